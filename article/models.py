@@ -1,12 +1,13 @@
 import logging
 import mimetypes
 import os
+from contextlib import contextmanager
 from datetime import datetime
 from tempfile import TemporaryDirectory
 from zipfile import ZipFile
 
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.db import models
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
@@ -441,6 +442,9 @@ class ArticlePackages(CommonControlField):
 
     @property
     def subdirs(self):
+        if not self.article:
+            # pacote criado na migração, antes do registro do artigo
+            return self.sps_pkg_name
         issn = (
             self.official_journal.issnl
             or self.official_journal.issn_electronic
@@ -506,13 +510,59 @@ class ArticlePackages(CommonControlField):
     def add_sps_package_file(self, filename, content, user):
         logging.info(f"ArticlePackages.add_sps_package_file: {filename}")
         self.not_optimised_zip_file.save(filename, ContentFile(content))
-        self._create_optimised_sps_package()
+        previous_optimised_name = self._create_optimised_sps_package()
         self.updated = datetime.utcnow()
         self.updated_by = user
         self.save()
+        self._delete_previous_file(self.optimised_zip_file, previous_optimised_name)
+
+    @contextmanager
+    def sps_package_zip_file(self, filename, user):
+        """
+        Cria o zip do pacote não otimizado diretamente no storage e,
+        ao final, cria o pacote otimizado a partir do mesmo arquivo,
+        sem manter o conteúdo do zip em memória
+
+        with article_pkgs.sps_package_zip_file(filename, user) as zf:
+            zf.write(...)
+        """
+        logging.info(f"ArticlePackages.sps_package_zip_file: {filename}")
+        field_file = self.not_optimised_zip_file
+        # o zip anterior só é removido depois que o novo foi criado e salvo
+        previous_name = field_file.name
+        storage = field_file.storage
+        name = storage.get_available_name(
+            field_file.field.generate_filename(self, filename)
+        )
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with ZipFile(path, "w") as zf:
+                yield zf
+        except Exception:
+            if os.path.isfile(path):
+                os.unlink(path)
+            raise
+        field_file.name = name
+        previous_optimised_name = self._create_optimised_sps_package()
+        self.updated = datetime.utcnow()
+        self.updated_by = user
+        self.save()
+        self._delete_previous_file(field_file, previous_name)
+        self._delete_previous_file(self.optimised_zip_file, previous_optimised_name)
+
+    @staticmethod
+    def _delete_previous_file(field_file, previous_name):
+        if previous_name and previous_name != field_file.name:
+            field_file.storage.delete(previous_name)
 
     def _create_optimised_sps_package(self):
+        """
+        Cria o pacote otimizado sem remover o anterior, cujo nome é
+        retornado para ser removido após o registro ser salvo
+        """
         logging.info(f"ArticlePackages._create_optimised_sps_package {self.article}")
+        previous_name = self.optimised_zip_file.name
         try:
             with TemporaryDirectory() as targetdir:
                 logging.info(f"Cria diretorio destino {targetdir}")
@@ -533,7 +583,7 @@ class ArticlePackages(CommonControlField):
                 with open(target, "rb") as fp:
                     logging.info(f"Save optimised package {optimised_zip_sps_name}")
                     self.optimised_zip_file.save(
-                        optimised_zip_sps_name, ContentFile(fp.read())
+                        optimised_zip_sps_name, File(fp), save=False
                     )
         except Exception as e:
             raise exceptions.BuildAndAddOptimisedSPSPackageError(
@@ -541,6 +591,7 @@ class ArticlePackages(CommonControlField):
                     self.article
                 )
             )
+        return previous_name
 
     def get_xml_with_pre(self):
         for xml_with_pre in XMLWithPre.create(path=self.optimised_zip_file.path):
@@ -7,6 +7,8 @@ from django.utils.translation import gettext_lazy as _
 from article.controller import request_pid_v3_and_create_article
 from article.models import Article, ArticlePackages
 from config import celery_app
+from migration.choices import DOC_STAGE_PID_REQUESTED
+from migration.models import MigratedDocument
 
 from . import controller
 
@@ -68,13 +70,18 @@ def task_request_pid_v3_and_create_article(
             user,
             collection,
         )
-        if response["xml_changed"]:
+        if response.get("xml_changed"):
             article_pkgs.update_xml(xml_with_pre)
         # cria / obtém article
         logging.info(f"Cria / obtém article para {xml_name}")
         article_pkgs.article = response["article"]
         article_pkgs.save()
 
+        # registra a etapa concluída do documento migrado
+        MigratedDocument.objects.filter(
+            sps_pkg_name=article_pkgs.sps_pkg_name,
+        ).update(stage=DOC_STAGE_PID_REQUESTED)
+
     except Exception as e:
         # TODO registra falha e deixa acessível na área restrita
         logging.exception(e)
@@ -380,3 +380,57 @@ NOCAPTCHA = True
 
 RECAPTCHA_PUBLIC_KEY = env.str("RECAPTCHA_PUBLIC_KEY", default="")
 RECAPTCHA_PRIVATE_KEY = env.str("RECAPTCHA_PRIVATE_KEY", default="")
+
+# PID Provider
+# ------------------------------------------------------------------------------
+# segundos antes da expiração do token em que ele é renovado
+PID_PROVIDER_TOKEN_REFRESH_MARGIN = env.int("PID_PROVIDER_TOKEN_REFRESH_MARGIN", 30)
+# validade assumida para tokens sem o claim exp
+PID_PROVIDER_TOKEN_DEFAULT_TTL = env.int("PID_PROVIDER_TOKEN_DEFAULT_TTL", 60)
+# compartilha o token entre os workers por meio do cache do Django (Redis)
+PID_PROVIDER_TOKEN_USE_DJANGO_CACHE = env.bool(
+    "PID_PROVIDER_TOKEN_USE_DJANGO_CACHE", False
+)
+# conexões HTTP mantidas (keep-alive) com o pid provider
+PID_PROVIDER_POOL_CONNECTIONS = env.int("PID_PROVIDER_POOL_CONNECTIONS", 10)
+PID_PROVIDER_POOL_MAXSIZE = env.int("PID_PROVIDER_POOL_MAXSIZE", 10)
+PID_PROVIDER_POOL_BLOCK = env.bool("PID_PROVIDER_POOL_BLOCK", False)
+# quantidade de PIDs v2/v3 reservados de uma vez por processo
+PID_PROVIDER_PID_BLOCK_SIZE = env.int("PID_PROVIDER_PID_BLOCK_SIZE", 100)
+# segundos após os quais as reservas de PIDs não usadas são removidas
+PID_PROVIDER_PID_RESERVATION_MAX_AGE = env.int(
+    "PID_PROVIDER_PID_RESERVATION_MAX_AGE", 7 * 24 * 60 * 60
+)
+# quantidade de XMLWithPre de XMLVersion mantidos em memória por processo
+XMLSPS_XML_WITH_PRE_CACHE_SIZE = env.int("XMLSPS_XML_WITH_PRE_CACHE_SIZE", 128)
+
+# Migration
+# ------------------------------------------------------------------------------
+# quantidade de registros de TITLE / ISSUE por tarefa no modo fan-out
+MIGRATION_JOURNAL_RECORDS_CHUNK_SIZE = env.int(
+    "MIGRATION_JOURNAL_RECORDS_CHUNK_SIZE", 20
+)
+MIGRATION_ISSUE_RECORDS_CHUNK_SIZE = env.int("MIGRATION_ISSUE_RECORDS_CHUNK_SIZE", 50)
+# cria hard links (em vez de cópias) dos arquivos do site clássico no MEDIA_ROOT
+MIGRATION_HARD_LINK_FILES = env.bool("MIGRATION_HARD_LINK_FILES", False)
+# quantidade de MigratedFile gravados por bulk_create / bulk_update
+MIGRATION_MIGRATED_FILE_BATCH_SIZE = env.int("MIGRATION_MIGRATED_FILE_BATCH_SIZE", 500)
+# processos usados para gerar XML a partir dos HTML de um fascículo (0: sem pool)
+MIGRATION_HTML_TO_XML_PROCESSES = env.int("MIGRATION_HTML_TO_XML_PROCESSES", 0)
+# quantidade de falhas de migração distintas acumuladas antes de serem gravadas
+MIGRATION_FAILURE_BUFFER_SIZE = env.int("MIGRATION_FAILURE_BUFFER_SIZE", 500)
+
+# Upload
+# ------------------------------------------------------------------------------
+# quantidade de ValidationResult gravados por bulk_create
+UPLOAD_VALIDATION_RESULT_BATCH_SIZE = env.int(
+    "UPLOAD_VALIDATION_RESULT_BATCH_SIZE", 500
+)
+# critérios usados por packtools.validator.ValidationReportXML na validação do conteúdo
+UPLOAD_VALIDATION_CRITERIA_FILE = env.str(
+    "UPLOAD_VALIDATION_CRITERIA_FILE", "validation_criteria_example.json"
+)
+# segundos sem acesso após os quais o conteúdo extraído de um pacote é removido
+UPLOAD_WORKSPACE_MAX_AGE = env.int("UPLOAD_WORKSPACE_MAX_AGE", 24 * 60 * 60)
+# soma máxima (bytes) do conteúdo extraído dos pacotes; 0: sem limite
+UPLOAD_WORKSPACE_MAX_SIZE = env.int("UPLOAD_WORKSPACE_MAX_SIZE", 0)
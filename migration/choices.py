@@ -16,3 +16,16 @@ MIGRATION_STATUS = (
     (MS_IMPORTED, _("Imported")),
     (MS_PUBLISHED, _("Published")),
 )
+
+# etapas concluídas da migração de um documento
+DOC_STAGE_IMPORTED = "imported"
+DOC_STAGE_XML_GENERATED = "xml_generated"
+DOC_STAGE_PACKAGE_BUILT = "package_built"
+DOC_STAGE_PID_REQUESTED = "pid_requested"
+
+DOC_MIGRATION_STAGES = (
+    (DOC_STAGE_IMPORTED, _("Imported")),
+    (DOC_STAGE_XML_GENERATED, _("XML generated")),
+    (DOC_STAGE_PACKAGE_BUILT, _("Package built")),
+    (DOC_STAGE_PID_REQUESTED, _("PID requested")),
+)
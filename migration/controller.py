@@ -1,11 +1,17 @@
 import json
 import logging
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from tempfile import TemporaryDirectory
-from zipfile import ZipFile
+from itertools import islice
 
+import django
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connections
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from packtools.sps.models.article_assets import ArticleAssets
@@ -21,7 +27,14 @@ from journal.models import Journal, OfficialJournal, SciELOJournal
 from scielo_classic_website import classic_ws
 
 from . import exceptions
-from .choices import MS_IMPORTED, MS_PUBLISHED, MS_TO_IGNORE
+from .choices import (
+    DOC_STAGE_PACKAGE_BUILT,
+    DOC_STAGE_PID_REQUESTED,
+    DOC_STAGE_XML_GENERATED,
+    MS_IMPORTED,
+    MS_PUBLISHED,
+    MS_TO_IGNORE,
+)
 from .models import (
     BodyAndBackFile,
     ClassicWebsiteConfiguration,
@@ -31,10 +44,28 @@ from .models import (
     MigratedIssue,
     MigratedJournal,
     MigrationFailure,
+    MigrationFailureRecorder,
+    MigrationHighWaterMark,
 )
 
 User = get_user_model()
 
+# quantidade de registros de TITLE / ISSUE processados por tarefa no modo fan-out
+JOURNAL_RECORDS_CHUNK_SIZE = getattr(
+    settings, "MIGRATION_JOURNAL_RECORDS_CHUNK_SIZE", 20
+)
+ISSUE_RECORDS_CHUNK_SIZE = getattr(settings, "MIGRATION_ISSUE_RECORDS_CHUNK_SIZE", 50)
+
+# processos usados para gerar XML a partir dos HTML de um fascículo (0: sem pool)
+HTML_TO_XML_PROCESSES = getattr(settings, "MIGRATION_HTML_TO_XML_PROCESSES", 0)
+
+# campos ISIS com a data de atualização do registro, por base de dados
+ISIS_UPDATED_DATE_TAGS = {
+    "title": "v941",
+    "issue": "v91",
+    "artigo": "v91",
+}
+
 
 def schedule_migrations(user, collection_acron=None):
     if collection_acron:
@@ -174,37 +205,269 @@ def _schedule_run_migrations(user, collection_acron):
     )
 
 
+# instâncias de ClassicWebsite por coleção, mantidas por processo (worker)
+_classic_websites = {}
+_classic_websites_lock = threading.Lock()
+
+
 def get_classic_website(collection_acron):
+    """
+    Retorna a instância de ClassicWebsite da coleção, reutilizando a do
+    processo enquanto a configuração e as bases title / issue não mudam
+    """
     config = ClassicWebsiteConfiguration.objects.get(collection__acron=collection_acron)
-    return classic_ws.ClassicWebsite(
-        bases_path=os.path.dirname(config.bases_work_path),
-        bases_work_path=config.bases_work_path,
-        bases_translation_path=config.bases_translation_path,
-        bases_pdf_path=config.bases_pdf_path,
-        bases_xml_path=config.bases_xml_path,
-        htdocs_img_revistas_path=config.htdocs_img_revistas_path,
-        serial_path=config.serial_path,
-        cisis_path=config.cisis_path,
-        title_path=config.title_path,
-        issue_path=config.issue_path,
+    signature = _get_classic_website_signature(config)
+    with _classic_websites_lock:
+        item = _classic_websites.get(collection_acron)
+        if item and item[0] == signature:
+            return item[1]
+
+    classic_website = CachedClassicWebsite(
+        classic_ws.ClassicWebsite(
+            bases_path=os.path.dirname(config.bases_work_path),
+            bases_work_path=config.bases_work_path,
+            bases_translation_path=config.bases_translation_path,
+            bases_pdf_path=config.bases_pdf_path,
+            bases_xml_path=config.bases_xml_path,
+            htdocs_img_revistas_path=config.htdocs_img_revistas_path,
+            serial_path=config.serial_path,
+            cisis_path=config.cisis_path,
+            title_path=config.title_path,
+            issue_path=config.issue_path,
+        )
+    )
+    with _classic_websites_lock:
+        _classic_websites[collection_acron] = (signature, classic_website)
+    return classic_website
+
+
+def _get_classic_website_signature(config):
+    paths = (
+        config.title_path,
+        config.issue_path,
+        config.serial_path,
+        config.cisis_path,
+        config.bases_work_path,
+        config.bases_pdf_path,
+        config.bases_translation_path,
+        config.bases_xml_path,
+        config.htdocs_img_revistas_path,
     )
+    mtimes = []
+    for path in (config.title_path, config.issue_path):
+        # title_path / issue_path podem ser informados sem extensão
+        for name in (path, f"{path}.mst", f"{path}.id"):
+            try:
+                mtimes.append(os.stat(name).st_mtime)
+            except (OSError, TypeError, ValueError):
+                mtimes.append(None)
+    return paths + tuple(mtimes)
+
+
+class CachedClassicWebsite:
+    """
+    Delega para ClassicWebsite, guardando os registros das bases
+    title e issue obtidos na primeira leitura
+    """
+
+    def __init__(self, classic_website):
+        self.classic_website = classic_website
+        self._journals_pids_and_records = None
+        self._issues_pids_and_records = None
+
+    def __getattr__(self, name):
+        return getattr(self.classic_website, name)
+
+    def get_journals_pids_and_records(self):
+        if self._journals_pids_and_records is None:
+            self._journals_pids_and_records = list(
+                self.classic_website.get_journals_pids_and_records()
+            )
+        return iter(self._journals_pids_and_records)
+
+    def get_issues_pids_and_records(self):
+        if self._issues_pids_and_records is None:
+            self._issues_pids_and_records = list(
+                self.classic_website.get_issues_pids_and_records()
+            )
+        return iter(self._issues_pids_and_records)
 
 
 def migrate_journal_records(
     user,
     collection_acron,
     force_update=False,
+    incremental=False,
+):
+    records = get_journal_records(
+        collection_acron, incremental=incremental and not force_update
+    )
+    stats = migrate_journal_records_chunk(user, collection_acron, records, force_update)
+    stats["skipped"] = records.skipped
+    MigrationHighWaterMark.update(
+        collection_acron, "title", stats["isis_updated_date"], creator=user
+    )
+    return stats
+
+
+def migrate_journal_records_chunk(
+    user,
+    collection_acron,
+    records,
+    force_update=False,
 ):
+    """
+    Migra um conjunto de registros da base TITLE
+
+    Parameters
+    ----------
+    records : iterable of (scielo_issn, journal_data)
+
+    Returns
+    -------
+        dict (total, migrated, failed, isis_updated_date)
+    """
     collection = Collection.get_or_create(collection_acron)
-    classic_website = get_classic_website(collection.acron)
-    for scielo_issn, journal_data in classic_website.get_journals_pids_and_records():
-        migrated_journal = import_data_from_title_database(
-            user,
-            collection,
-            scielo_issn,
-            journal_data[0],
-            force_update,
-        )
+    stats = {"total": 0, "migrated": 0, "failed": 0, "isis_updated_date": None}
+    # falhas gravadas em lote ao final
+    failures = MigrationFailureRecorder(collection_acron, user)
+    try:
+        for scielo_issn, journal_data in records:
+            stats["total"] += 1
+            migrated_journal = import_data_from_title_database(
+                user,
+                collection,
+                scielo_issn,
+                journal_data,
+                force_update=force_update,
+                failures=failures,
+            )
+            if not migrated_journal:
+                stats["failed"] += 1
+                continue
+            stats["migrated"] += 1
+            _update_max_isis_updated_date(
+                stats, get_isis_updated_date(journal_data, "title")
+            )
+    finally:
+        failures.flush()
+    return stats
+
+
+def get_journal_records(collection_acron, incremental=False):
+    """
+    Obtém os registros da base TITLE
+
+    Se incremental, omite os registros cuja data de atualização não mudou
+    desde a última migração, antes de instanciar classic_ws.Journal
+
+    Returns
+    -------
+        IncrementalRecords of (scielo_issn, journal_data)
+    """
+    classic_website = get_classic_website(collection_acron)
+    records = (
+        (scielo_issn, journal_data[0])
+        for scielo_issn, journal_data in classic_website.get_journals_pids_and_records()
+    )
+    return IncrementalRecords(
+        records,
+        "title",
+        incremental and MigratedJournal.isis_updated_dates(collection_acron),
+        incremental and MigrationHighWaterMark.get_value(collection_acron, "title"),
+    )
+
+
+def get_journal_records_chunks(collection_acron, chunk_size=None, incremental=False):
+    """
+    Divide os registros da base TITLE em partes serializáveis,
+    para serem distribuídas entre os workers
+
+    Returns
+    -------
+        generator of list of (scielo_issn, journal_data)
+    """
+    records = get_journal_records(collection_acron, incremental)
+    yield from _chunks(records, chunk_size or JOURNAL_RECORDS_CHUNK_SIZE)
+    logging.info(f"get_journal_records_chunks: skipped {records.skipped}")
+
+
+def _chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def get_isis_updated_date(records, database):
+    """
+    Obtém a data de atualização diretamente do(s) registro(s) ISIS,
+    sem instanciar classic_ws.Journal / Issue / Document
+
+    Returns
+    -------
+        str (YYYYMMDD) or None
+    """
+    tag = ISIS_UPDATED_DATE_TAGS[database]
+    if isinstance(records, dict):
+        records = [records]
+    dates = []
+    for record in records:
+        value = record.get(tag)
+        if isinstance(value, list):
+            value = value and value[0]
+        if isinstance(value, dict):
+            value = value.get("_")
+        if value:
+            dates.append(str(value)[:8])
+    return max(dates) if dates else None
+
+
+def _update_max_isis_updated_date(stats, isis_updated_date):
+    if isis_updated_date and (
+        not stats["isis_updated_date"] or isis_updated_date > stats["isis_updated_date"]
+    ):
+        stats["isis_updated_date"] = isis_updated_date
+
+
+class IncrementalRecords:
+    """
+    Itera sobre pares (key, record(s)) de uma base ISIS omitindo,
+    no modo incremental, os registros já migrados cuja data de
+    atualização não é mais recente que a registrada
+    """
+
+    def __init__(
+        self, records, database, isis_updated_dates=None, high_water_mark=None
+    ):
+        self.records = records
+        self.database = database
+        # {key: isis_updated_date}; None ou {} desabilita o filtro
+        self.isis_updated_dates = isis_updated_dates
+        # maior data de atualização já migrada (MigrationHighWaterMark):
+        # registros mais recentes mudaram e não precisam ser comparados
+        self.high_water_mark = high_water_mark
+        self.skipped = 0
+
+    def is_unchanged(self, key, records):
+        if not self.isis_updated_dates:
+            return False
+        current = get_isis_updated_date(records, self.database)
+        if not current:
+            return False
+        if self.high_water_mark and current > self.high_water_mark:
+            return False
+        stored = self.isis_updated_dates.get(key)
+        return bool(stored) and current <= stored
+
+    def __iter__(self):
+        for key, records in self.records:
+            if self.is_unchanged(key, records):
+                self.skipped += 1
+                continue
+            yield key, records
 
 
 def import_data_from_title_database(
@@ -212,11 +475,14 @@ def import_data_from_title_database(
     collection,
     scielo_issn,
     journal_data,
-    classic_website_journal,
+    classic_website_journal=None,
     force_update=False,
+    failures=None,
 ):
     """
     Create/update JournalMigration
+
+    failures : MigrationFailureRecorder; se None, grava a falha imediatamente
     """
     try:
         # obtém classic website journal
@@ -267,43 +533,169 @@ def import_data_from_title_database(
         message = _("Unable to migrate journal {} {}").format(
             collection.acron, scielo_issn
         )
-        MigrationFailure.create(
+        _register_failure(
+            failures,
+            e,
             collection_acron=collection.acron,
             migrated_item_name="journal",
             migrated_item_id=scielo_issn,
             message=message,
             action_name="migrate",
-            e=e,
             creator=user,
         )
 
 
+def _register_failure(
+    failures,
+    e,
+    collection_acron,
+    migrated_item_name,
+    migrated_item_id,
+    message,
+    action_name,
+    creator,
+):
+    if failures is not None:
+        failures.add(
+            e,
+            migrated_item_name=migrated_item_name,
+            migrated_item_id=migrated_item_id,
+            message=message,
+            action_name=action_name,
+        )
+        return
+    MigrationFailure.create(
+        collection_acron=collection_acron,
+        migrated_item_name=migrated_item_name,
+        migrated_item_id=migrated_item_id,
+        message=message,
+        action_name=action_name,
+        e=e,
+        creator=creator,
+    )
+
+
 def migrate_issue_records_and_files(
     user,
     collection_acron,
     force_update=False,
+    incremental=False,
 ):
     """
     Migra os registros dos fascículos e arquivos dos artigos dos fascículos
     """
-    collection = Collection.get_or_create(acron=collection_acron)
-    classic_website = get_classic_website(collection_acron)
-    for issue_pid, issue_data in classic_website.get_issues_pids_and_records():
-        migrated_issue = import_data_from_issue_database(
-            user=user,
-            collection=collection,
-            scielo_issn=issue_pid[:9],
-            issue_pid=issue_pid,
-            issue_data=issue_data[0],
+    records = get_issue_records(
+        collection_acron, incremental=incremental and not force_update
+    )
+    stats = migrate_issue_records_chunk(user, collection_acron, records, force_update)
+    stats["skipped"] = records.skipped
+    MigrationHighWaterMark.update(
+        collection_acron, "issue", stats["isis_updated_date"], creator=user
+    )
+    for migrated_issue in MigratedIssue.objects.filter(
+        id__in=stats.pop("migrated_issue_ids")
+    ).iterator():
+        migrate_one_issue_files(
+            user,
+            migrated_issue,
+            collection_acron,
             force_update=force_update,
         )
-        if migrated_issue:
-            migrate_one_issue_files(
-                user,
-                migrated_issue,
-                collection_acron,
+    return stats
+
+
+def migrate_issue_records_chunk(
+    user,
+    collection_acron,
+    records,
+    force_update=False,
+):
+    """
+    Migra um conjunto de registros da base ISSUE
+
+    Parameters
+    ----------
+    records : iterable of (issue_pid, issue_data)
+
+    Returns
+    -------
+        dict (total, migrated, failed, isis_updated_date, migrated_issue_ids)
+    """
+    collection = Collection.get_or_create(acron=collection_acron)
+    stats = {
+        "total": 0,
+        "migrated": 0,
+        "failed": 0,
+        "isis_updated_date": None,
+        "migrated_issue_ids": [],
+    }
+    # falhas gravadas em lote ao final
+    failures = MigrationFailureRecorder(collection_acron, user)
+    try:
+        for issue_pid, issue_data in records:
+            stats["total"] += 1
+            migrated_issue = import_data_from_issue_database(
+                user=user,
+                collection=collection,
+                scielo_issn=issue_pid[:9],
+                issue_pid=issue_pid,
+                issue_data=issue_data,
                 force_update=force_update,
+                failures=failures,
             )
+            if not migrated_issue:
+                stats["failed"] += 1
+                continue
+            stats["migrated"] += 1
+            stats["migrated_issue_ids"].append(migrated_issue.id)
+            _update_max_isis_updated_date(
+                stats, get_isis_updated_date(issue_data, "issue")
+            )
+    finally:
+        failures.flush()
+    return stats
+
+
+def get_issue_records(collection_acron, incremental=False):
+    """
+    Obtém os registros da base ISSUE
+
+    Se incremental, omite os registros cuja data de atualização não mudou
+    desde a última migração, antes de instanciar classic_ws.Issue
+
+    Returns
+    -------
+        IncrementalRecords of (issue_pid, issue_data)
+    """
+    classic_website = get_classic_website(collection_acron)
+    records = (
+        (issue_pid, issue_data[0])
+        for issue_pid, issue_data in classic_website.get_issues_pids_and_records()
+    )
+    return IncrementalRecords(
+        records,
+        "issue",
+        incremental and MigratedIssue.isis_updated_dates(collection_acron),
+        incremental and MigrationHighWaterMark.get_value(collection_acron, "issue"),
+    )
+
+
+def get_issue_records_chunks(collection_acron, chunk_size=None, incremental=False):
+    """
+    Agrupa os registros da base ISSUE por periódico e divide cada grupo
+    em partes serializáveis, para serem distribuídas entre os workers
+
+    Returns
+    -------
+        generator of list of (issue_pid, issue_data)
+    """
+    records = get_issue_records(collection_acron, incremental)
+    records_by_journal = {}
+    for issue_pid, issue_data in records:
+        records_by_journal.setdefault(issue_pid[:9], []).append((issue_pid, issue_data))
+    logging.info(f"get_issue_records_chunks: skipped {records.skipped}")
+    for records in records_by_journal.values():
+        yield from _chunks(records, chunk_size or ISSUE_RECORDS_CHUNK_SIZE)
 
 
 def import_data_from_issue_database(
@@ -313,9 +705,12 @@ def import_data_from_issue_database(
     issue_pid,
     issue_data,
     force_update=False,
+    failures=None,
 ):
     """
     Create/update IssueMigration
+
+    failures : MigrationFailureRecorder; se None, grava a falha imediatamente
     """
     try:
         logging.info(
@@ -360,28 +755,42 @@ def import_data_from_issue_database(
     except Exception as e:
         logging.exception(e)
         message = _("Unable to migrate issue {} {}").format(collection.acron, issue_pid)
-        MigrationFailure.create(
+        _register_failure(
+            failures,
+            e,
             collection_acron=collection.acron,
             migrated_item_name="issue",
             migrated_item_id=issue_pid,
             message=message,
             action_name="migrate",
-            e=e,
             creator=user,
         )
 
 
 class IssueMigration:
-    def __init__(self, user, collection_acron, migrated_issue, force_update):
+    def __init__(
+        self, user, collection_acron, migrated_issue, force_update, incremental=False
+    ):
         self.classic_website = get_classic_website(collection_acron)
         self.collection_acron = collection_acron
         self.force_update = force_update
+        self.incremental = incremental and not force_update
         self.issue_folder = migrated_issue.issue_folder
         self.issue_pid = migrated_issue.issue_pid
         self.migrated_issue = migrated_issue
         self.migrated_journal = migrated_issue.migrated_journal
         self.journal_acron = self.migrated_journal.acron
         self.user = user
+        self._file_index = None
+        # falhas gravadas em lote em flush_failures()
+        self.failures = MigrationFailureRecorder(collection_acron, user)
+
+    @property
+    def file_index(self):
+        # carregado após import_issue_files e compartilhado pelos documentos
+        if self._file_index is None:
+            self._file_index = MigratedFileIndex(self.migrated_issue)
+        return self._file_index
 
     def _get_classic_website_rel_path(self, file_path):
         if "htdocs" in file_path:
@@ -417,6 +826,7 @@ class IssueMigration:
             self.journal_acron,
             self.issue_folder,
         )
+        items = []
         for file in classic_issue_files:
             """
             {"type": "pdf", "key": name, "path": path, "name": basename, "lang": lang}
@@ -424,17 +834,20 @@ class IssueMigration:
             {"type": "html", "key": name, "path": path, "name": basename, "lang": lang, "part": label}
             {"type": "asset", "path": item, "name": os.path.basename(item)}
             """
+            logging.info(file)
             try:
-                logging.info(file)
-                migrated_file = MigratedFile.create_or_update(
-                    migrated_issue=self.migrated_issue,
-                    original_path=self._get_classic_website_rel_path(file["path"]),
-                    source_path=file["path"],
-                    category=self.check_category(file),
-                    lang=file.get("lang"),
-                    part=file.get("part"),
-                    pkg_name=file.get("key"),
-                    creator=self.user,
+                items.append(
+                    {
+                        "original_path": self._get_classic_website_rel_path(
+                            file["path"]
+                        ),
+                        "source_path": file["path"],
+                        "category": self.check_category(file),
+                        "lang": file.get("lang"),
+                        "part": file.get("part"),
+                        "pkg_name": file.get("key"),
+                        "file": file,
+                    }
                 )
             except Exception as e:
                 message = _("Unable to migrate issue files {} {}").format(
@@ -448,11 +861,48 @@ class IssueMigration:
                     action_name="migrate",
                 )
 
-    def migrate_document_records(self):
+        try:
+            stats = MigratedFile.bulk_create_or_update(
+                self.migrated_issue, items, creator=self.user
+            )
+        except Exception as e:
+            message = _("Unable to migrate issue files {} {}").format(
+                self.collection_acron, self.migrated_issue
+            )
+            self.register_failure(
+                e,
+                migrated_item_name="issue files",
+                migrated_item_id=str(self.migrated_issue),
+                message=message,
+                action_name="migrate",
+            )
+            return {"total": len(items), "migrated": 0, "failed": len(items)}
+
+        errors = stats.pop("errors")
+        stats["failed"] = len(errors)
+        for item, e in errors:
+            message = _("Unable to migrate issue files {} {}").format(
+                self.collection_acron, item["file"]
+            )
+            self.register_failure(
+                e,
+                migrated_item_name="issue files",
+                migrated_item_id=item["file"],
+                message=message,
+                action_name="migrate",
+            )
+        stats["migrated"] = stats["created"] + stats["updated"] + stats["unchanged"]
+        self._file_index = None
+        return stats
+
+    def migrate_document_records(self, html_processes=None):
         """
         Importa os registros presentes na base de dados `source_file_path`
         Importa os arquivos dos documentos (xml, pdf, html, imagens)
         Publica os artigos no site
+
+        Se html_processes, a geração de XML a partir dos HTML é executada
+        em um pool de processos
         """
         journal_issue_and_doc_data = {
             "title": self.migrated_journal.data,
@@ -469,56 +919,166 @@ class IssueMigration:
         # do fascículo de migrated_issue
         # possivelmente source_file pode conter registros de outros fascículos
         # se a fonte for `bases-work/acron/acron`
-        for doc_id, doc_records in self.classic_website.get_documents_pids_and_records(
-            self.journal_acron,
-            self.issue_folder,
-            self.issue_pid,
-        ):
-            try:
-                logging.info(_("Get {}").format(doc_id))
-                if len(doc_records) == 1:
-                    # é possível que em source_file_path exista registro tipo i
-                    journal_issue_and_doc_data["issue"] = doc_records[0]
-                    continue
-
-                journal_issue_and_doc_data["article"] = doc_records
-                classic_ws_doc = classic_ws.Document(journal_issue_and_doc_data)
-
-                migrated_document = self.migrate_document(
-                    classic_ws_doc=classic_ws_doc,
-                    journal_issue_and_doc_data=journal_issue_and_doc_data,
-                )
-                document_migration = DocumentMigration(migrated_document, self.user)
-                document_migration.generate_xml_from_html(classic_ws_doc)
-                document_migration.build_sps_package()
+        records = IncrementalRecords(
+            self.classic_website.get_documents_pids_and_records(
+                self.journal_acron,
+                self.issue_folder,
+                self.issue_pid,
+            ),
+            "artigo",
+            self.incremental
+            and MigratedDocument.isis_updated_dates(self.migrated_issue),
+            self.incremental
+            and MigrationHighWaterMark.get_value(self.collection_acron, "artigo"),
+        )
+        html_processes = (
+            HTML_TO_XML_PROCESSES if html_processes is None else html_processes
+        )
+        # etapas concluídas em execuções anteriores
+        stages = (
+            {} if self.force_update else MigratedDocument.stages(self.migrated_issue)
+        )
+        stats = {
+            "total": 0,
+            "migrated": 0,
+            "completed": 0,
+            "failed": 0,
+            "isis_updated_date": None,
+        }
+        pending = []
+        with get_html_to_xml_executor(html_processes) as executor:
+            for doc_id, doc_records in records:
+                try:
+                    logging.info(_("Get {}").format(doc_id))
+                    if len(doc_records) == 1:
+                        # é possível que em source_file_path exista registro tipo i
+                        journal_issue_and_doc_data["issue"] = doc_records[0]
+                        continue
+
+                    stats["total"] += 1
+                    stage = self._get_completed_stage(stages, doc_id, doc_records)
+                    if stage in (DOC_STAGE_PACKAGE_BUILT, DOC_STAGE_PID_REQUESTED):
+                        # documento já migrado
+                        stats["completed"] += 1
+                        continue
+
+                    journal_issue_and_doc_data["article"] = doc_records
+                    classic_ws_doc = classic_ws.Document(journal_issue_and_doc_data)
+
+                    migrated_document = self.migrate_document(
+                        classic_ws_doc=classic_ws_doc,
+                        journal_issue_and_doc_data=journal_issue_and_doc_data,
+                    )
+                    document_migration = DocumentMigration(
+                        migrated_document, self.user, self.file_index, self.failures
+                    )
+                    if stage == DOC_STAGE_XML_GENERATED:
+                        # retoma a partir da criação do pacote
+                        self._build_sps_package(
+                            doc_id, doc_records, document_migration, stats
+                        )
+                        continue
+
+                    if executor:
+                        html_texts = migrated_document.html_texts
+                        future = html_texts and executor.submit(
+                            generate_xmls_from_html,
+                            dict(journal_issue_and_doc_data),
+                            classic_ws_doc.scielo_pid_v2,
+                            html_texts,
+                        )
+                        pending.append(
+                            (doc_id, doc_records, document_migration, future)
+                        )
+                        continue
+
+                    if document_migration.generate_xml_from_html(classic_ws_doc):
+                        migrated_document.set_stage(DOC_STAGE_XML_GENERATED)
+                    self._build_sps_package(
+                        doc_id, doc_records, document_migration, stats
+                    )
+                except Exception as e:
+                    self._register_document_failure(e, doc_id)
+                    stats["failed"] += 1
 
-            except Exception as e:
-                message = _("Unable to migrate documents {} {} {} {}").format(
-                    self.collection_acron, self.journal_acron, self.issue_folder, doc_id
-                )
-                self.register_failure(
-                    e,
-                    migrated_item_name="document",
-                    migrated_item_id=doc_id,
-                    message=message,
-                    action_name="migrate",
-                )
+            # grava os XML gerados nos processos e cria os pacotes
+            for doc_id, doc_records, document_migration, future in pending:
+                try:
+                    generated = True
+                    if future:
+                        try:
+                            versions = future.result()
+                        except exceptions.GenerateBodyAndBackFromHTMLError as e:
+                            document_migration.register_body_and_back_failure(e)
+                            generated = False
+                        else:
+                            generated = document_migration.save_generated_xmls(versions)
+                    if generated:
+                        document_migration.migrated_document.set_stage(
+                            DOC_STAGE_XML_GENERATED
+                        )
+                    self._build_sps_package(
+                        doc_id, doc_records, document_migration, stats
+                    )
+                except Exception as e:
+                    self._register_document_failure(e, doc_id)
+                    stats["failed"] += 1
+        stats["skipped"] = records.skipped
+        return stats
+
+    def _get_completed_stage(self, stages, doc_id, doc_records):
+        """
+        Retorna a etapa concluída em execução anterior, se o registro
+        do documento não mudou desde então
+        """
+        try:
+            isis_updated_date, stage = stages[doc_id]
+        except KeyError:
+            return None
+        current = get_isis_updated_date(doc_records, "artigo")
+        if current and isis_updated_date and current <= isis_updated_date:
+            return stage
+
+    def _build_sps_package(self, doc_id, doc_records, document_migration, stats):
+        if not document_migration.build_sps_package():
+            # a falha já foi registrada; o documento não avança a marca de
+            # atualização, para ser migrado novamente na próxima execução
+            stats["failed"] += 1
+            return
+        document_migration.migrated_document.set_stage(DOC_STAGE_PACKAGE_BUILT)
+        stats["migrated"] += 1
+        _update_max_isis_updated_date(
+            stats, get_isis_updated_date(doc_records, "artigo")
+        )
+
+    def _register_document_failure(self, e, doc_id):
+        message = _("Unable to migrate documents {} {} {} {}").format(
+            self.collection_acron, self.journal_acron, self.issue_folder, doc_id
+        )
+        self.register_failure(
+            e,
+            migrated_item_name="document",
+            migrated_item_id=doc_id,
+            message=message,
+            action_name="migrate",
+        )
 
     def register_failure(
         self, e, migrated_item_name, migrated_item_id, message, action_name
     ):
         logging.info(message)
         logging.exception(e)
-        MigrationFailure.create(
-            collection_acron=self.collection_acron,
+        self.failures.add(
+            e,
             migrated_item_name=migrated_item_name,
             migrated_item_id=migrated_item_id,
             message=message,
             action_name=action_name,
-            e=e,
-            creator=self.user,
         )
 
+    def flush_failures(self):
+        self.failures.flush()
+
     def migrate_document(self, classic_ws_doc, journal_issue_and_doc_data):
         try:
             # instancia Document com registros de title, issue e artigo
@@ -568,7 +1128,10 @@ def migrate_one_issue_files(
     # dos metadados, e geração de XML, pois
     # há casos que os HTML mencionam arquivos de pastas diferentes
     # da sua pasta do fascículo
-    migration.import_issue_files()
+    try:
+        return migration.import_issue_files()
+    finally:
+        migration.flush_failures()
 
 
 def migrate_one_issue_document_records(
@@ -576,12 +1139,23 @@ def migrate_one_issue_document_records(
     migrated_issue,
     collection_acron,
     force_update=False,
+    incremental=False,
+    html_processes=None,
 ):
     logging.info(migrated_issue)
-    migration = IssueMigration(user, collection_acron, migrated_issue, force_update)
+    migration = IssueMigration(
+        user, collection_acron, migrated_issue, force_update, incremental
+    )
     # migra os documentos da base de dados `source_file_path`
     # que não contém necessariamente os dados de só 1 fascículo
-    migration.migrate_document_records()
+    try:
+        stats = migration.migrate_document_records(html_processes)
+    finally:
+        migration.flush_failures()
+    MigrationHighWaterMark.update(
+        collection_acron, "artigo", stats["isis_updated_date"], creator=user
+    )
+    return stats
 
 
 def _get_xml(path):
@@ -589,12 +1163,71 @@ def _get_xml(path):
         return item
 
 
+class MigratedFileIndex:
+    """
+    Índice em memória dos MigratedFile de um fascículo,
+    carregado com uma única consulta e compartilhado pelos
+    DocumentMigration do fascículo
+    """
+
+    def __init__(self, migrated_issue):
+        self.by_name = {}
+        self.by_stem = {}
+        self.renditions = {}
+        for item in (
+            MigratedFile.objects.filter(migrated_issue=migrated_issue)
+            .select_related("lang")
+            .order_by("pk")
+            .iterator()
+        ):
+            if item.original_name:
+                self.by_name.setdefault(item.original_name, item)
+                # indexado por cada prefixo terminado em ".", equivalente a
+                # original_name__startswith=stem + "." (a.thumb.jpg: a, a.thumb)
+                parts = item.original_name.split(".")
+                for i in range(1, len(parts)):
+                    self.by_stem.setdefault(".".join(parts[:i]), []).append(item)
+            if item.category == "rendition":
+                self.renditions.setdefault(item.pkg_name, []).append(item)
+
+    def get(self, name):
+        """
+        Obtém o arquivo pelo nome exato
+
+        Raises
+        ------
+            MigratedFile.DoesNotExist
+        """
+        try:
+            return self.by_name[name]
+        except KeyError:
+            raise MigratedFile.DoesNotExist(name)
+
+    def get_alternative(self, name):
+        """
+        Obtém o arquivo pelo nome sem extensão ou
+        pelo nome com outra extensão
+        """
+        stem, ext = os.path.splitext(name)
+        if stem in self.by_name:
+            return self.by_name[stem]
+        alternatives = self.by_stem.get(stem)
+        if alternatives:
+            return alternatives[0]
+
+    def get_renditions(self, pkg_name):
+        return self.renditions.get(pkg_name) or []
+
+
 class DocumentMigration:
-    def __init__(self, migrated_document, user):
+    def __init__(self, migrated_document, user, file_index=None, failures=None):
         self.migrated_document = migrated_document
         self.migrated_issue = migrated_document.migrated_issue
         self.collection_acron = self.migrated_issue.migrated_journal.collection.acron
         self.user = user
+        self._file_index = file_index
+        # MigrationFailureRecorder compartilhado; se None, grava cada falha
+        self.failures = failures
         self.pid = migrated_document.pid
         self._xml_name = None
         self._xml_with_pre = None
@@ -606,16 +1239,23 @@ class DocumentMigration:
     ):
         logging.info(message)
         logging.exception(e)
-        MigrationFailure.create(
+        _register_failure(
+            self.failures,
+            e,
             collection_acron=self.collection_acron,
             migrated_item_name=migrated_item_name,
             migrated_item_id=migrated_item_id,
             message=message,
             action_name=action_name,
-            e=e,
             creator=self.user,
         )
 
+    @property
+    def file_index(self):
+        if self._file_index is None:
+            self._file_index = MigratedFileIndex(self.migrated_issue)
+        return self._file_index
+
     @property
     def xml_name(self):
         if not self._xml_name:
@@ -693,34 +1333,26 @@ class DocumentMigration:
         logging.info(f"Build SPS Package {self.migrated_document}")
         try:
             # gera nome de pacote padrão SPS ISSN-ACRON-VOL-NUM-SUPPL-ARTICLE
-            with TemporaryDirectory() as tmpdirname:
-                logging.info("TemporaryDirectory %s" % tmpdirname)
-                tmp_sps_pkg_zip_path = os.path.join(
-                    tmpdirname, f"{self.sps_pkg_name}.zip"
-                )
-
-                self.article_pkgs = ArticlePackages.get_or_create(
-                    sps_pkg_name=self.sps_pkg_name,
-                )
-                with ZipFile(tmp_sps_pkg_zip_path, "w") as zf:
-                    # adiciona XML em zip
-                    self._build_sps_package_add_xml(zf)
-
-                    # add renditions (pdf) to zip
-                    self._build_sps_package_add_renditions(zf)
-
-                    # A partir do XML, obtém os nomes dos arquivos dos ativos digitais
-                    assets = ArticleAssets(self.xml_with_pre.xmltree)
-                    self._build_sps_package_replace_asset_href(assets)
-                    self._build_sps_package_add_assets(zf, assets.article_assets)
-
-                with open(tmp_sps_pkg_zip_path, "rb") as fp:
-                    # guarda o pacote compactado
-                    self.article_pkgs.add_sps_package_file(
-                        filename=self.sps_pkg_name + ".zip",
-                        content=fp.read(),
-                        user=self.user,
-                    )
+            self.article_pkgs = ArticlePackages.get_or_create(
+                sps_pkg_name=self.sps_pkg_name,
+                creator=self.user,
+            )
+            # grava o zip diretamente no storage
+            with self.article_pkgs.sps_package_zip_file(
+                filename=self.sps_pkg_name + ".zip",
+                user=self.user,
+            ) as zf:
+                # adiciona XML em zip
+                self._build_sps_package_add_xml(zf)
+
+                # add renditions (pdf) to zip
+                self._build_sps_package_add_renditions(zf)
+
+                # A partir do XML, obtém os nomes dos arquivos dos ativos digitais
+                assets = ArticleAssets(self.xml_with_pre.xmltree)
+                self._build_sps_package_replace_asset_href(assets)
+                self._build_sps_package_add_assets(zf, assets.article_assets)
+            return True
         except Exception as e:
             message = _("Unable to build sps package {} {}").format(
                 self.collection_acron, self.pid
@@ -732,6 +1364,7 @@ class DocumentMigration:
                 message=message,
                 action_name="build-sps-package",
             )
+            return False
 
     def _build_sps_package_add_xml(self, zf):
         try:
@@ -756,10 +1389,8 @@ class DocumentMigration:
 
     def _build_sps_package_add_renditions(self, zf):
         # grava renditions (pdf) em zip
-        for rendition_file in MigratedFile.objects.filter(
-            migrated_issue=self.migrated_issue,
-            pkg_name=self.migrated_document.pkg_name,
-            category="rendition",
+        for rendition_file in self.file_index.get_renditions(
+            self.migrated_document.pkg_name
         ):
             try:
                 logging.info(f"Add rendition {rendition_file.original_path}")
@@ -792,34 +1423,17 @@ class DocumentMigration:
     def _build_sps_package_replace_asset_href(self, sps_article_assets):
         alternatives = {}
         for xml_graphic in sps_article_assets.article_assets:
-            try:
-                asset_file = MigratedFile.get(
-                    migrated_issue=self.migrated_issue,
-                    original_name=xml_graphic.name,
-                )
-            except MigratedFile.DoesNotExist as e:
-                name, ext = os.path.splitext(xml_graphic.name)
-                try:
-                    alternative = MigratedFile.get(
-                        migrated_issue=self.migrated_issue,
-                        original_name=name,
-                    )
-                except MigratedFile.DoesNotExist as e:
-                    alternative = MigratedFile.objects.filter(
-                        migrated_issue=self.migrated_issue,
-                        original_name__startswith=name + ".",
-                    ).first()
-                if alternative:
-                    alternatives[xml_graphic.name] = alternative.original_name
+            if xml_graphic.name in self.file_index.by_name:
+                continue
+            alternative = self.file_index.get_alternative(xml_graphic.name)
+            if alternative:
+                alternatives[xml_graphic.name] = alternative.original_name
         sps_article_assets.replace_names(alternatives)
 
     def _build_sps_package_add_assets(self, zf, article_assets):
         for xml_graphic in article_assets:
             try:
-                asset_file = MigratedFile.get(
-                    migrated_issue=self.migrated_issue,
-                    original_name=xml_graphic.name,
-                )
+                asset_file = self.file_index.get(xml_graphic.name)
             except MigratedFile.DoesNotExist as e:
                 message = _("Unable to _build_sps_package_add_assets {} {} {}").format(
                     self.collection_acron, self.sps_pkg_name, xml_graphic.name
@@ -865,30 +1479,50 @@ class DocumentMigration:
             )
 
     def generate_xml_from_html(self, classic_ws_doc):
+        """
+        Returns
+        -------
+            bool : True se não há HTML ou se todos os XML foram gerados
+        """
         html_texts = self.migrated_document.html_texts
         if not html_texts:
-            return
-
-        pkg_name = self.migrated_document.pkg_name
+            return True
 
         try:
-            # obtém um XML com body e back a partir dos arquivos HTML / traduções
-            classic_ws_doc.generate_body_and_back_from_html(html_texts)
+            versions = _generate_xmls_from_html(classic_ws_doc, html_texts)
         except Exception as e:
-            migrated_item_id = f"{self.collection_acron} {self.pid}"
-            message = _("Unable to generate body and back from HTML {}").format(
-                migrated_item_id
-            )
-            self.register_failure(
-                e,
-                migrated_item_name="document",
-                migrated_item_id=migrated_item_id,
-                message=message,
-                action_name="xml-body-and-back",
-            )
-            return
+            self.register_body_and_back_failure(e)
+            return False
+        return self.save_generated_xmls(versions)
+
+    def register_body_and_back_failure(self, e):
+        migrated_item_id = f"{self.collection_acron} {self.pid}"
+        message = _("Unable to generate body and back from HTML {}").format(
+            migrated_item_id
+        )
+        self.register_failure(
+            e,
+            migrated_item_name="document",
+            migrated_item_id=migrated_item_id,
+            message=message,
+            action_name="xml-body-and-back",
+        )
+
+    def save_generated_xmls(self, versions):
+        """
+        Guarda as versões de body/back e de XML gerados a partir dos HTML
+
+        Parameters
+        ----------
+        versions : list of (xml_body_and_back, xml_content, error)
 
-        for i, xml_body_and_back in enumerate(classic_ws_doc.xml_body_and_back):
+        Returns
+        -------
+            bool : True se todas as versões foram guardadas
+        """
+        pkg_name = self.migrated_document.pkg_name
+        saved = True
+        for i, (xml_body_and_back, xml_content, error) in enumerate(versions):
             try:
                 # para cada versão de body/back, guarda a versão de body/back
                 migrated_file = BodyAndBackFile.create_or_update(
@@ -898,8 +1532,9 @@ class DocumentMigration:
                     file_content=xml_body_and_back,
                     version=i,
                 )
+                if error:
+                    raise error
                 # para cada versão de body/back, guarda uma versão de XML
-                xml_content = classic_ws_doc.generate_full_xml(xml_body_and_back)
                 migrated_file = GeneratedXMLFile.create_or_update(
                     migrated_issue=self.migrated_issue,
                     pkg_name=pkg_name,
@@ -919,3 +1554,73 @@ class DocumentMigration:
                     message=message,
                     action_name="xml-to-html",
                 )
+                saved = False
+        return saved
+
+
+def _generate_xmls_from_html(classic_ws_doc, html_texts):
+    """
+    Gera as versões de body/back e de XML completo a partir dos HTML
+
+    Returns
+    -------
+        list of (xml_body_and_back, xml_content, error)
+    """
+    # obtém um XML com body e back a partir dos arquivos HTML / traduções
+    classic_ws_doc.generate_body_and_back_from_html(html_texts)
+
+    versions = []
+    for xml_body_and_back in classic_ws_doc.xml_body_and_back:
+        try:
+            xml_content = classic_ws_doc.generate_full_xml(xml_body_and_back)
+            versions.append((xml_body_and_back, xml_content, None))
+        except Exception as e:
+            versions.append((xml_body_and_back, None, e))
+    return versions
+
+
+def get_html_to_xml_executor(processes):
+    """
+    Retorna o pool de processos em que os XML são gerados a partir dos HTML
+    ou nullcontext(), para gerá-los no próprio processo, se processes é 0
+    ou se o processo corrente é daemon, pois não pode ter processos filhos
+    """
+    if not processes:
+        return nullcontext()
+    # os processos do pool prefork do Celery são criados pelo billiard e
+    # não impedem ProcessPoolExecutor; só um processo daemon do
+    # multiprocessing não pode ter processos filhos
+    if multiprocessing.current_process().daemon:
+        logging.info(
+            "Generating XML from HTML serially: daemon processes cannot have children"
+        )
+        return nullcontext()
+    # "spawn": os processos filhos não herdam (por fork) as conexões
+    # abertas com o banco de dados, que também são fechadas aqui
+    connections.close_all()
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )
+
+
+def generate_xmls_from_html(journal_issue_and_doc_data, pid, html_texts):
+    """
+    Executada no pool de processos: não acessa o banco de dados e
+    converte as exceções em tipos que podem ser serializados (pickle)
+    """
+    try:
+        classic_ws_doc = classic_ws.Document(journal_issue_and_doc_data)
+        classic_ws_doc.scielo_pid_v2 = pid
+        versions = _generate_xmls_from_html(classic_ws_doc, html_texts)
+    except Exception as e:
+        raise exceptions.GenerateBodyAndBackFromHTMLError(f"{type(e)} {e}")
+    return [
+        (
+            xml_body_and_back,
+            xml_content,
+            error and exceptions.GenerateXMLFromHTMLError(f"{type(error)} {error}"),
+        )
+        for xml_body_and_back, xml_content, error in versions
+    ]
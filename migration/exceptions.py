@@ -32,3 +32,11 @@ class CreateOrUpdateGeneratedXMLFileError(Exception):
 
 class MigratedXMLFileNotFoundError(Exception):
     ...
+
+
+class GenerateBodyAndBackFromHTMLError(Exception):
+    ...
+
+
+class GenerateXMLFromHTMLError(Exception):
+    ...
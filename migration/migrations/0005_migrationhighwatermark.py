@@ -0,0 +1,90 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "collection",
+            "0006_alter_collection_creator_alter_collection_updated_by_and_more",
+        ),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("migration", "0004_alter_bodyandbackfile_creator_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MigrationHighWaterMark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Creation date"
+                    ),
+                ),
+                (
+                    "updated",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="Last update date"
+                    ),
+                ),
+                ("database", models.CharField(max_length=10, verbose_name="Database")),
+                (
+                    "isis_updated_date",
+                    models.CharField(
+                        blank=True,
+                        max_length=8,
+                        null=True,
+                        verbose_name="ISIS updated date",
+                    ),
+                ),
+                (
+                    "collection",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="collection.collection",
+                    ),
+                ),
+                (
+                    "creator",
+                    models.ForeignKey(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_creator",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Creator",
+                    ),
+                ),
+                (
+                    "updated_by",
+                    models.ForeignKey(
+                        blank=True,
+                        editable=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_last_mod_user",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Updater",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("collection", "database")},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migration", "0005_migrationhighwatermark"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="migratedfile",
+            name="file_hash",
+            field=models.CharField(
+                blank=True, max_length=40, null=True, verbose_name="File hash"
+            ),
+        ),
+        migrations.AddField(
+            model_name="migratedfile",
+            name="file_mtime",
+            field=models.FloatField(blank=True, null=True, verbose_name="File mtime"),
+        ),
+        migrations.AddField(
+            model_name="migratedfile",
+            name="file_size",
+            field=models.BigIntegerField(
+                blank=True, null=True, verbose_name="File size"
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migration", "0006_migratedfile_file_hash_migratedfile_file_mtime_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="migrateddocument",
+            name="stage",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("imported", "Imported"),
+                    ("xml_generated", "XML generated"),
+                    ("package_built", "Package built"),
+                    ("pid_requested", "PID requested"),
+                ],
+                max_length=16,
+                null=True,
+                verbose_name="Stage",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="migrateddocument",
+            index=models.Index(fields=["stage"], name="migration_m_stage_210557_idx"),
+        ),
+    ]
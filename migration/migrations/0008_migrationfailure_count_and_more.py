@@ -0,0 +1,38 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migration", "0007_migrateddocument_stage_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="migrationfailure",
+            name="count",
+            field=models.IntegerField(default=1, verbose_name="Count"),
+        ),
+        migrations.AddField(
+            model_name="migrationfailure",
+            name="first_occurrence",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="First occurrence"
+            ),
+        ),
+        migrations.AddField(
+            model_name="migrationfailure",
+            name="last_occurrence",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Last occurrence"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="migrationfailure",
+            index=models.Index(
+                fields=["migrated_item_id"], name="migration_m_migrate_1206b1_idx"
+            ),
+        ),
+    ]
@@ -1,9 +1,12 @@
+import hashlib
 import logging
 import os
 from datetime import datetime
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.base import ContentFile, File
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
 from article.models import Article, CollectionArticleId
@@ -158,6 +161,10 @@ class MigratedData(CommonControlField):
         ]
 
 
+# quantidade de falhas distintas acumuladas antes de serem gravadas
+MIGRATION_FAILURE_BUFFER_SIZE = getattr(settings, "MIGRATION_FAILURE_BUFFER_SIZE", 500)
+
+
 class MigrationFailure(CommonControlField):
     action_name = models.TextField(_("Action"), null=True, blank=True)
     message = models.TextField(_("Message"), null=True, blank=True)
@@ -167,12 +174,28 @@ class MigrationFailure(CommonControlField):
     exception_msg = models.TextField(_("Exception Msg"), null=True, blank=True)
     collection_acron = models.TextField(_("Collection acron"), null=True, blank=True)
     traceback = models.JSONField(null=True, blank=True)
+    # ocorrências agrupadas por (action_name, item, exception_type)
+    count = models.IntegerField(_("Count"), default=1)
+    first_occurrence = models.DateTimeField(
+        _("First occurrence"), null=True, blank=True
+    )
+    last_occurrence = models.DateTimeField(_("Last occurrence"), null=True, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=["action_name"]),
+            models.Index(fields=["migrated_item_id"]),
         ]
 
+    @property
+    def key(self):
+        return (
+            self.action_name,
+            self.migrated_item_name,
+            self.migrated_item_id,
+            self.exception_type,
+        )
+
     @classmethod
     def create(
         cls,
@@ -194,10 +217,171 @@ class MigrationFailure(CommonControlField):
         obj.exception_msg = str(e)
         obj.exception_type = str(type(e))
         obj.creator = creator
+        obj.first_occurrence = obj.last_occurrence = datetime.utcnow()
         obj.save()
         return obj
 
 
+class MigrationFailureRecorder:
+    """
+    Acumula as falhas de uma tarefa de migração agrupando-as por
+    (action_name, item, exception_type) e as grava em lote em flush()
+    """
+
+    def __init__(self, collection_acron, creator, max_size=None):
+        self.collection_acron = collection_acron
+        self.creator = creator
+        self.max_size = max_size or MIGRATION_FAILURE_BUFFER_SIZE
+        self.items = {}
+
+    def add(
+        self,
+        e,
+        migrated_item_name=None,
+        migrated_item_id=None,
+        message=None,
+        action_name=None,
+    ):
+        now = datetime.utcnow()
+        obj = MigrationFailure(
+            collection_acron=self.collection_acron,
+            action_name=action_name,
+            migrated_item_name=migrated_item_name,
+            migrated_item_id=migrated_item_id and str(migrated_item_id),
+            message=message,
+            exception_msg=str(e),
+            exception_type=str(type(e)),
+            creator=self.creator,
+            first_occurrence=now,
+            last_occurrence=now,
+        )
+        registered = self.items.get(obj.key)
+        if registered:
+            registered.count += 1
+            registered.last_occurrence = now
+            registered.message = message
+            registered.exception_msg = obj.exception_msg
+        else:
+            self.items[obj.key] = obj
+            if len(self.items) >= self.max_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Grava as falhas acumuladas, somando as ocorrências às das
+        falhas já registradas com a mesma chave
+        """
+        if not self.items:
+            return
+        items = self.items
+        self.items = {}
+
+        # migrated_item_id__in não encontra os registros com migrated_item_id nulo
+        migrated_item_ids = {key[2] for key in items}
+        query = Q(migrated_item_id__in=migrated_item_ids - {None})
+        if None in migrated_item_ids:
+            query |= Q(migrated_item_id__isnull=True)
+
+        to_update = []
+        for registered in MigrationFailure.objects.filter(
+            query, collection_acron=self.collection_acron
+        ).iterator():
+            obj = items.pop(registered.key, None)
+            if not obj:
+                continue
+            registered.count += obj.count
+            registered.last_occurrence = obj.last_occurrence
+            registered.message = obj.message
+            registered.exception_msg = obj.exception_msg
+            registered.updated_by = self.creator
+            registered.updated = datetime.utcnow()
+            to_update.append(registered)
+
+        MigrationFailure.objects.bulk_update(
+            to_update,
+            [
+                "count",
+                "last_occurrence",
+                "message",
+                "exception_msg",
+                "updated_by",
+                "updated",
+            ],
+            batch_size=MIGRATION_FAILURE_BUFFER_SIZE,
+        )
+        MigrationFailure.objects.bulk_create(
+            items.values(), batch_size=MIGRATION_FAILURE_BUFFER_SIZE
+        )
+
+
+class MigrationHighWaterMark(CommonControlField):
+    """
+    Maior data de atualização (ISIS) dos registros migrados,
+    por coleção e base de dados (title, issue, artigo)
+    """
+
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, null=True, blank=True
+    )
+    database = models.CharField(_("Database"), max_length=10)
+    isis_updated_date = models.CharField(
+        _("ISIS updated date"), max_length=8, null=True, blank=True
+    )
+
+    class Meta:
+        unique_together = [["collection", "database"]]
+
+    def __str__(self):
+        return f"{self.collection} {self.database} {self.isis_updated_date}"
+
+    @classmethod
+    def get_value(cls, collection_acron, database):
+        try:
+            return cls.objects.get(
+                collection__acron=collection_acron, database=database
+            ).isis_updated_date
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def update(cls, collection_acron, database, isis_updated_date, creator=None):
+        """
+        Avança a marca somente se isis_updated_date for mais recente
+        """
+        if not isis_updated_date:
+            return
+        try:
+            obj = cls.objects.get(collection__acron=collection_acron, database=database)
+            if obj.isis_updated_date and obj.isis_updated_date >= isis_updated_date:
+                return obj
+            obj.updated_by = creator
+        except cls.DoesNotExist:
+            obj = cls()
+            obj.collection = Collection.get_or_create(collection_acron)
+            obj.database = database
+            obj.creator = creator
+        obj.isis_updated_date = isis_updated_date
+        obj.save()
+        return obj
+
+
+# quantidade de MigratedFile gravados por bulk_create / bulk_update
+MIGRATED_FILE_BATCH_SIZE = getattr(settings, "MIGRATION_MIGRATED_FILE_BATCH_SIZE", 500)
+# tamanho dos blocos lidos ao calcular o hash / copiar os arquivos migrados
+FILE_CHUNK_SIZE = 1024 * 1024
+# cria hard link em vez de copiar, se a origem e o MEDIA_ROOT
+# estiverem no mesmo sistema de arquivos
+HARD_LINK_MIGRATED_FILES = getattr(settings, "MIGRATION_HARD_LINK_FILES", False)
+
+
+def get_file_hash(path):
+    _sum = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(FILE_CHUNK_SIZE), b""):
+            _sum.update(chunk)
+    return _sum.hexdigest()
+
+
 def migrated_files_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/user_<id>/<filename>
     return f"migrated_files/{instance.migrated_issue.issue_pid}/{filename}"
@@ -229,6 +413,10 @@ class MigratedFile(CommonControlField):
     )
     lang = models.ForeignKey(Language, null=True, blank=True, on_delete=models.SET_NULL)
     part = models.CharField(_("Part"), max_length=6, null=True, blank=True)
+    # dados do arquivo de origem na última importação
+    file_hash = models.CharField(_("File hash"), max_length=40, null=True, blank=True)
+    file_size = models.BigIntegerField(_("File size"), null=True, blank=True)
+    file_mtime = models.FloatField(_("File mtime"), null=True, blank=True)
 
     class Meta:
         indexes = [
@@ -258,6 +446,75 @@ class MigratedFile(CommonControlField):
         logging.info(self.file.path)
         logging.info(os.path.isfile(self.file.path))
 
+    def import_source_file(self, name, source_path):
+        """
+        Importa o arquivo de origem sem carregá-lo inteiro em memória,
+        omitindo a cópia se tamanho e mtime ou hash não mudaram. O arquivo
+        substituído só é removido por delete_replaced_files(), depois que
+        o registro for gravado
+
+        Returns
+        -------
+            bool : False se o arquivo não mudou desde a última importação
+        """
+        stat = os.stat(source_path)
+        file_hash = None
+        if (
+            self.file
+            and self.file_size == stat.st_size
+            and self.file.storage.exists(self.file.name)
+        ):
+            if self.file_mtime == stat.st_mtime:
+                logging.info(f"Unchanged {source_path}")
+                return False
+            file_hash = get_file_hash(source_path)
+            if self.file_hash == file_hash:
+                logging.info(f"Unchanged {source_path}")
+                self.file_mtime = stat.st_mtime
+                return False
+
+        logging.info(f"Save {name}")
+        previous_name = self.file.name
+        if not (HARD_LINK_MIGRATED_FILES and self._link_source_file(name, source_path)):
+            with open(source_path, "rb") as fp:
+                self.file.save(name, File(fp), save=False)
+        if previous_name and previous_name != self.file.name:
+            self.replaced_file_names.append(previous_name)
+        self.file_hash = file_hash or get_file_hash(source_path)
+        self.file_size = stat.st_size
+        self.file_mtime = stat.st_mtime
+        return True
+
+    @property
+    def replaced_file_names(self):
+        try:
+            return self._replaced_file_names
+        except AttributeError:
+            self._replaced_file_names = []
+            return self._replaced_file_names
+
+    def delete_replaced_files(self):
+        """
+        Remove os arquivos substituídos por import_source_file;
+        deve ser chamado após o registro ser gravado
+        """
+        for name in self.replaced_file_names:
+            self.file.storage.delete(name)
+        self.replaced_file_names.clear()
+
+    def _link_source_file(self, name, source_path):
+        storage = self.file.storage
+        name = storage.get_available_name(self.file.field.generate_filename(self, name))
+        try:
+            path = storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.link(source_path, path)
+        except (NotImplementedError, OSError) as e:
+            logging.info(f"Unable to link {source_path}: {type(e)} {e}")
+            return False
+        self.file.name = name
+        return True
+
     @classmethod
     def get(
         cls,
@@ -299,6 +556,112 @@ class MigratedFile(CommonControlField):
                 sps_pkg_name=sps_pkg_name,
             )
 
+    @classmethod
+    def bulk_create_or_update(
+        cls, migrated_issue, items, creator=None, batch_size=None
+    ):
+        """
+        Cria / atualiza os MigratedFile de um fascículo em lote
+
+        Parameters
+        ----------
+        items : iterable of dict
+            original_path, source_path, category, lang, part, pkg_name
+
+        Returns
+        -------
+            dict (total, created, updated, unchanged, errors)
+            errors : list of (item, exception)
+        """
+        batch_size = batch_size or MIGRATED_FILE_BATCH_SIZE
+        # lang é comparado com o valor novo; evita uma consulta por registro
+        registered_files = cls.objects.filter(
+            migrated_issue=migrated_issue
+        ).select_related("lang")
+        registered = {obj.original_path: obj for obj in registered_files.iterator()}
+        languages = {}
+
+        collection_acron = migrated_issue.migrated_journal.collection.acron
+        journal_acron = migrated_issue.migrated_journal.acron
+        prefix = f"{collection_acron}_{journal_acron}_{migrated_issue.issue_folder}"
+
+        to_create = {}
+        to_update = {}
+        stats = {"total": 0, "created": 0, "updated": 0, "unchanged": 0, "errors": []}
+        for item in items:
+            stats["total"] += 1
+            original_path = item["original_path"]
+            try:
+                lang = item.get("lang")
+                if lang and lang not in languages:
+                    languages[lang] = Language.get_or_create(
+                        code2=lang, creator=creator
+                    )
+                values = {
+                    "original_path": original_path,
+                    "original_name": original_path and os.path.basename(original_path),
+                    "original_href": cls.get_original_href(original_path),
+                    "pkg_name": item.get("pkg_name"),
+                    "category": item.get("category"),
+                    "lang": lang and languages[lang],
+                    "part": item.get("part"),
+                }
+                obj = registered.get(original_path)
+                is_new = obj is None
+                if is_new:
+                    obj = cls(migrated_issue=migrated_issue, creator=creator)
+                    changed = True
+                else:
+                    changed = any(
+                        getattr(obj, name) != value for name, value in values.items()
+                    )
+                for name, value in values.items():
+                    setattr(obj, name, value)
+
+                # import_source_file pode atualizar somente file_mtime
+                file_mtime = obj.file_mtime
+                file_name = f"{prefix}_{os.path.basename(original_path)}"
+                if obj.import_source_file(file_name, item["source_path"]):
+                    changed = True
+                changed = changed or obj.file_mtime != file_mtime
+
+                registered[original_path] = obj
+                if is_new or original_path in to_create:
+                    to_create[original_path] = obj
+                elif changed:
+                    obj.updated_by = creator
+                    obj.updated = datetime.utcnow()
+                    to_update[original_path] = obj
+                else:
+                    stats["unchanged"] += 1
+            except Exception as e:
+                stats["errors"].append((item, e))
+
+        cls.objects.bulk_create(to_create.values(), batch_size=batch_size)
+        cls.objects.bulk_update(
+            to_update.values(),
+            [
+                "original_name",
+                "original_href",
+                "pkg_name",
+                "category",
+                "lang",
+                "part",
+                "file",
+                "file_hash",
+                "file_size",
+                "file_mtime",
+                "updated",
+                "updated_by",
+            ],
+            batch_size=batch_size,
+        )
+        for obj in list(to_create.values()) + list(to_update.values()):
+            obj.delete_replaced_files()
+        stats["created"] = len(to_create)
+        stats["updated"] = len(to_update)
+        return stats
+
     @classmethod
     def create_or_update(
         cls,
@@ -345,7 +708,6 @@ class MigratedFile(CommonControlField):
             obj.category = category
             obj.lang = lang and Language.get_or_create(code2=lang, creator=creator)
             obj.part = part
-            obj.save()
 
             # cria / atualiza arquivo
             collection_acron = migrated_issue.migrated_journal.collection.acron
@@ -357,11 +719,12 @@ class MigratedFile(CommonControlField):
                 or f"{collection_acron}_{journal_acron}_{issue_folder}_{basename}"
             )
             if source_path:
-                with open(source_path, "rb") as fp:
-                    file_content = fp.read()
-            if file_content:
-                obj.save_file(file_name, file_content)
-                obj.save()
+                obj.import_source_file(file_name, source_path)
+            elif file_content:
+                obj.file.save(file_name, ContentFile(file_content), save=False)
+                obj.file_hash = obj.file_size = obj.file_mtime = None
+            obj.save()
+            obj.delete_replaced_files()
             logging.info("Created {}".format(obj))
             return obj
         except Exception as e:
@@ -443,6 +806,18 @@ class MigratedJournal(MigratedData):
                 )
             )
 
+    @classmethod
+    def isis_updated_dates(cls, collection_acron):
+        """
+        Retorna, em uma única consulta, {scielo_issn: isis_updated_date}
+        dos periódicos migrados da coleção
+        """
+        return dict(
+            cls.objects.filter(
+                scielo_journal__collection__acron=collection_acron,
+            ).values_list("scielo_journal__scielo_issn", "isis_updated_date")
+        )
+
     @classmethod
     def journals(cls, collection_acron, status):
         return cls.objects.filter(
@@ -495,6 +870,18 @@ class MigratedIssue(MigratedData):
     def publication_year(self):
         return self.scielo_issue.official_issue.publication_year
 
+    @classmethod
+    def isis_updated_dates(cls, collection_acron):
+        """
+        Retorna, em uma única consulta, {issue_pid: isis_updated_date}
+        dos fascículos migrados da coleção
+        """
+        return dict(
+            cls.objects.filter(
+                migrated_journal__scielo_journal__collection__acron=collection_acron,
+            ).values_list("scielo_issue__issue_pid", "isis_updated_date")
+        )
+
     @classmethod
     def create_or_update(
         cls,
@@ -552,6 +939,14 @@ class MigratedDocument(MigratedData):
     pid = models.TextField(_("Package name"), null=True, blank=True)
     pkg_name = models.TextField(_("Package name"), null=True, blank=True)
     sps_pkg_name = models.TextField(_("New Package name"), null=True, blank=True)
+    # última etapa concluída da migração do documento
+    stage = models.CharField(
+        _("Stage"),
+        max_length=16,
+        choices=choices.DOC_MIGRATION_STAGES,
+        null=True,
+        blank=True,
+    )
 
     def __unicode__(self):
         return "%s %s %s" % (self.migrated_issue, self.pkg_name, self.pid)
@@ -564,6 +959,7 @@ class MigratedDocument(MigratedData):
             models.Index(fields=["migrated_issue"]),
             models.Index(fields=["pid"]),
             models.Index(fields=["pkg_name"]),
+            models.Index(fields=["stage"]),
         ]
 
     def add_aids(
@@ -577,6 +973,41 @@ class MigratedDocument(MigratedData):
             creator=creator,
         )
 
+    def set_stage(self, stage):
+        self.stage = stage
+        self.save(update_fields=["stage", "updated"])
+
+    @classmethod
+    def stages(cls, migrated_issue):
+        """
+        Retorna, em uma única consulta, {pid: (isis_updated_date, stage)}
+        dos documentos do fascículo que têm alguma etapa concluída
+        """
+        return {
+            pid: (isis_updated_date, stage)
+            for pid, isis_updated_date, stage in cls.objects.filter(
+                migrated_issue=migrated_issue,
+                stage__isnull=False,
+            ).values_list("pid", "isis_updated_date", "stage")
+        }
+
+    @classmethod
+    def isis_updated_dates(cls, migrated_issue):
+        """
+        Retorna, em uma única consulta, {pid: isis_updated_date}
+        dos documentos migrados do fascículo cujo pacote foi criado;
+        os demais não são omitidos na migração incremental
+        """
+        return dict(
+            cls.objects.filter(
+                migrated_issue=migrated_issue,
+                stage__in=(
+                    choices.DOC_STAGE_PACKAGE_BUILT,
+                    choices.DOC_STAGE_PID_REQUESTED,
+                ),
+            ).values_list("pid", "isis_updated_date")
+        )
+
     @classmethod
     def get(cls, migrated_issue, pid=None, pkg_name=None):
         if pid:
@@ -640,6 +1071,8 @@ class MigratedDocument(MigratedData):
                 obj.article = article or obj.article
                 obj.sps_pkg_name = sps_pkg_name or obj.sps_pkg_name
                 obj.data = data or obj.data
+                # registro novo ou alterado: reinicia as etapas
+                obj.stage = choices.DOC_STAGE_IMPORTED
 
                 if pid or pid_v3 or aop_pid:
                     obj.add_aids(
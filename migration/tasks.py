@@ -1,9 +1,13 @@
+import logging
+import time
+
+from celery import chord
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
 from config import celery_app
-from migration.models import MigratedIssue
+from migration.models import MigratedIssue, MigrationHighWaterMark
 
 from . import controller
 from .choices import MS_IMPORTED, MS_PUBLISHED, MS_TO_IGNORE
@@ -34,11 +38,57 @@ def task_migrate_journal_records(
     username,
     collection_acron,
     force_update=False,
+    fan_out=False,
+    chunk_size=None,
+    incremental=False,
+):
+    user = _get_user(self.request, username)
+    incremental = incremental and not force_update
+    if fan_out:
+        # distribui os registros da base TITLE entre os workers
+        header = [
+            task_migrate_journal_records_chunk.s(
+                username=username,
+                collection_acron=collection_acron,
+                records=records,
+                force_update=force_update,
+            )
+            for records in controller.get_journal_records_chunks(
+                collection_acron, chunk_size, incremental
+            )
+        ]
+        if header:
+            chord(header)(
+                task_report_migration.s(
+                    action_name="migrate_journal_records",
+                    collection_acron=collection_acron,
+                    started=time.time(),
+                    username=username,
+                    database="title",
+                )
+            )
+        return
+    return controller.migrate_journal_records(
+        user,
+        collection_acron,
+        force_update,
+        incremental,
+    )
+
+
+@celery_app.task(bind=True, name="migrate_journal_records_chunk")
+def task_migrate_journal_records_chunk(
+    self,
+    username,
+    collection_acron,
+    records,
+    force_update=False,
 ):
     user = _get_user(self.request, username)
-    controller.migrate_journal_records(
+    return controller.migrate_journal_records_chunk(
         user,
         collection_acron,
+        records,
         force_update,
     )
 
@@ -49,15 +99,147 @@ def task_migrate_issue_records_and_files(
     username,
     collection_acron,
     force_update=False,
+    fan_out=False,
+    chunk_size=None,
+    incremental=False,
+):
+    user = _get_user(self.request, username)
+    incremental = incremental and not force_update
+    if fan_out:
+        # distribui os registros da base ISSUE, agrupados por periódico,
+        # entre os workers; ao final, distribui a migração dos arquivos
+        # de cada fascículo migrado
+        header = [
+            task_migrate_issue_records_chunk.s(
+                username=username,
+                collection_acron=collection_acron,
+                records=records,
+                force_update=force_update,
+            )
+            for records in controller.get_issue_records_chunks(
+                collection_acron, chunk_size, incremental
+            )
+        ]
+        if header:
+            chord(header)(
+                task_migrate_issue_files_fan_out.s(
+                    username=username,
+                    collection_acron=collection_acron,
+                    force_update=force_update,
+                    started=time.time(),
+                )
+            )
+        return
+    return controller.migrate_issue_records_and_files(
+        user,
+        collection_acron,
+        force_update,
+        incremental,
+    )
+
+
+@celery_app.task(bind=True, name="migrate_issue_records_chunk")
+def task_migrate_issue_records_chunk(
+    self,
+    username,
+    collection_acron,
+    records,
+    force_update=False,
 ):
     user = _get_user(self.request, username)
-    controller.migrate_issue_records_and_files(
+    return controller.migrate_issue_records_chunk(
         user,
         collection_acron,
+        records,
         force_update,
     )
 
 
+@celery_app.task(bind=True, name="migrate_issue_files_fan_out")
+def task_migrate_issue_files_fan_out(
+    self,
+    results,
+    username,
+    collection_acron,
+    force_update=False,
+    started=None,
+):
+    migrated_issue_ids = []
+    for item in results:
+        migrated_issue_ids.extend(item.pop("migrated_issue_ids"))
+    report = task_report_migration(
+        results,
+        action_name="migrate_issue_records",
+        collection_acron=collection_acron,
+        started=started,
+        username=username,
+        database="issue",
+    )
+
+    header = [
+        task_migrate_one_issue_files.s(
+            username=username,
+            migrated_issue_id=migrated_issue_id,
+            collection_acron=collection_acron,
+            force_update=force_update,
+        )
+        for migrated_issue_id in migrated_issue_ids
+    ]
+    if header:
+        chord(header)(
+            task_report_migration.s(
+                action_name="migrate_issue_files",
+                collection_acron=collection_acron,
+                started=time.time(),
+            )
+        )
+    return report
+
+
+@celery_app.task(bind=True, name="report_migration")
+def task_report_migration(
+    self,
+    results,
+    action_name,
+    collection_acron,
+    started=None,
+    username=None,
+    database=None,
+):
+    """
+    Totaliza os resultados das tarefas distribuídas entre os workers
+    e, se database, avança a marca de atualização da coleção
+    """
+    results = [item for item in results if item]
+    total = sum(item["total"] for item in results)
+    migrated = sum(item["migrated"] for item in results)
+    # falhas contadas pelas tarefas: registros sem alteração ou já
+    # migrados estão em total, mas não são falhas
+    failed = sum(item.get("failed", 0) for item in results)
+    if database:
+        isis_updated_date = max(
+            (item["isis_updated_date"] or "" for item in results), default=None
+        )
+        MigrationHighWaterMark.update(
+            collection_acron,
+            database,
+            isis_updated_date,
+            creator=_get_user(self.request, username),
+        )
+    elapsed = started and time.time() - started
+    report = {
+        "action_name": action_name,
+        "collection_acron": collection_acron,
+        "tasks": len(results),
+        "total": total,
+        "migrated": migrated,
+        "failed": failed,
+        "elapsed": elapsed,
+    }
+    logging.info(f"report_migration: {report}")
+    return report
+
+
 @celery_app.task(bind=True, name="migrate_set_of_issue_files")
 def task_migrate_set_of_issue_files(
     self,
@@ -100,7 +282,7 @@ def task_migrate_one_issue_files(
 ):
     user = _get_user(self.request, username)
     migrated_issue = MigratedIssue.objects.get(id=migrated_issue_id)
-    controller.migrate_one_issue_files(
+    return controller.migrate_one_issue_files(
         user,
         migrated_issue,
         collection_acron,
@@ -116,6 +298,8 @@ def task_migrate_set_of_issue_document_records(
     scielo_issn=None,
     publication_year=None,
     force_update=False,
+    incremental=False,
+    html_processes=None,
 ):
     user = _get_user(self.request, username)
 
@@ -136,6 +320,8 @@ def task_migrate_set_of_issue_document_records(
                 "migrated_issue_id": migrated_issue.id,
                 "collection_acron": collection_acron,
                 "force_update": force_update,
+                "incremental": incremental,
+                "html_processes": html_processes,
             }
         )
 
@@ -147,14 +333,18 @@ def task_migrate_one_issue_document_records(
     migrated_issue_id,
     collection_acron,
     force_update=False,
+    incremental=False,
+    html_processes=None,
 ):
     user = _get_user(self.request, username)
     migrated_issue = MigratedIssue.objects.get(id=migrated_issue_id)
-    controller.migrate_one_issue_document_records(
+    return controller.migrate_one_issue_document_records(
         user,
         migrated_issue,
         collection_acron,
         force_update,
+        incremental,
+        html_processes,
     )
 
 
@@ -164,6 +354,8 @@ def task_run_migrations(
     username=None,
     collection_acron=None,
     force_update=False,
+    fan_out=False,
+    incremental=False,
 ):
     user = _get_user(self.request, username)
     # migra os registros da base TITLE
@@ -172,6 +364,8 @@ def task_run_migrations(
             "username": username,
             "collection_acron": collection_acron,
             "force_update": force_update,
+            "fan_out": fan_out,
+            "incremental": incremental,
         }
     )
     # migra os registros da base ISSUE
@@ -181,6 +375,8 @@ def task_run_migrations(
             "username": username,
             "collection_acron": collection_acron,
             "force_update": force_update,
+            "fan_out": fan_out,
+            "incremental": incremental,
         }
     )
     # migra os registros das bases de artigos
@@ -191,5 +387,6 @@ def task_run_migrations(
             "username": username,
             "collection_acron": collection_acron,
             "force_update": force_update,
+            "incremental": incremental,
         }
     )
@@ -1,3 +1,396 @@
-from django.test import TestCase
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from collection.models import Collection
+from issue.models import SciELOIssue
+from journal.models import SciELOJournal
+from migration import controller, exceptions
+from migration.models import (
+    MigratedFile,
+    MigratedIssue,
+    MigratedJournal,
+    MigrationFailure,
+    MigrationFailureRecorder,
+)
+
+User = get_user_model()
+
+
+def _generate_xmls_from_html_outcome(call):
+    # resultado comparável da geração: os erros são comparados pela mensagem
+    try:
+        return [
+            (xml_body_and_back, xml_content, error and str(error))
+            for xml_body_and_back, xml_content, error in call()
+        ]
+    except exceptions.GenerateBodyAndBackFromHTMLError as e:
+        return str(e)
+
+
+class GetHtmlToXmlExecutorTest(SimpleTestCase):
+    def test_returns_nullcontext_if_processes_is_zero(self):
+        self.assertIsInstance(controller.get_html_to_xml_executor(0), nullcontext)
+
+    @patch("migration.controller.multiprocessing.current_process")
+    def test_returns_nullcontext_in_daemon_process(self, mock_current_process):
+        mock_current_process.return_value.daemon = True
+        self.assertIsInstance(controller.get_html_to_xml_executor(2), nullcontext)
+
+    @patch("migration.controller.connections")
+    def test_closes_connections_and_uses_spawn(self, mock_connections):
+        executor = controller.get_html_to_xml_executor(2)
+        try:
+            self.assertIsInstance(executor, ProcessPoolExecutor)
+            self.assertEqual("spawn", executor._mp_context.get_start_method())
+            mock_connections.close_all.assert_called_once_with()
+        finally:
+            executor.shutdown()
+
+    def test_generate_xmls_from_html_runs_in_the_pool(self):
+        args = (
+            {"journal": {}, "issue": {}, "article": [{}, {}]},
+            "S0001-37652000000100001",
+            {"pt": {"before references": "<p>texto</p>"}},
+        )
+        with controller.get_html_to_xml_executor(1) as executor:
+            future = executor.submit(controller.generate_xmls_from_html, *args)
+            pooled = _generate_xmls_from_html_outcome(future.result)
+        serial = _generate_xmls_from_html_outcome(
+            lambda: controller.generate_xmls_from_html(*args)
+        )
+        self.assertEqual(serial, pooled)
+
+
+class MigrationFailureRecorderTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="migration-failure-recorder")
+
+    def test_flush_updates_failures_without_migrated_item_id(self):
+        for i in range(2):
+            failures = MigrationFailureRecorder("scl", self.user)
+            failures.add(ValueError("error"), migrated_item_name="journal")
+            failures.flush()
+
+        failure = MigrationFailure.objects.get()
+        self.assertIsNone(failure.migrated_item_id)
+        self.assertEqual(2, failure.count)
+
+
+class IncrementalRecordsTest(SimpleTestCase):
+    def test_skips_records_not_updated_since_the_last_migration(self):
+        records = controller.IncrementalRecords(
+            [
+                ("0001-0001", {"v941": "20230101"}),
+                ("0002-0002", {"v941": "20230301"}),
+                ("0003-0003", {"v941": "20230101"}),
+            ],
+            "title",
+            {"0001-0001": "20230101", "0002-0002": "20230101"},
+        )
+        self.assertEqual(["0002-0002", "0003-0003"], [key for key, data in records])
+        self.assertEqual(1, records.skipped)
+
+    def test_records_newer_than_high_water_mark_are_not_compared(self):
+        isis_updated_dates = MagicMock()
+        isis_updated_dates.get.return_value = "20230101"
+        records = controller.IncrementalRecords(
+            [("0001-0001", {"v941": "20230301"})],
+            "title",
+            isis_updated_dates,
+            high_water_mark="20230201",
+        )
+        self.assertEqual(["0001-0001"], [key for key, data in records])
+        isis_updated_dates.get.assert_not_called()
+
+
+class MigratedFileImportSourceFileTest(SimpleTestCase):
+    def setUp(self):
+        # o decorator de classe não se aplicaria a setUp, que também salva
+        generate_filename = patch.object(
+            MigratedFile._meta.get_field("file"),
+            "generate_filename",
+            lambda instance, filename: f"migrated_files/{filename}",
+        )
+        generate_filename.start()
+        self.addCleanup(generate_filename.stop)
+        self.media_root = TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings.enable()
+        self.source = os.path.join(self.media_root.name, "source.pdf")
+        with open(self.source, "wb") as fp:
+            fp.write(b"new content")
+        self.migrated_file = MigratedFile()
+        self.migrated_file.file.save(
+            "previous.pdf", ContentFile(b"previous content"), save=False
+        )
+        self.previous_name = self.migrated_file.file.name
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def test_keeps_previous_file_until_the_replaced_files_are_deleted(self):
+        storage = self.migrated_file.file.storage
+
+        self.assertTrue(self.migrated_file.import_source_file("new.pdf", self.source))
+        self.assertNotEqual(self.previous_name, self.migrated_file.file.name)
+        self.assertTrue(storage.exists(self.previous_name))
+
+        self.migrated_file.delete_replaced_files()
+        self.assertFalse(storage.exists(self.previous_name))
+        self.assertTrue(storage.exists(self.migrated_file.file.name))
+
+    @patch("migration.models.File", side_effect=OSError("copy failed"))
+    def test_keeps_previous_file_if_the_copy_fails(self, mock_file):
+        with self.assertRaises(OSError):
+            self.migrated_file.import_source_file("new.pdf", self.source)
+
+        self.assertEqual(self.previous_name, self.migrated_file.file.name)
+        self.assertTrue(self.migrated_file.file.storage.exists(self.previous_name))
+        self.assertEqual([], self.migrated_file.replaced_file_names)
+
+
+class IssueMigrationBuildSpsPackageTest(SimpleTestCase):
+    def setUp(self):
+        self.stats = {"migrated": 0, "failed": 0, "isis_updated_date": None}
+        self.doc_records = [{"v91": "20230301"}]
+
+    def test_counts_built_package_as_migrated(self):
+        document_migration = MagicMock()
+        document_migration.build_sps_package.return_value = True
+
+        controller.IssueMigration._build_sps_package(
+            MagicMock(), "doc", self.doc_records, document_migration, self.stats
+        )
+
+        self.assertEqual(
+            {"migrated": 1, "failed": 0, "isis_updated_date": "20230301"},
+            self.stats,
+        )
+        document_migration.migrated_document.set_stage.assert_called_once()
+
+    def test_counts_failed_package_without_advancing_the_mark(self):
+        document_migration = MagicMock()
+        document_migration.build_sps_package.return_value = False
+
+        controller.IssueMigration._build_sps_package(
+            MagicMock(), "doc", self.doc_records, document_migration, self.stats
+        )
+
+        self.assertEqual(
+            {"migrated": 0, "failed": 1, "isis_updated_date": None}, self.stats
+        )
+        document_migration.migrated_document.set_stage.assert_not_called()
+
+
+def _create_migrated_issue(user):
+    collection = Collection.objects.create(creator=user, acron="scl")
+    scielo_journal = SciELOJournal.objects.create(
+        creator=user,
+        collection=collection,
+        scielo_issn="0001-3714",
+        acron="abc",
+    )
+    scielo_issue = SciELOIssue.objects.create(
+        creator=user,
+        scielo_journal=scielo_journal,
+        issue_pid="0001-371420230001",
+        issue_folder="v1n1",
+    )
+    return MigratedIssue.objects.create(
+        creator=user,
+        scielo_issue=scielo_issue,
+        migrated_journal=MigratedJournal.objects.create(
+            creator=user, scielo_journal=scielo_journal
+        ),
+    )
+
+
+class MigratedFileBulkCreateOrUpdateTest(TestCase):
+    def setUp(self):
+        self.media_root = TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings.enable()
+
+        self.user = get_user_model().objects.create(username="migrated-files")
+        self.migrated_issue = _create_migrated_issue(self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media_root.cleanup()
+
+    def _source(self, name, content):
+        path = os.path.join(self.media_root.name, name)
+        with open(path, "wb") as fp:
+            fp.write(content)
+        return path
+
+    def _item(self, name, source_path, **kwargs):
+        item = {
+            "original_path": f"pdf/abc/v1n1/{name}",
+            "source_path": source_path,
+            "category": "pdf",
+            "lang": "pt",
+            "part": None,
+            "pkg_name": os.path.splitext(name)[0],
+        }
+        item.update(kwargs)
+        return item
+
+    def _bulk_create_or_update(self, items):
+        return MigratedFile.bulk_create_or_update(
+            self.migrated_issue, items, creator=self.user
+        )
+
+    def test_classifies_created_updated_and_unchanged_files(self):
+        a = self._source("a.pdf", b"a")
+        b = self._source("b.pdf", b"b")
+        stats = self._bulk_create_or_update(
+            [self._item("a.pdf", a), self._item("b.pdf", b)]
+        )
+        self.assertEqual(
+            {"total": 2, "created": 2, "updated": 0, "unchanged": 0, "errors": []},
+            stats,
+        )
+
+        self._source("a.pdf", b"a, updated")
+        c = self._source("c.pdf", b"c")
+        stats = self._bulk_create_or_update(
+            [
+                self._item("a.pdf", a),
+                self._item("b.pdf", b),
+                self._item("c.pdf", c),
+            ]
+        )
+
+        self.assertEqual(
+            {"total": 3, "created": 1, "updated": 1, "unchanged": 1, "errors": []},
+            stats,
+        )
+        self.assertEqual(3, MigratedFile.objects.count())
+        migrated_file = MigratedFile.objects.get(original_name="a.pdf")
+        self.assertEqual(
+            "scl_abc_v1n1_a", os.path.basename(migrated_file.file.name)[:14]
+        )
+        with migrated_file.file.open("rb") as fp:
+            self.assertEqual(b"a, updated", fp.read())
+
+    def test_updates_the_changed_values_of_unchanged_files(self):
+        a = self._source("a.pdf", b"a")
+        self._bulk_create_or_update([self._item("a.pdf", a)])
+
+        stats = self._bulk_create_or_update([self._item("a.pdf", a, lang="en")])
+
+        self.assertEqual(1, stats["updated"])
+        self.assertEqual("en", MigratedFile.objects.get().lang.code2)
+
+    def test_duplicated_original_path_in_one_batch_creates_one_file(self):
+        a = self._source("a.pdf", b"a")
+
+        stats = self._bulk_create_or_update(
+            [self._item("a.pdf", a), self._item("a.pdf", a, lang="en")]
+        )
+
+        self.assertEqual(
+            {"total": 2, "created": 1, "updated": 0, "unchanged": 0, "errors": []},
+            stats,
+        )
+        self.assertEqual("en", MigratedFile.objects.get().lang.code2)
+
+    def test_collects_the_errors_of_each_item(self):
+        a = self._source("a.pdf", b"a")
+        missing = self._item("b.pdf", os.path.join(self.media_root.name, "b.pdf"))
+
+        stats = self._bulk_create_or_update([missing, self._item("a.pdf", a)])
+
+        self.assertEqual(1, stats["created"])
+        self.assertEqual(1, len(stats["errors"]))
+        item, error = stats["errors"][0]
+        self.assertIs(missing, item)
+        self.assertIsInstance(error, FileNotFoundError)
+        self.assertEqual(
+            ["a.pdf"], [obj.original_name for obj in MigratedFile.objects.all()]
+        )
+
+
+class MigratedFileIndexTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create(username="migrated-file-index")
+        self.migrated_issue = _create_migrated_issue(user)
+        for name in (
+            "a01f1.jpg",
+            "a01f1.tif",
+            "a01f1.thumbnail.jpg",
+            "a01f2",
+            "a01f2.png",
+            "A01F3.tif",
+            "a01f3.thumbnail.jpg",
+        ):
+            MigratedFile.objects.create(
+                creator=user, migrated_issue=self.migrated_issue, original_name=name
+            )
+        self.index = controller.MigratedFileIndex(self.migrated_issue)
+
+    def _get_alternative_by_query(self, name):
+        # consultas substituídas por MigratedFileIndex.get_alternative
+        stem, ext = os.path.splitext(name)
+        try:
+            return MigratedFile.get(
+                migrated_issue=self.migrated_issue, original_name=stem
+            )
+        except MigratedFile.DoesNotExist:
+            return MigratedFile.objects.filter(
+                migrated_issue=self.migrated_issue,
+                original_name__startswith=stem + ".",
+            ).first()
+
+    def test_get_alternative_matches_the_replaced_queries(self):
+        # a01f3.gif fica de fora: startswith (LIKE) só diferencia maiúsculas
+        # no PostgreSQL, não no SQLite
+        for name in (
+            "a01f1.gif",
+            "a01f1",
+            "a01f1.thumbnail.gif",
+            "a01f2.gif",
+            "A01F3.gif",
+            "a01f4.gif",
+            "a01.gif",
+        ):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self._get_alternative_by_query(name),
+                    self.index.get_alternative(name),
+                )
+
+    def test_get_alternative_returns_the_first_of_multiple_extensions(self):
+        self.assertEqual(
+            "a01f1.jpg", self.index.get_alternative("a01f1.gif").original_name
+        )
+
+    def test_get_alternative_prefers_the_name_without_extension(self):
+        self.assertEqual("a01f2", self.index.get_alternative("a01f2.gif").original_name)
+
+    def test_get_alternative_is_case_sensitive_as_startswith_on_postgresql(self):
+        self.assertEqual(
+            "a01f3.thumbnail.jpg",
+            self.index.get_alternative("a01f3.gif").original_name,
+        )
+        self.assertEqual(
+            "A01F3.tif", self.index.get_alternative("A01F3.gif").original_name
+        )
+
+    def test_get_alternative_returns_none_for_missing_stem(self):
+        self.assertIsNone(self.index.get_alternative("a01f4.gif"))
+        self.assertIsNone(self.index.get_alternative("a01.gif"))
+
+    def test_get_raises_does_not_exist(self):
+        self.assertEqual("a01f1.tif", self.index.get("a01f1.tif").original_name)
+        with self.assertRaises(MigratedFile.DoesNotExist):
+            self.index.get("a01f1.gif")
@@ -28,6 +28,8 @@ class MigrationFailureAdmin(ModelAdmin):
         "migrated_item_name",
         "migrated_item_id",
         "message",
+        "count",
+        "last_occurrence",
         "updated",
     )
     list_filter = (
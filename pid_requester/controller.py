@@ -1,9 +1,15 @@
+import asyncio
 import logging
 import os
 import sys
+import time
 import traceback
+from http import HTTPStatus
+from io import BytesIO
 from tempfile import TemporaryDirectory
+from zipfile import ZIP_DEFLATED, ZipFile
 
+import aiohttp
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext as _
 from packtools.sps.pid_provider.xml_sps_lib import (
@@ -12,10 +18,22 @@ from packtools.sps.pid_provider.xml_sps_lib import (
     get_xml_with_pre,
 )
 from requests.auth import HTTPBasicAuth
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
 from pid_requester import exceptions
 from pid_requester.models import PidProviderConfig, PidRequesterXML
-from pid_requester.utils.requester import post_data
+from pid_requester.utils import token_cache
+from pid_requester.utils.requester import (
+    NonRetryableError,
+    RetryableError,
+    get_session,
+    post_data,
+)
 
 User = get_user_model()
 
@@ -29,8 +47,17 @@ class PidRequester:
     armazena o XML
     """
 
-    def __init__(self):
+    def __init__(self, concurrency=None):
+        """
+        concurrency : int
+            se informado, quantidade de requisições simultâneas
+            ao pid provider (AsyncPidProviderAPI)
+        """
         self.pid_provider_api = PidProviderAPI()
+        self.concurrency = concurrency
+        self.async_pid_provider_api = concurrency and AsyncPidProviderAPI(
+            concurrency=concurrency
+        )
 
     def request_pid_for_xml_uri(self, xml_uri, name, user, is_published=None):
         """
@@ -54,15 +81,27 @@ class PidRequester:
                 xml_with_pre, name, user, is_published
             )
 
-    def request_pid_for_xml_zip(self, zip_xml_file_path, user, is_published=None):
+    def request_pid_for_xml_zip(
+        self, zip_xml_file_path, user, is_published=None, batch_size=None
+    ):
         """
         Recebe um zip de arquivo XML para solicitar o PID da versão 3
         para o Pid Provider
 
+        Se batch_size é informado, os XML são agrupados em lotes e
+        cada lote é enviado ao Pid Provider em uma única requisição
+        ou, se concurrency foi informado, em requisições simultâneas
+
         Returns
         -------
             list of dict
         """
+        batch_size = batch_size or self.concurrency
+        if batch_size:
+            yield from self._request_pid_for_xml_zip_in_batches(
+                zip_xml_file_path, user, is_published, batch_size
+            )
+            return
         try:
             for xml_with_pre in XMLWithPre.create(path=zip_xml_file_path):
                 logging.info("request_pid_for_xml_zip:")
@@ -89,6 +128,77 @@ class PidRequester:
                 "error_type": str(type(e)),
             }
 
+    def _request_pid_for_xml_zip_in_batches(
+        self, zip_xml_file_path, user, is_published, batch_size
+    ):
+        try:
+            batch = []
+            for xml_with_pre in XMLWithPre.create(path=zip_xml_file_path):
+                batch.append(xml_with_pre)
+                if len(batch) == batch_size:
+                    yield from self.request_pid_for_xml_batch(batch, user, is_published)
+                    batch = []
+            if batch:
+                yield from self.request_pid_for_xml_batch(batch, user, is_published)
+        except Exception as e:
+            logging.exception(e)
+            yield {
+                "error_msg": f"Unable to request pid for {zip_xml_file_path} {e}",
+                "error_type": str(type(e)),
+            }
+
+    def request_pid_for_xml_batch(self, xml_with_pre_items, user, is_published=None):
+        """
+        Recebe uma lista de xml_with_pre para solicitar o PID da versão 3
+        para o Pid Provider
+
+        Os XML que requerem registro remoto são enviados
+        em um único zip, com um único token, ou, se concurrency foi
+        informado, em requisições simultâneas
+
+        Returns
+        -------
+            list of dict, na mesma ordem de xml_with_pre_items
+        """
+        demands = []
+        remote_items = []
+        for xml_with_pre in xml_with_pre_items:
+            demand = PidRequesterXML.check_registration_demand(xml_with_pre)
+            logging.info(f"demand={demand}")
+            demands.append(demand)
+            if demand.get("required_remote_registration"):
+                remote_items.append(xml_with_pre)
+
+        responses = {}
+        if remote_items:
+            api = self.async_pid_provider_api or self.pid_provider_api
+            batch_response = api.provide_pid_for_batch(
+                [(item, item.filename) for item in remote_items]
+            )
+            for xml_with_pre, response in zip(remote_items, batch_response):
+                responses[id(xml_with_pre)] = response
+
+        results = []
+        for xml_with_pre, demand in zip(xml_with_pre_items, demands):
+            try:
+                registered = self._register_demand(
+                    xml_with_pre,
+                    xml_with_pre.filename,
+                    user,
+                    is_published,
+                    demand,
+                    responses.get(id(xml_with_pre)) or {},
+                )
+            except Exception as e:
+                logging.exception(e)
+                registered = {
+                    "error_msg": f"Unable to request pid for {xml_with_pre.filename} {e}",
+                    "error_type": str(type(e)),
+                }
+            registered["filename"] = xml_with_pre.filename
+            results.append(registered)
+        return results
+
     def request_pid_for_xml_with_pre(self, xml_with_pre, name, user, is_published=None):
         """
         Recebe um xml_with_pre para solicitar o PID da versão 3
@@ -113,11 +223,24 @@ class PidRequester:
             return demand
 
         response = {}
-        registered = demand["registered"]
-
         if demand["required_remote_registration"]:
             response = self.pid_provider_api.provide_pid(xml_with_pre, name)
 
+        return self._register_demand(
+            xml_with_pre, name, user, is_published, demand, response or {}
+        )
+
+    def _register_demand(
+        self, xml_with_pre, name, user, is_published, demand, response
+    ):
+        """
+        Registra localmente, se necessário, considerando
+        a resposta do Pid Provider
+        """
+        if demand.get("error_type"):
+            return dict(demand)
+
+        registered = demand["registered"]
         if demand["required_local_registration"]:
             registered = PidRequesterXML.register(
                 xml_with_pre,
@@ -211,11 +334,88 @@ class PidRequester:
                     "Unable to synchronized data with central pid provider because API URI is missing"
                 )
             )
-        for item in PidRequesterXML.unsynchronized:
+        if self.async_pid_provider_api:
+            return self._synchronize_concurrently(user)
+
+        for item in PidRequesterXML.unsynchronized():
             name = item.pkg_name
             xml_with_pre = item.xml_with_pre
             response = self.pid_provider_api.provide_pid(xml_with_pre, name)
-            item.set_synchronized(user, **response)
+            self._set_synchronized(item, user, response)
+
+    def _synchronize_concurrently(self, user):
+        chunk_size = self.concurrency * 10
+        chunk = []
+        for item in PidRequesterXML.unsynchronized():
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                self._synchronize_chunk(chunk, user)
+                chunk = []
+        if chunk:
+            self._synchronize_chunk(chunk, user)
+
+    def _synchronize_chunk(self, items, user):
+        responses = self.async_pid_provider_api.provide_pid_for_batch(
+            [(item.xml_with_pre, item.pkg_name) for item in items]
+        )
+        for item, response in zip(items, responses):
+            self._set_synchronized(item, user, response)
+
+    def synchronize_range(self, user, first_pk, last_pk):
+        """
+        Sincroniza os registros não sincronizados cujo pk está entre
+        first_pk e last_pk e grava o status de todos em lote
+
+        Returns
+        -------
+            dict
+        """
+        started = time.monotonic()
+        items = list(PidRequesterXML.unsynchronized_in_range(first_pk, last_pk))
+
+        requests = []
+        responses = [None] * len(items)
+        for i, item in enumerate(items):
+            try:
+                requests.append((i, item.xml_with_pre, item.pkg_name))
+            except Exception as e:
+                logging.exception(e)
+                responses[i] = {"error_msg": str(e), "error_type": str(type(e))}
+
+        if self.async_pid_provider_api:
+            provided = self.async_pid_provider_api.provide_pid_for_batch(
+                [(xml_with_pre, name) for i, xml_with_pre, name in requests]
+            )
+        else:
+            provided = [
+                self.pid_provider_api.provide_pid(xml_with_pre, name)
+                for i, xml_with_pre, name in requests
+            ]
+        for (i, xml_with_pre, name), response in zip(requests, provided):
+            responses[i] = response
+
+        synchronized = PidRequesterXML.bulk_set_synchronized(items, responses, user)
+        elapsed = time.monotonic() - started
+        result = {
+            "first_pk": first_pk,
+            "last_pk": last_pk,
+            "total": len(items),
+            "synchronized": synchronized,
+            "failed": len(items) - synchronized,
+            "elapsed": elapsed,
+        }
+        logging.info(f"PidRequester.synchronize_range {result}")
+        return result
+
+    def _set_synchronized(self, item, user, response):
+        response = response or {}
+        item.set_synchronized(
+            user,
+            xml_uri=response.get("xml_uri"),
+            error_type=response.get("error_type"),
+            error_msg=response.get("error_msg"),
+            traceback=response.get("traceback"),
+        )
 
 
 class PidProviderAPI:
@@ -291,12 +491,9 @@ class PidProviderAPI:
             nome do arquivo xml
         """
         try:
-            token = self._get_token(
-                username=self.api_username,
-                password=self.api_password,
-                timeout=self.timeout,
+            response = self._post_with_token(
+                self._prepare_and_post_xml, xml_with_pre, name
             )
-            response = self._prepare_and_post_xml(xml_with_pre, name, token)
 
             self._process_post_xml_response(response, xml_with_pre)
             try:
@@ -317,7 +514,102 @@ class PidProviderAPI:
                 ],
             }
 
-    def _get_token(self, username, password, timeout):
+    def provide_pid_for_batch(self, items):
+        """
+        Solicita PIDs para vários XML em uma única requisição
+
+        items : list of tuple (xml_with_pre, name)
+
+        Returns
+        -------
+            list of dict, na mesma ordem de items
+        """
+        try:
+            response = self._post_with_token(self._prepare_and_post_xml_batch, items)
+            return self._match_batch_response(items, response)
+        except (
+            exceptions.GetAPITokenError,
+            exceptions.APIPidProviderPostError,
+            exceptions.APIPidProviderConfigError,
+        ) as e:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            error = {
+                "error_msg": str(e),
+                "error_type": str(type(e)),
+                "traceback": [
+                    str(item) for item in traceback.extract_tb(exc_traceback)
+                ],
+            }
+            return [dict(error) for item in items]
+
+    def _match_batch_response(self, items, response):
+        """
+        Associa cada item da resposta ao XML enviado,
+        pelo nome do arquivo, se presente, ou pela posição
+        """
+        response = response or []
+        by_filename = {
+            item["filename"]: item
+            for item in response
+            if isinstance(item, dict) and item.get("filename")
+        }
+        results = []
+        for i, (xml_with_pre, name) in enumerate(items):
+            found = by_filename.get(self._xml_filename(name))
+            if found is None and not by_filename and i < len(response):
+                found = response[i]
+            results.append(
+                found
+                or {
+                    "error_msg": _("No response from pid provider for {}").format(name),
+                    "error_type": str(exceptions.APIPidProviderPostError),
+                }
+            )
+        return results
+
+    def _xml_filename(self, name):
+        name, ext = os.path.splitext(os.path.basename(name))
+        return name + ".xml"
+
+    def _post_with_token(self, prepare_and_post, *args):
+        """
+        Executa prepare_and_post(*args, token) e, se o token for recusado (401),
+        obtém um novo token e tenta mais uma vez
+        """
+        token = self._get_token(
+            username=self.api_username,
+            password=self.api_password,
+            timeout=self.timeout,
+        )
+        try:
+            return prepare_and_post(*args, token)
+        except exceptions.APIPidProviderUnauthorizedError as e:
+            logging.info(f"Token refused by pid provider, retrying: {e}")
+            token = self._get_token(
+                username=self.api_username,
+                password=self.api_password,
+                timeout=self.timeout,
+                force_refresh=True,
+            )
+            return prepare_and_post(*args, token)
+
+    def _get_token(self, username, password, timeout, force_refresh=False):
+        """
+        Retorna o token armazenado em cache enquanto não está próximo de
+        expirar, caso contrário, solicita um novo ao pid provider
+        """
+        key = token_cache.cache_key(self.pid_provider_api_get_token, username)
+        if force_refresh:
+            token_cache.invalidate(key)
+        else:
+            token = token_cache.get(key)
+            if token:
+                return token
+        token = self._request_token(username, password, timeout)
+        token_cache.set(key, token)
+        return token
+
+    def _request_token(self, username, password, timeout):
         """
         curl -X POST 127.0.0.1:8000/api-token-auth/ \
             --data 'username=x&password=x'
@@ -330,6 +622,7 @@ class PidProviderAPI:
                 auth=HTTPBasicAuth(username, password),
                 timeout=timeout,
                 json=True,
+                session=get_session(self.pid_provider_api_get_token),
             )
             logging.info(resp)
             return resp.get("access")
@@ -358,6 +651,18 @@ class PidProviderAPI:
 
             return self._post_xml(zip_xml_file_path, token, self.timeout)
 
+    def _prepare_and_post_xml_batch(self, items, token):
+        """
+        Cria um único zip contendo todos os XML e o envia
+        """
+        with TemporaryDirectory() as tmpdirname:
+            zip_xml_file_path = os.path.join(tmpdirname, "batch.zip")
+            with ZipFile(zip_xml_file_path, "w", compression=ZIP_DEFLATED) as zf:
+                for xml_with_pre, name in items:
+                    zf.writestr(self._xml_filename(name), xml_with_pre.tostring())
+
+            return self._post_xml(zip_xml_file_path, token, self.timeout)
+
     def _post_xml(self, zip_xml_file_path, token, timeout):
         """
         curl -X POST -S \
@@ -368,10 +673,14 @@ class PidProviderAPI:
         """
         basename = os.path.basename(zip_xml_file_path)
 
+        # conteúdo em bytes, para que as novas tentativas reenviem o arquivo
+        with open(zip_xml_file_path, "rb") as fp:
+            content = fp.read()
+
         files = {
             "file": (
                 basename,
-                open(zip_xml_file_path, "rb"),
+                content,
                 "application/zip",
             )
         }
@@ -389,6 +698,24 @@ class PidProviderAPI:
                 timeout=timeout,
                 verify=False,
                 json=True,
+                session=get_session(self.pid_provider_api_post_xml),
+            )
+        except NonRetryableError as e:
+            logging.exception(e)
+            response = getattr(e.__cause__, "response", None)
+            if getattr(response, "status_code", None) == HTTPStatus.UNAUTHORIZED:
+                raise exceptions.APIPidProviderUnauthorizedError(
+                    _("Unauthorized to get pid from pid provider {} {}").format(
+                        zip_xml_file_path,
+                        e,
+                    )
+                )
+            raise exceptions.APIPidProviderPostError(
+                _("Unable to get pid from pid provider {} {} {}").format(
+                    zip_xml_file_path,
+                    type(e),
+                    e,
+                )
             )
         except Exception as e:
             logging.exception(e)
@@ -417,3 +744,190 @@ class PidProviderAPI:
                     break
             except KeyError:
                 pass
+
+
+class AsyncPidProviderAPI(PidProviderAPI):
+    """
+    Interface com o pid provider que mantém até `concurrency`
+    requisições simultâneas
+    """
+
+    def __init__(self, concurrency=None, **kwargs):
+        super().__init__(**kwargs)
+        self.concurrency = concurrency or 10
+
+    def provide_pid_for_batch(self, items):
+        """
+        Solicita PIDs para vários XML, uma requisição por XML,
+        com até `concurrency` requisições simultâneas
+
+        items : list of tuple (xml_with_pre, name)
+
+        Returns
+        -------
+            list of dict, na mesma ordem de items
+        """
+        return asyncio.run(self.aprovide_pid_for_batch(items))
+
+    async def aprovide_pid_for_batch(self, items):
+        semaphore = asyncio.BoundedSemaphore(self.concurrency)
+        token_lock = asyncio.Lock()
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            return await asyncio.gather(
+                *[
+                    self.aprovide_pid(session, semaphore, token_lock, xml, name)
+                    for xml, name in items
+                ]
+            )
+
+    async def aprovide_pid(self, session, semaphore, token_lock, xml_with_pre, name):
+        """
+        name : str
+            nome do arquivo xml
+        """
+        try:
+            async with semaphore:
+                content = self._xml_zip_content(xml_with_pre, name)
+                async with token_lock:
+                    token = await self._aget_token(session)
+                try:
+                    response = await self._apost_xml(session, content, name, token)
+                except exceptions.APIPidProviderUnauthorizedError as e:
+                    logging.info(f"Token refused by pid provider, retrying: {e}")
+                    async with token_lock:
+                        token = await self._aget_token(session, refused=token)
+                    response = await self._apost_xml(session, content, name, token)
+            try:
+                return response[0]
+            except (IndexError, KeyError, TypeError):
+                # sem resposta, o XML não pode ser considerado sincronizado
+                return {
+                    "error_msg": _("No response from pid provider for {}").format(name),
+                    "error_type": str(exceptions.APIPidProviderPostError),
+                }
+        except (
+            exceptions.GetAPITokenError,
+            exceptions.APIPidProviderPostError,
+            exceptions.APIPidProviderConfigError,
+        ) as e:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            return {
+                "error_msg": str(e),
+                "error_type": str(type(e)),
+                "traceback": [
+                    str(item) for item in traceback.extract_tb(exc_traceback)
+                ],
+            }
+
+    def _xml_zip_content(self, xml_with_pre, name):
+        buffer = BytesIO()
+        with ZipFile(buffer, "w", compression=ZIP_DEFLATED) as zf:
+            zf.writestr(self._xml_filename(name), xml_with_pre.tostring())
+        return buffer.getvalue()
+
+    async def _aget_token(self, session, refused=None):
+        """
+        Retorna o token em cache ou solicita um novo;
+        refused é o token recusado pelo pid provider, que deve ser renovado,
+        exceto se outra requisição já o renovou
+        """
+        key = token_cache.cache_key(self.pid_provider_api_get_token, self.api_username)
+        token = token_cache.get(key)
+        if token and token != refused:
+            return token
+        try:
+            response = await self._apost(
+                session,
+                self.pid_provider_api_get_token,
+                data={"username": self.api_username, "password": self.api_password},
+                auth=aiohttp.BasicAuth(self.api_username, self.api_password),
+            )
+            token = response.get("access")
+        except Exception as e:
+            logging.exception(e)
+            raise exceptions.GetAPITokenError(
+                _("Unable to get api token {} {} {}").format(
+                    self.api_username,
+                    type(e),
+                    e,
+                )
+            )
+        token_cache.set(key, token)
+        return token
+
+    async def _apost_xml(self, session, content, name, token):
+        basename = os.path.splitext(os.path.basename(name))[0] + ".zip"
+        header = {
+            "Authorization": "Bearer " + token,
+            "Content-Disposition": "attachment; filename=%s" % basename,
+        }
+        try:
+            return await self._apost(
+                session,
+                self.pid_provider_api_post_xml,
+                files=(basename, content),
+                headers=header,
+                ssl=False,
+            )
+        except NonRetryableError as e:
+            if getattr(e.__cause__, "status", None) == HTTPStatus.UNAUTHORIZED:
+                raise exceptions.APIPidProviderUnauthorizedError(
+                    _("Unauthorized to get pid from pid provider {} {}").format(
+                        name,
+                        e,
+                    )
+                )
+            raise exceptions.APIPidProviderPostError(
+                _("Unable to get pid from pid provider {} {} {}").format(
+                    name,
+                    type(e),
+                    e,
+                )
+            )
+        except Exception as e:
+            logging.exception(e)
+            raise exceptions.APIPidProviderPostError(
+                _("Unable to get pid from pid provider {} {} {}").format(
+                    name,
+                    type(e),
+                    e,
+                )
+            )
+
+    @retry(
+        retry=retry_if_exception_type(RetryableError),
+        wait=wait_exponential(multiplier=1, min=1, max=5),
+        stop=stop_after_attempt(5),
+    )
+    async def _apost(
+        self, session, url, data=None, files=None, auth=None, headers=None, ssl=None
+    ):
+        """
+        Equivalente assíncrono de post_data, com timeout por requisição
+        """
+        if files:
+            basename, content = files
+            data = aiohttp.FormData()
+            data.add_field(
+                "file", content, filename=basename, content_type="application/zip"
+            )
+        try:
+            async with session.post(
+                url,
+                data=data,
+                auth=auth,
+                headers=headers,
+                ssl=ssl,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            ) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+            logging.error(f"Erro posting data: {url}, retry..., erro: {exc}")
+            raise RetryableError(exc) from exc
+        except aiohttp.ClientResponseError as exc:
+            if 500 <= exc.status < 600:
+                logging.error(f"Erro posting data: {url}, retry..., erro: {exc}")
+                raise RetryableError(exc) from exc
+            raise NonRetryableError(exc) from exc
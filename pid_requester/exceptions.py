@@ -2,6 +2,10 @@ class APIPidProviderPostError(Exception):
     ...
 
 
+class APIPidProviderUnauthorizedError(APIPidProviderPostError):
+    ...
+
+
 class PidRequesterXMLContentError(Exception):
     ...
 
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "pid_requester",
+            "0002_pidchange_pidrequest_alter_xmlissue_unique_together_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "main_doi"],
+                name="pid_request_journal_213b4c_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "fpage"],
+                name="pid_request_journal_959b71_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "elocation_id"],
+                name="pid_request_journal_ff0f58_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "pkg_name"],
+                name="pid_request_journal_bd66f3_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "z_surnames"],
+                name="pid_request_journal_f6ec11_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "z_collab"],
+                name="pid_request_journal_3f8192_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "article_pub_year", "z_links"],
+                name="pid_request_journal_b21336_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "issue", "fpage", "fpage_seq"],
+                name="pid_request_journal_ca44f0_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pidrequesterxml",
+            index=models.Index(
+                fields=["journal", "issue", "elocation_id"],
+                name="pid_request_journal_253159_idx",
+            ),
+        ),
+    ]
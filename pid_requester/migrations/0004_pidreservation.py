@@ -0,0 +1,46 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "pid_requester",
+            "0003_pidrequesterxml_pid_request_journal_213b4c_idx_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PidReservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pid_type", models.CharField(max_length=3, verbose_name="PID type")),
+                (
+                    "value",
+                    models.CharField(max_length=23, unique=True, verbose_name="PID"),
+                ),
+                ("owner", models.CharField(max_length=32, verbose_name="Owner")),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Creation date"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="pidreservation",
+            index=models.Index(fields=["owner"], name="pid_request_owner_5fecdc_idx"),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicated_related_items(apps, schema_editor):
+    """
+    Mantém um XMLRelatedItem por main_doi, transferindo para ele os
+    relacionamentos com PidRequesterXML dos registros removidos
+    """
+    XMLRelatedItem = apps.get_model("pid_requester", "XMLRelatedItem")
+    PidRequesterXML = apps.get_model("pid_requester", "PidRequesterXML")
+    Through = PidRequesterXML.related_items.through
+
+    duplicated = (
+        XMLRelatedItem.objects.filter(main_doi__isnull=False)
+        .values("main_doi")
+        .annotate(kept=Min("pk"), total=Count("pk"))
+        .filter(total__gt=1)
+    )
+    for item in duplicated.iterator():
+        others = XMLRelatedItem.objects.filter(main_doi=item["main_doi"]).exclude(
+            pk=item["kept"]
+        )
+        pid_requester_xml_ids = set(
+            Through.objects.filter(xmlrelateditem__in=others).values_list(
+                "pidrequesterxml_id", flat=True
+            )
+        ) - set(
+            Through.objects.filter(xmlrelateditem_id=item["kept"]).values_list(
+                "pidrequesterxml_id", flat=True
+            )
+        )
+        Through.objects.bulk_create(
+            [
+                Through(pidrequesterxml_id=pk, xmlrelateditem_id=item["kept"])
+                for pk in pid_requester_xml_ids
+            ]
+        )
+        Through.objects.filter(xmlrelateditem__in=others).delete()
+        others.delete()
+
+
+def remove_duplicated_pid_changes(apps, schema_editor):
+    """
+    Mantém um PidChange por (pid_type, old, new, version), inclusive
+    quando alguma das colunas é NULL
+    """
+    PidChange = apps.get_model("pid_requester", "PidChange")
+
+    duplicated = (
+        PidChange.objects.values("pid_type", "old", "new", "version")
+        .annotate(kept=Min("pk"), total=Count("pk"))
+        .filter(total__gt=1)
+    )
+    for item in duplicated.iterator():
+        kept = item.pop("kept")
+        item.pop("total")
+        lookup = {}
+        for name, value in item.items():
+            if value is None:
+                lookup[f"{name}__isnull"] = True
+            else:
+                lookup[name] = value
+        PidChange.objects.filter(**lookup).exclude(pk=kept).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pid_requester", "0004_pidreservation"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicated_related_items, migrations.RunPython.noop
+        ),
+        migrations.RunPython(remove_duplicated_pid_changes, migrations.RunPython.noop),
+        # a restrição de unicidade já cria um índice para main_doi
+        migrations.RemoveIndex(
+            model_name="xmlrelateditem",
+            name="pid_request_main_do_892ce7_idx",
+        ),
+        migrations.AlterField(
+            model_name="xmlrelateditem",
+            name="main_doi",
+            field=models.TextField(
+                blank=True, null=True, unique=True, verbose_name="DOI"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="pidchange",
+            unique_together={("pid_type", "old", "new", "version")},
+        ),
+    ]
@@ -1,12 +1,20 @@
 import hashlib
 import logging
 import os
-from datetime import datetime
+import random
+import threading
+from collections import deque
+from datetime import datetime, timedelta
 from http import HTTPStatus
 from shutil import copyfile
+from uuid import uuid4
 
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
 from django.core.files.base import ContentFile
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from packtools.sps.pid_provider import v3_gen, xml_sps_adapter
 from wagtail.admin.panels import FieldPanel
@@ -25,6 +33,93 @@ def utcnow():
     # return datetime.utcnow().isoformat().replace("T", " ") + "Z"
 
 
+# quantidade de PIDs reservados de uma vez por PidReservation
+PID_BLOCK_SIZE = getattr(settings, "PID_PROVIDER_PID_BLOCK_SIZE", 100)
+# segundos após os quais as reservas de PidReservation são removidas
+PID_RESERVATION_MAX_AGE = getattr(
+    settings, "PID_PROVIDER_PID_RESERVATION_MAX_AGE", 7 * 24 * 60 * 60
+)
+
+# lookups que _matches_query_params avalia em Python
+PYTHON_LOOKUPS = ("exact", "iexact", "isnull")
+
+
+def _get_field_value(obj, path):
+    value = obj
+    for name in path:
+        if value is None:
+            return None
+        value = getattr(value, name)
+    return value
+
+
+def _matches_query_params(obj, params):
+    """
+    Avalia em Python se obj atende a params,
+    com a mesma semântica do filtro do Django para os lookups PYTHON_LOOKUPS
+
+    Returns
+    -------
+        bool
+
+    Raises
+    ------
+        NotImplementedError
+    """
+    for key, expected in params.items():
+        path = key.split("__")
+        lookup = "exact"
+        if path[-1] in PYTHON_LOOKUPS:
+            lookup = path.pop()
+        value = _get_field_value(obj, path)
+        if lookup == "isnull":
+            matched = (value is None) == bool(expected)
+        elif expected is None:
+            matched = value is None
+        elif value is None:
+            matched = False
+        elif lookup == "iexact":
+            matched = str(value).upper() == str(expected).upper()
+        else:
+            matched = str(value) == str(expected)
+        if not matched:
+            return False
+    return True
+
+
+class XMLRefCache:
+    """
+    Cache, por processo, de registros referenciados por PidRequesterXML
+    (XMLJournal, XMLIssue); os registros só são adicionados após o commit
+    da transação em que foram obtidos ou criados
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._items = {}
+
+    def get(self, key):
+        return self._items.get(key)
+
+    def add(self, key, obj):
+        if not obj or not obj.pk:
+            return
+
+        def _add():
+            if len(self._items) >= self.maxsize:
+                self._items.clear()
+            self._items[key] = obj
+
+        transaction.on_commit(_add)
+
+    def clear(self):
+        self._items.clear()
+
+
+xml_journal_cache = XMLRefCache()
+xml_issue_cache = XMLRefCache()
+
+
 class PidProviderConfig(CommonControlField):
     """
     Tem função de guardar XML que falhou no registro
@@ -179,12 +274,7 @@ class XMLRelatedItem(CommonControlField):
     Tem objetivo de identificar o Documento (Artigo)
     """
 
-    main_doi = models.TextField(_("DOI"), null=True, blank=True)
-
-    class Meta:
-        indexes = [
-            models.Index(fields=["main_doi"]),
-        ]
+    main_doi = models.TextField(_("DOI"), null=True, blank=True, unique=True)
 
     def __str__(self):
         return self.main_doi
@@ -211,6 +301,9 @@ class PidChange(CommonControlField):
     )
 
     class Meta:
+        unique_together = [
+            ["pid_type", "old", "new", "version"],
+        ]
         indexes = [
             models.Index(fields=["old"]),
             models.Index(fields=["new"]),
@@ -269,6 +362,151 @@ class SyncFailure(CommonControlField):
         return obj
 
 
+class PidReservation(models.Model):
+    """
+    Tem função de reservar PIDs (v2 e v3) em blocos, garantindo, por meio
+    da restrição de unicidade, que cada PID seja entregue a um único processo
+    """
+
+    pid_type = models.CharField(_("PID type"), max_length=3)
+    value = models.CharField(_("PID"), max_length=23, unique=True)
+    owner = models.CharField(_("Owner"), max_length=32)
+    created = models.DateTimeField(_("Creation date"), auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner"]),
+        ]
+
+    def __str__(self):
+        return f"{self.pid_type} {self.value}"
+
+    _lock = threading.Lock()
+    _pools = {}
+
+    @classmethod
+    def next_v3(cls):
+        return cls._next("v3", None, cls._v3_candidates)
+
+    @classmethod
+    def next_v2(cls, v2_prefix):
+        # mm e dd são os da data de uso do PID, não os da data da reserva
+        h = utcnow()
+        return cls._next("v2", f"{v2_prefix}{h.month:02}{h.day:02}", cls._v2_candidates)
+
+    @classmethod
+    def _next(cls, pid_type, prefix, generate):
+        """
+        Entrega um PID reservado previamente por este processo,
+        reservando um novo bloco quando os anteriores se esgotam.
+
+        As linhas do bloco são inseridas na transação corrente, então apenas
+        o PID entregue agora é usado antes do commit; os demais só entram no
+        pool após o commit e são descartados se a transação for desfeita.
+
+        Cada PID do pool guarda a data da reserva do seu bloco; os reservados
+        há mais de PID_RESERVATION_MAX_AGE segundos são descartados, pois
+        expire() já pode ter removido as suas reservas
+        """
+        key = (pid_type, prefix)
+        with cls._lock:
+            cls._discard_stale_pools(pid_type, prefix)
+            pool = cls._pools.get(key)
+            limit = timezone.now() - timedelta(seconds=PID_RESERVATION_MAX_AGE)
+            while pool:
+                reserved_at, value = pool.popleft()
+                if reserved_at > limit:
+                    return value
+
+        # anterior à data de criação das linhas do bloco
+        reserved_at = timezone.now()
+        values = []
+        while not values:
+            values = cls.reserve(pid_type, generate(prefix, PID_BLOCK_SIZE))
+        value, others = values[0], values[1:]
+
+        def _add():
+            with cls._lock:
+                cls._pools.setdefault(key, deque()).extend(
+                    (reserved_at, item) for item in others
+                )
+
+        transaction.on_commit(_add)
+        return value
+
+    @classmethod
+    def _discard_stale_pools(cls, pid_type, prefix):
+        """
+        Descarta os pools de v2 de outras datas, que continham o mm/dd da
+        data da reserva
+        """
+        if pid_type != "v2":
+            return
+        for key in list(cls._pools):
+            if key[0] == pid_type and key[1] != prefix and key[1][:-4] == prefix[:-4]:
+                del cls._pools[key]
+
+    @classmethod
+    def reserve(cls, pid_type, candidates):
+        """
+        Reserva os candidatos que não estão registrados nem reservados,
+        com um bulk insert
+
+        Returns
+        -------
+            list of str (PIDs reservados)
+        """
+        candidates = set(candidates)
+        registered = set(
+            PidRequesterXML.objects.filter(
+                **{f"{pid_type}__in": candidates}
+            ).values_list(pid_type, flat=True)
+        )
+        owner = uuid4().hex
+        cls.objects.bulk_create(
+            [
+                cls(pid_type=pid_type, value=value, owner=owner)
+                for value in candidates - registered
+            ],
+            ignore_conflicts=True,
+        )
+        # os que já estavam reservados por outro processo foram ignorados
+        return list(
+            cls.objects.filter(owner=owner)
+            .order_by("pk")
+            .values_list("value", flat=True)
+        )
+
+    @classmethod
+    def expire(cls, max_age=None):
+        """
+        Remove as reservas mais antigas que max_age segundos. Os PIDs
+        usados já constam em PidRequesterXML, que reserve() também consulta;
+        os não usados são descartados dos pools por _next() com a mesma idade
+
+        Returns
+        -------
+            int (quantidade de reservas removidas)
+        """
+        max_age = PID_RESERVATION_MAX_AGE if max_age is None else max_age
+        deleted, _ = cls.objects.filter(
+            created__lt=timezone.now() - timedelta(seconds=max_age)
+        ).delete()
+        return deleted
+
+    @classmethod
+    def _v3_candidates(cls, prefix, size):
+        return [v3_gen.generates() for i in range(size)]
+
+    @classmethod
+    def _v2_candidates(cls, prefix, size):
+        # prefix: v2_prefix + mm + dd
+        return [
+            f"{prefix}{str(nnnnn).zfill(5)}"
+            for nnnnn in random.sample(range(100000), size)
+        ]
+
+
 class PidRequesterXML(CommonControlField):
     """
     Tem responsabilidade de garantir a atribuição do PID da versão 3,
@@ -360,6 +598,16 @@ class PidRequesterXML(CommonControlField):
             models.Index(fields=["z_links"]),
             models.Index(fields=["z_partial_body"]),
             models.Index(fields=["synchronized"]),
+            # índices compostos usados por _fetch_candidates
+            models.Index(fields=["journal", "article_pub_year", "main_doi"]),
+            models.Index(fields=["journal", "article_pub_year", "fpage"]),
+            models.Index(fields=["journal", "article_pub_year", "elocation_id"]),
+            models.Index(fields=["journal", "article_pub_year", "pkg_name"]),
+            models.Index(fields=["journal", "article_pub_year", "z_surnames"]),
+            models.Index(fields=["journal", "article_pub_year", "z_collab"]),
+            models.Index(fields=["journal", "article_pub_year", "z_links"]),
+            models.Index(fields=["journal", "issue", "fpage", "fpage_seq"]),
+            models.Index(fields=["journal", "issue", "elocation_id"]),
         ]
 
     def __str__(self):
@@ -390,6 +638,84 @@ class PidRequesterXML(CommonControlField):
         """
         return cls.objects.filter(synchronized=False).iterator()
 
+    @classmethod
+    def unsynchronized_pk_ranges(cls, chunk_size):
+        """
+        Divide os registros não sincronizados em intervalos de pk
+        (paginação por chave), cada um com até chunk_size registros
+
+        Returns
+        -------
+            generator of tuple (first_pk, last_pk, total)
+        """
+        last_pk = 0
+        while True:
+            pks = list(
+                cls.objects.filter(synchronized=False, pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not pks:
+                return
+            yield pks[0], pks[-1], len(pks)
+            last_pk = pks[-1]
+
+    @classmethod
+    def unsynchronized_in_range(cls, first_pk, last_pk):
+        return (
+            cls.objects.filter(
+                synchronized=False,
+                pk__gte=first_pk,
+                pk__lte=last_pk,
+            )
+            .select_related("current_version", "sync_failure")
+            .order_by("pk")
+        )
+
+    @classmethod
+    def bulk_set_synchronized(cls, items, responses, user):
+        """
+        Atualiza o status de sincronização de items com as
+        respostas correspondentes do pid provider, em lote
+
+        Returns
+        -------
+            int (quantidade de items sincronizados)
+        """
+        now = utcnow()
+        failures = {}
+        old_failures = []
+        for item, response in zip(items, responses):
+            response = response or {}
+            if item.sync_failure_id:
+                old_failures.append(item.sync_failure_id)
+            error_msg = response.get("error_msg")
+            error_type = response.get("error_type")
+            traceback = response.get("traceback")
+            item.sync_failure = None
+            item.synchronized = not (error_msg or error_type or traceback)
+            if not item.synchronized:
+                failures[item.pk] = SyncFailure(
+                    error_msg=error_msg,
+                    error_type=error_type,
+                    traceback=traceback,
+                    creator=user,
+                    created=now,
+                )
+            item.updated_by = user
+            item.updated = now
+
+        with transaction.atomic():
+            SyncFailure.objects.bulk_create(failures.values())
+            for item in items:
+                item.sync_failure = failures.get(item.pk)
+            cls.objects.bulk_update(
+                items, ["synchronized", "sync_failure", "updated", "updated_by"]
+            )
+            if old_failures:
+                SyncFailure.objects.filter(pk__in=old_failures).delete()
+        return len(items) - len(failures)
+
     @classmethod
     def get_xml_with_pre(cls, v3):
         try:
@@ -461,32 +787,34 @@ class PidRequesterXML(CommonControlField):
             # analisa se aceita ou rejeita registro
             cls.evaluate_registration(xml_adapter, registered)
 
-            # verfica os PIDs encontrados no XML / atualiza-os se necessário
-            changed_pids = cls._complete_pids(xml_adapter, registered)
-            if not xml_adapter.v3:
-                raise exceptions.InvalidPidError(
-                    f"Unable to register {filename}, because v3 is invalid"
-                )
+            with transaction.atomic():
+                # verfica os PIDs encontrados no XML / atualiza-os se necessário
+                # (na mesma transação das reservas de PidReservation)
+                changed_pids = cls._complete_pids(xml_adapter, registered)
+                if not xml_adapter.v3:
+                    raise exceptions.InvalidPidError(
+                        f"Unable to register {filename}, because v3 is invalid"
+                    )
 
-            if not xml_adapter.v2:
-                raise exceptions.InvalidPidError(
-                    f"Unable to register {filename}, because v2 is invalid"
-                )
+                if not xml_adapter.v2:
+                    raise exceptions.InvalidPidError(
+                        f"Unable to register {filename}, because v2 is invalid"
+                    )
 
-            # cria ou atualiza registro
-            registered = cls._save(
-                registered,
-                xml_adapter,
-                user,
-                changed_pids,
-                synchronized,
-                error_type,
-                error_msg,
-                traceback,
-            )
+                # cria ou atualiza registro
+                registered = cls._save(
+                    registered,
+                    xml_adapter,
+                    user,
+                    changed_pids,
+                    synchronized,
+                    error_type,
+                    error_msg,
+                    traceback,
+                )
 
-            # cria ou atualiza XMLSPS
-            registered._create_or_update_xmlsps(user, is_published)
+                # cria ou atualiza XMLSPS
+                registered._create_or_update_xmlsps(user, is_published)
 
             # data to return
             data = registered.data.copy()
@@ -548,8 +876,6 @@ class PidRequesterXML(CommonControlField):
 
         registered._add_pid_changes(changed_pids, user)
         registered._add_related_items(xml_adapter, user)
-
-        registered.save()
         return registered
 
     def _add_synchronization_status(self, error_msg, error_type, traceback, user):
@@ -563,8 +889,9 @@ class PidRequesterXML(CommonControlField):
             )
         else:
             self.synchronized = True
-            if self.sync_failure:
-                self.sync_failure.delete()
+            sync_failure, self.sync_failure = self.sync_failure, None
+            if sync_failure:
+                sync_failure.delete()
 
     @classmethod
     def evaluate_registration(cls, xml_adapter, registered):
@@ -588,7 +915,7 @@ class PidRequesterXML(CommonControlField):
         self, user, xml_uri=None, error_type=None, error_msg=None, traceback=None
     ):
         logging.info("PidRequesterXML.set_synchronized")
-        self._add_synchronization_status(error_type, error_msg, traceback)
+        self._add_synchronization_status(error_msg, error_type, traceback, user)
         self.updated_by = user
         self.updated = utcnow()
         self.save()
@@ -614,6 +941,15 @@ class PidRequesterXML(CommonControlField):
         exceptions.QueryDocumentMultipleObjectsReturnedError
         """
         logging.info("PidRequesterXML.check_registration_demand")
+        # caminho rápido: XML idêntico à versão atual de um registro sincronizado
+        registered = cls._get_synchronized_by_finger_print(xml_with_pre)
+        if registered:
+            return dict(
+                registered=registered.data,
+                required_local_registration=False,
+                required_remote_registration=False,
+            )
+
         xml_adapter = xml_sps_adapter.PidProviderXMLAdapter(xml_with_pre)
 
         try:
@@ -638,6 +974,27 @@ class PidRequesterXML(CommonControlField):
             required_remote_registration=required_remote,
         )
 
+    @classmethod
+    def _get_synchronized_by_finger_print(cls, xml_with_pre):
+        """
+        Obtém o registro sincronizado cuja versão atual tem o mesmo
+        finger_print de xml_with_pre, com uma consulta indexada
+
+        Returns
+        -------
+        None or PidRequesterXML
+        """
+        finger_print = getattr(xml_with_pre, "finger_print", None)
+        if not finger_print:
+            return None
+        try:
+            return cls.objects.select_related("sync_failure").get(
+                current_version__finger_print=finger_print,
+                synchronized=True,
+            )
+        except (cls.DoesNotExist, cls.MultipleObjectsReturned):
+            return None
+
     @classmethod
     def get_registered(cls, xml_with_pre):
         """
@@ -694,24 +1051,79 @@ class PidRequesterXML(CommonControlField):
         exceptions.NotEnoughParametersToGetDocumentRecordError
         """
         LOGGER.info("_query_document")
-        items = xml_adapter.query_list
-        for params in items:
-            cls.validate_query_params(params)
-            adapted_params = xml_adapter.adapt_query_params(params)
-
+        params_list = []
+        invalid_params_error = None
+        for params in xml_adapter.query_list:
             try:
-                return cls.objects.get(**adapted_params)
-            except cls.DoesNotExist:
-                continue
-            except cls.MultipleObjectsReturned as e:
-                # seria inesperado já que os dados informados devem encontrar
-                # ocorrência única ou None
-                logging.info(f"params={adapted_params} | e={e}")
-                raise exceptions.QueryDocumentMultipleObjectsReturnedError(
-                    _("Found more than one document matching to {}").format(
-                        adapted_params
+                cls.validate_query_params(params)
+            except exceptions.NotEnoughParametersToGetDocumentRecordError as e:
+                # só é levantada se nenhum dos parâmetros anteriores
+                # encontrar o documento
+                invalid_params_error = e
+                break
+            params_list.append(xml_adapter.adapt_query_params(params))
+
+        if params_list:
+            # obtém todos os candidatos em uma única consulta e
+            # escolhe o documento respeitando a ordem de prioridade
+            candidates = cls._fetch_candidates(params_list)
+            for adapted_params in params_list:
+                found = [
+                    item
+                    for item in candidates
+                    if cls._matches_query_params(item, adapted_params)
+                ]
+                if len(found) == 1:
+                    return found[0]
+                if len(found) > 1:
+                    # seria inesperado já que os dados informados devem encontrar
+                    # ocorrência única ou None
+                    logging.info(f"params={adapted_params} | found={found}")
+                    raise exceptions.QueryDocumentMultipleObjectsReturnedError(
+                        _("Found more than one document matching to {}").format(
+                            adapted_params
+                        )
                     )
-                )
+
+        if invalid_params_error:
+            raise invalid_params_error
+
+    @classmethod
+    def _fetch_candidates(cls, params_list):
+        """
+        Obtém os registros que atendem a qualquer um dos params_list
+        """
+        query = Q()
+        for params in params_list:
+            query |= Q(**params)
+        return list(
+            cls.objects.filter(query).select_related(
+                "journal", "issue", "current_version", "sync_failure"
+            )
+        )
+
+    @classmethod
+    def _matches_query_params(cls, obj, params):
+        if not all(cls._is_python_lookup(key) for key in params.keys()):
+            # lookup não suportado em Python, consulta o banco de dados
+            return cls.objects.filter(pk=obj.pk, **params).exists()
+        return _matches_query_params(obj, params)
+
+    @classmethod
+    def _is_python_lookup(cls, key):
+        """
+        Indica se key (ex.: journal__issn_print, main_doi__iexact) pode
+        ser avaliada por _matches_query_params
+        """
+        names = key.split("__")
+        model = cls
+        for i, name in enumerate(names):
+            try:
+                field = model._meta.get_field(name)
+            except (AttributeError, FieldDoesNotExist):
+                return name in PYTHON_LOOKUPS and i == len(names) - 1
+            model = field.related_model
+        return True
 
     def _add_data(self, xml_adapter, user):
         self.pkg_name = xml_adapter.sps_pkg_name
@@ -735,31 +1147,42 @@ class PidRequesterXML(CommonControlField):
         self.z_partial_body = xml_adapter.z_partial_body
 
     def _add_journal(self, xml_adapter):
-        self.journal = XMLJournal.get_or_create(
-            xml_adapter.journal_issn_electronic,
-            xml_adapter.journal_issn_print,
-        )
+        key = (xml_adapter.journal_issn_electronic, xml_adapter.journal_issn_print)
+        self.journal = xml_journal_cache.get(key)
+        if not self.journal:
+            self.journal = XMLJournal.get_or_create(*key)
+            xml_journal_cache.add(key, self.journal)
 
     def _add_issue(self, xml_adapter, journal):
         if xml_adapter.volume or xml_adapter.number or xml_adapter.suppl:
-            self.issue = XMLIssue.get_or_create(
-                journal,
+            key = (
+                journal and journal.pk,
                 xml_adapter.volume,
                 xml_adapter.number,
                 xml_adapter.suppl,
                 xml_adapter.pub_year,
             )
+            self.issue = xml_issue_cache.get(key)
+            if not self.issue:
+                self.issue = XMLIssue.get_or_create(journal, *key[1:])
+                xml_issue_cache.add(key, self.issue)
 
     def _add_current_version(self, xml_adapter, user):
         self.current_version = XMLVersion.get_or_create(user, xml_adapter.xml_with_pre)
 
     def _add_related_items(self, xml_adapter, creator):
-        if xml_adapter.related_items:
-            self.save()
-        for related in xml_adapter.related_items:
-            self.related_items.add(
-                XMLRelatedItem.get_or_create(related["href"], creator)
-            )
+        # requires self.pk
+        main_dois = {related["href"] for related in xml_adapter.related_items}
+        if not main_dois:
+            return
+        XMLRelatedItem.objects.bulk_create(
+            [
+                XMLRelatedItem(main_doi=main_doi, creator=creator)
+                for main_doi in main_dois
+            ],
+            ignore_conflicts=True,
+        )
+        self.related_items.add(*XMLRelatedItem.objects.filter(main_doi__in=main_dois))
 
     def _add_pid_changes(self, changed_pids, user):
         # requires registered.current_version is set
@@ -769,26 +1192,41 @@ class PidRequesterXML(CommonControlField):
             raise ValueError(
                 "PidRequesterXML._add_pid_changes requires current_version is set"
             )
+        # ignore_conflicts não evita duplicidade de linhas com colunas NULL
+        # (ex.: new), pois NULL não conflita na restrição de unicidade
+        registered = set(
+            PidChange.objects.filter(version=self.current_version).values_list(
+                "pid_type", "old", "new"
+            )
+        )
+        changes = []
         for change_args in changed_pids:
-            if change_args["old"]:
-                # somente registra as mudanças de um old não vazio
-                change_args["user"] = user
-                change_args["version"] = self.current_version
-                change = PidChange.get_or_create(**change_args)
+            key = (change_args["pid_type"], change_args["old"], change_args["new"])
+            # somente registra as mudanças de um old não vazio
+            if not change_args["old"] or key in registered:
+                continue
+            registered.add(key)
+            changes.append(
+                PidChange(
+                    creator=user,
+                    pid_type=change_args["pid_type"],
+                    old=change_args["old"],
+                    new=change_args["new"],
+                    version=self.current_version,
+                )
+            )
+        PidChange.objects.bulk_create(changes, ignore_conflicts=True)
 
     @classmethod
     def _get_unique_v3(cls):
         """
-        Generate v3 and return it only if it is new
+        Return a new v3, reserved in advance by PidReservation
 
         Returns
         -------
             str
         """
-        while True:
-            generated = v3_gen.generates()
-            if not cls._is_registered_pid(v3=generated):
-                return generated
+        return PidReservation.next_v3()
 
     @classmethod
     def _is_registered_pid(cls, v2=None, v3=None, aop_pid=None):
@@ -807,28 +1245,16 @@ class PidRequesterXML(CommonControlField):
             else:
                 return True
 
-    @classmethod
-    def _v2_generates(cls, xml_adapter):
-        # '2022-10-19T13:51:33.830085'
-        h = utcnow()
-        mm = str(h.month).zfill(2)
-        dd = str(h.day).zfill(2)
-        nnnnn = str(h.timestamp()).split(".")[0][-5:]
-        return f"{xml_adapter.v2_prefix}{mm}{dd}{nnnnn}"
-
     @classmethod
     def _get_unique_v2(cls, xml_adapter):
         """
-        Generate v2 and return it only if it is new
+        Return a new v2, reserved in advance by PidReservation
 
         Returns
         -------
             str
         """
-        while True:
-            generated = cls._v2_generates(xml_adapter)
-            if not cls._is_registered_pid(v2=generated):
-                return generated
+        return PidReservation.next_v2(xml_adapter.v2_prefix)
 
     @classmethod
     def _complete_pids(cls, xml_adapter, registered):
@@ -0,0 +1,18 @@
+from django.utils.translation import gettext_lazy as _
+
+from core.utils.scheduler import schedule_task
+
+
+def run():
+    schedule_task(
+        task="expire_pid_reservations",
+        name="expire_pid_reservations",
+        kwargs={},
+        description=_("Remove as reservas de PIDs antigas"),
+        priority=3,
+        enabled=True,
+        run_once=False,
+        day_of_week="*",
+        hour="3",
+        minute="15",
+    )
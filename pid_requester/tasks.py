@@ -1,9 +1,12 @@
 import logging
+import time
 
+from celery import chord
 from django.contrib.auth import get_user_model
 
 from config import celery_app
 from pid_requester.controller import PidRequester
+from pid_requester.models import PidRequesterXML, PidReservation
 
 User = get_user_model()
 
@@ -24,12 +27,101 @@ def request_pid_for_file(
     username=None,
     file_path=None,
     is_published=None,
+    batch_size=None,
+    concurrency=None,
 ):
     user = _get_user(self.request, username=username)
 
-    pid_requester = PidRequester()
+    pid_requester = PidRequester(concurrency=concurrency)
     for resp in pid_requester.request_pid_for_xml_zip(
-        file_path, user, is_published=is_published
+        file_path, user, is_published=is_published, batch_size=batch_size
     ):
         logging.info(resp)
     # return response
+
+
+@celery_app.task(bind=True, name="synchronize_pid_requester_xml")
+def synchronize_pid_requester_xml(
+    self,
+    username=None,
+    user_id=None,
+    concurrency=None,
+):
+    user = _get_user(self.request, username=username, user_id=user_id)
+
+    pid_requester = PidRequester(concurrency=concurrency)
+    pid_requester.synchronize(user)
+
+
+@celery_app.task(bind=True, name="synchronize_pid_requester_xml_in_chunks")
+def task_synchronize_pid_requester_xml_in_chunks(
+    self,
+    username=None,
+    user_id=None,
+    chunk_size=None,
+    concurrency=None,
+):
+    """
+    Divide os registros não sincronizados em intervalos de pk e
+    distribui a sincronização de cada intervalo entre os workers
+    """
+    user = _get_user(self.request, username=username, user_id=user_id)
+
+    header = [
+        task_synchronize_pid_requester_xml_chunk.s(
+            user_id=user.id,
+            first_pk=first_pk,
+            last_pk=last_pk,
+            concurrency=concurrency,
+        )
+        for first_pk, last_pk, total in PidRequesterXML.unsynchronized_pk_ranges(
+            chunk_size or 500
+        )
+    ]
+    logging.info(f"synchronize_pid_requester_xml_in_chunks: {len(header)} chunks")
+    if header:
+        chord(header)(
+            task_report_pid_requester_xml_synchronization.s(started=time.time())
+        )
+
+
+@celery_app.task(bind=True, name="synchronize_pid_requester_xml_chunk")
+def task_synchronize_pid_requester_xml_chunk(
+    self,
+    user_id,
+    first_pk,
+    last_pk,
+    concurrency=None,
+):
+    user = _get_user(self.request, user_id=user_id)
+
+    pid_requester = PidRequester(concurrency=concurrency)
+    return pid_requester.synchronize_range(user, first_pk, last_pk)
+
+
+@celery_app.task(bind=True, name="report_pid_requester_xml_synchronization")
+def task_report_pid_requester_xml_synchronization(
+    self,
+    results,
+    started,
+):
+    total = sum(item["total"] for item in results)
+    synchronized = sum(item["synchronized"] for item in results)
+    elapsed = time.time() - started
+    report = {
+        "chunks": len(results),
+        "total": total,
+        "synchronized": synchronized,
+        "failed": total - synchronized,
+        "elapsed": elapsed,
+        "items_per_second": elapsed and total / elapsed,
+    }
+    logging.info(f"report_pid_requester_xml_synchronization: {report}")
+    return report
+
+
+@celery_app.task(bind=True, name="expire_pid_reservations")
+def task_expire_pid_reservations(self, max_age=None):
+    deleted = PidReservation.expire(max_age)
+    logging.info(f"expire_pid_reservations: {deleted}")
+    return deleted
@@ -1,16 +1,22 @@
+import asyncio
+from contextlib import asynccontextmanager
 from unittest.mock import ANY, MagicMock, Mock, patch
 
+import aiohttp
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from packtools.sps.pid_provider.xml_sps_lib import XMLWithPre
+from tenacity import wait_none
 
-from pid_requester.controller import PidRequester
+from pid_requester import exceptions
+from pid_requester.controller import AsyncPidProviderAPI, PidProviderAPI, PidRequester
 from pid_requester.models import (
     PidProviderConfig,
     PidRequesterXML,
     SyncFailure,
     XMLVersion,
 )
+from pid_requester.utils import token_cache
 
 User = get_user_model()
 
@@ -192,3 +198,325 @@ class PidRequesterTest(TestCase):
         self.assertEqual("2236-8906-hoehnea-49-e1082020.xml", result[0]["filename"])
         self.assertEqual("registered_v3", result[0]["v3"])
         self.assertIsNotNone(result[0]["xml_with_pre"])
+
+
+class PidRequesterBatchTest(TestCase):
+    @patch("pid_requester.controller.PidRequesterXML.register")
+    @patch("pid_requester.controller.PidProviderAPI.provide_pid_for_batch")
+    @patch("pid_requester.controller.PidRequesterXML.check_registration_demand")
+    def test_request_pid_for_xml_batch_posts_only_required_and_keeps_order(
+        self,
+        mock_check_registration_demand,
+        mock_provide_pid_for_batch,
+        mock_register,
+    ):
+        xml_a = Mock(XMLWithPre)
+        xml_a.filename = "a.xml"
+        xml_b = Mock(XMLWithPre)
+        xml_b.filename = "b.xml"
+        xml_c = Mock(XMLWithPre)
+        xml_c.filename = "c.xml"
+
+        mock_check_registration_demand.side_effect = [
+            {
+                "registered": {},
+                "required_local_registration": True,
+                "required_remote_registration": True,
+            },
+            {
+                "registered": {"v3": "registered_v3"},
+                "required_local_registration": False,
+                "required_remote_registration": False,
+            },
+            {
+                "registered": {},
+                "required_local_registration": True,
+                "required_remote_registration": True,
+            },
+        ]
+        mock_provide_pid_for_batch.return_value = [
+            {"xml_uri": "https://a.xml"},
+            {"error_type": "error", "error_msg": "msg"},
+        ]
+        mock_register.side_effect = [{"v3": "v3_a"}, {"v3": "v3_c"}]
+
+        pid_requester_ = PidRequester()
+        result = pid_requester_.request_pid_for_xml_batch(
+            [xml_a, xml_b, xml_c], user=None
+        )
+
+        mock_provide_pid_for_batch.assert_called_once_with(
+            [(xml_a, "a.xml"), (xml_c, "c.xml")]
+        )
+        self.assertEqual(
+            ["v3_a", "registered_v3", "v3_c"], [item["v3"] for item in result]
+        )
+        self.assertEqual(
+            ["a.xml", "b.xml", "c.xml"], [item["filename"] for item in result]
+        )
+        self.assertTrue(mock_register.call_args_list[0].kwargs["synchronized"])
+        self.assertFalse(mock_register.call_args_list[1].kwargs["synchronized"])
+        self.assertEqual("error", mock_register.call_args_list[1].kwargs["error_type"])
+
+
+class PidProviderAPITokenTest(TestCase):
+    def _api(self):
+        return PidProviderAPI(
+            pid_provider_api_post_xml="https://post_xml_uri",
+            pid_provider_api_get_token="https://get_token",
+            api_username="username",
+            api_password="password",
+        )
+
+    @patch("pid_requester.controller.token_cache.get", return_value=None)
+    @patch("pid_requester.controller.token_cache.set")
+    @patch("pid_requester.controller.PidProviderAPI._request_token")
+    @patch("pid_requester.controller.PidProviderAPI._prepare_and_post_xml")
+    def test_provide_pid_refreshes_token_once_when_unauthorized(
+        self,
+        mock_prepare_and_post_xml,
+        mock_request_token,
+        mock_token_cache_set,
+        mock_token_cache_get,
+    ):
+        mock_request_token.side_effect = ["expired", "fresh"]
+        mock_prepare_and_post_xml.side_effect = [
+            exceptions.APIPidProviderUnauthorizedError("401"),
+            [{"v3": "v3"}],
+        ]
+
+        result = self._api().provide_pid(Mock(XMLWithPre), "a.xml")
+
+        self.assertEqual({"v3": "v3"}, result)
+        self.assertEqual(2, mock_request_token.call_count)
+        self.assertEqual("fresh", mock_prepare_and_post_xml.call_args.args[-1])
+
+    @patch("pid_requester.controller.token_cache.get", return_value="cached")
+    @patch("pid_requester.controller.PidProviderAPI._request_token")
+    def test_get_token_returns_cached_token(
+        self,
+        mock_request_token,
+        mock_token_cache_get,
+    ):
+        token = self._api()._get_token("username", "password", 15)
+        self.assertEqual("cached", token)
+        mock_request_token.assert_not_called()
+
+
+class PidRequesterSynchronizeTest(TestCase):
+    @patch("pid_requester.controller.AsyncPidProviderAPI.provide_pid_for_batch")
+    @patch("pid_requester.controller.PidRequesterXML.unsynchronized")
+    def test_synchronize_with_concurrency_uses_async_api(
+        self,
+        mock_unsynchronized,
+        mock_provide_pid_for_batch,
+    ):
+        item_a = Mock(PidRequesterXML)
+        item_a.pkg_name = "a"
+        item_b = Mock(PidRequesterXML)
+        item_b.pkg_name = "b"
+        mock_unsynchronized.return_value = iter([item_a, item_b])
+        mock_provide_pid_for_batch.return_value = [
+            {"xml_uri": "https://a.xml"},
+            {"error_type": "error", "error_msg": "msg"},
+        ]
+
+        pid_requester_ = PidRequester(concurrency=2)
+        pid_requester_.pid_provider_api._pid_provider_api_post_xml = "https://post"
+        pid_requester_.synchronize(user=None)
+
+        mock_provide_pid_for_batch.assert_called_once_with(
+            [(item_a.xml_with_pre, "a"), (item_b.xml_with_pre, "b")]
+        )
+        item_a.set_synchronized.assert_called_once_with(
+            None,
+            xml_uri="https://a.xml",
+            error_type=None,
+            error_msg=None,
+            traceback=None,
+        )
+        item_b.set_synchronized.assert_called_once_with(
+            None,
+            xml_uri=None,
+            error_type="error",
+            error_msg="msg",
+            traceback=None,
+        )
+
+
+class _FakeResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self.payload = payload
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(Mock(), (), status=self.status)
+
+    async def json(self, content_type=None):
+        return self.payload
+
+
+class _FakeClientSession:
+    """
+    Substitui aiohttp.ClientSession; respond(url, kwargs) é a corrotina que
+    retorna (status, payload) de cada requisição ou levanta uma exceção
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.active = 0
+        self.max_active = 0
+        self.posts = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    @asynccontextmanager
+    async def post(self, url, **kwargs):
+        self.posts.append((url, kwargs))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            yield _FakeResponse(*await self.respond(url, kwargs))
+        finally:
+            self.active -= 1
+
+
+def _posted_filename(kwargs):
+    # "attachment; filename=a.zip" -> "a.xml"
+    return kwargs["headers"]["Content-Disposition"].split("=")[-1][:-4] + ".xml"
+
+
+class AsyncPidProviderAPIBatchTest(TestCase):
+    def setUp(self):
+        token_cache._tokens.clear()
+        self.token_requests = 0
+
+    def tearDown(self):
+        token_cache._tokens.clear()
+
+    def _api(self, concurrency=10):
+        return AsyncPidProviderAPI(
+            concurrency=concurrency,
+            pid_provider_api_post_xml="https://post_xml_uri",
+            pid_provider_api_get_token="https://get_token",
+            api_username="username",
+            api_password="password",
+        )
+
+    def _items(self, *names):
+        items = []
+        for name in names:
+            xml_with_pre = Mock(XMLWithPre)
+            xml_with_pre.tostring.return_value = b"<article/>"
+            items.append((xml_with_pre, name))
+        return items
+
+    async def _respond_token(self):
+        self.token_requests += 1
+        return 200, {"access": f"token-{self.token_requests}"}
+
+    def _run(self, api, items, respond):
+        session = _FakeClientSession(respond)
+        with patch("pid_requester.controller.aiohttp.TCPConnector"), patch(
+            "pid_requester.controller.aiohttp.ClientSession", return_value=session
+        ):
+            results = asyncio.run(api.aprovide_pid_for_batch(items))
+        xml_posts = [
+            kwargs for url, kwargs in session.posts if url != "https://get_token"
+        ]
+        return results, session, xml_posts
+
+    def test_aprovide_pid_for_batch_keeps_the_order_of_the_items(self):
+        delays = {"a.xml": 0.03, "b.xml": 0.02, "c.xml": 0.01}
+
+        async def respond(url, kwargs):
+            if url == "https://get_token":
+                return await self._respond_token()
+            filename = _posted_filename(kwargs)
+            await asyncio.sleep(delays[filename])
+            return 200, [{"filename": filename}]
+
+        results, session, xml_posts = self._run(
+            self._api(), self._items("a.xml", "b.xml", "c.xml"), respond
+        )
+
+        self.assertEqual(
+            ["a.xml", "b.xml", "c.xml"], [item["filename"] for item in results]
+        )
+
+    def test_aprovide_pid_for_batch_limits_the_concurrent_requests(self):
+        async def respond(url, kwargs):
+            if url == "https://get_token":
+                return await self._respond_token()
+            await asyncio.sleep(0.01)
+            return 200, [{"filename": _posted_filename(kwargs)}]
+
+        results, session, xml_posts = self._run(
+            self._api(concurrency=2),
+            self._items("a.xml", "b.xml", "c.xml", "d.xml", "e.xml"),
+            respond,
+        )
+
+        self.assertEqual(5, len(xml_posts))
+        self.assertEqual(2, session.max_active)
+
+    def test_aprovide_pid_for_batch_refreshes_the_refused_token_once(self):
+        async def respond(url, kwargs):
+            if url == "https://get_token":
+                return await self._respond_token()
+            await asyncio.sleep(0.01)
+            if kwargs["headers"]["Authorization"] == "Bearer token-1":
+                return 401, {}
+            return 200, [{"filename": _posted_filename(kwargs)}]
+
+        results, session, xml_posts = self._run(
+            self._api(), self._items("a.xml", "b.xml"), respond
+        )
+
+        self.assertEqual(2, self.token_requests)
+        self.assertEqual(["a.xml", "b.xml"], [item["filename"] for item in results])
+        self.assertEqual(
+            ["Bearer token-2", "Bearer token-2"],
+            [kwargs["headers"]["Authorization"] for kwargs in xml_posts[2:]],
+        )
+
+    @patch.object(AsyncPidProviderAPI._apost.retry, "wait", wait_none())
+    def test_aprovide_pid_for_batch_retries_retryable_errors(self):
+        failures = [aiohttp.ClientConnectionError("reset"), (503, {})]
+
+        async def respond(url, kwargs):
+            if url == "https://get_token":
+                return await self._respond_token()
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return 200, [{"filename": _posted_filename(kwargs)}]
+
+        results, session, xml_posts = self._run(
+            self._api(), self._items("a.xml"), respond
+        )
+
+        self.assertEqual([{"filename": "a.xml"}], results)
+        self.assertEqual(3, len(xml_posts))
+
+    def test_aprovide_pid_returns_error_for_empty_response(self):
+        async def respond(url, kwargs):
+            if url == "https://get_token":
+                return await self._respond_token()
+            return 200, []
+
+        results, session, xml_posts = self._run(
+            self._api(), self._items("a.xml"), respond
+        )
+
+        self.assertEqual(
+            str(exceptions.APIPidProviderPostError), results[0]["error_type"]
+        )
+        self.assertIn("a.xml", results[0]["error_msg"])
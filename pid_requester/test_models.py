@@ -1,10 +1,12 @@
 import logging
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 from unittest import mock
 from unittest.mock import ANY, MagicMock, Mock, call, patch
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
 from lxml import etree
 from packtools.sps.pid_provider.xml_sps_adapter import PidProviderXMLAdapter
 from packtools.sps.pid_provider.xml_sps_lib import XMLWithPre
@@ -228,87 +230,109 @@ class PidRequesterXMLValidateQueryParamsTest(TestCase):
     "pid_requester.models.PidRequesterXML.validate_query_params",
     return_value=True,
 )
-@patch("pid_requester.models.PidRequesterXML.objects.get")
+@patch("pid_requester.models.PidRequesterXML._fetch_candidates")
 class PidRequesterXMLQueryDocumentTest(TestCase):
     def test_query_document_is_called_with_query_params(
         self,
-        mock_get,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
         """
         PidRequesterXML._query_document is called with parameters returned by
-        PidRequesterXML.query_list
+        PidRequesterXML.query_list, in a single query
         """
         params_list = [
-            {"key": "value"},
+            {"v3": "value"},
+            {"v3": "value2"},
         ]
         mock_query_list.return_value = params_list
-        mock_get.side_effect = models.PidRequesterXML.DoesNotExist
+        mock_fetch_candidates.return_value = []
         xml_adapter = _get_xml_adapter()
         result = models.PidRequesterXML._query_document(xml_adapter)
-        mock_get.assert_called_once_with(**{"key": "value"})
+        mock_fetch_candidates.assert_called_once_with(
+            [{"v3": "value"}, {"v3": "value2"}]
+        )
 
     def test_query_document_returns_none_if_document_does_not_exist(
         self,
-        mock_get,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
         params_list = [
-            {"key": "value"},
+            {"v3": "value"},
         ]
         mock_query_list.return_value = params_list
-        mock_get.side_effect = models.PidRequesterXML.DoesNotExist
+        mock_fetch_candidates.return_value = []
         xml_adapter = _get_xml_adapter()
         result = models.PidRequesterXML._query_document(xml_adapter)
         self.assertIsNone(result)
 
     def test_query_document_returns_found_document(
         self,
-        mock_get,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
         params_list = [
-            {"key": "value"},
+            {"v3": "value"},
         ]
         mock_query_list.return_value = params_list
-        mock_get.return_value = models.PidRequesterXML()
+        mock_fetch_candidates.return_value = [models.PidRequesterXML(v3="value")]
         xml_adapter = _get_xml_adapter()
         result = models.PidRequesterXML._query_document(xml_adapter)
         self.assertEqual(models.PidRequesterXML, type(result))
 
     def test_query_document_returns_found_item_at_the_second_round(
         self,
-        mock_get,
+        mock_fetch_candidates,
+        mock_validate_params,
+        mock_query_list,
+    ):
+        params_list = [
+            {"v3": "value"},
+            {"v3": "value2"},
+        ]
+        mock_query_list.return_value = params_list
+        mock_fetch_candidates.return_value = [models.PidRequesterXML(v3="value2")]
+        xml_adapter = _get_xml_adapter()
+        result = models.PidRequesterXML._query_document(xml_adapter)
+        self.assertEqual("value2", result.v3)
+
+    def test_query_document_respects_the_priority_order(
+        self,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
         params_list = [
-            {"key": "value"},
-            {"key": "value2"},
+            {"v3": "value"},
+            {"v3": "value2"},
         ]
         mock_query_list.return_value = params_list
-        mock_get.side_effect = [
-            models.PidRequesterXML.DoesNotExist,
-            models.PidRequesterXML(),
+        mock_fetch_candidates.return_value = [
+            models.PidRequesterXML(v3="value2"),
+            models.PidRequesterXML(v3="value"),
         ]
         xml_adapter = _get_xml_adapter()
         result = models.PidRequesterXML._query_document(xml_adapter)
-        self.assertEqual(models.PidRequesterXML, type(result))
+        self.assertEqual("value", result.v3)
 
     def test_query_document_raises_query_document_error_because_multiple_objects_returned(
         self,
-        mock_get,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
         params_list = [
-            {"key": "value"},
+            {"v3": "value"},
         ]
         mock_query_list.return_value = params_list
-        mock_get.side_effect = models.PidRequesterXML.MultipleObjectsReturned
+        mock_fetch_candidates.return_value = [
+            models.PidRequesterXML(v3="value"),
+            models.PidRequesterXML(v3="value"),
+        ]
         with self.assertRaises(
             exceptions.QueryDocumentMultipleObjectsReturnedError
         ) as exc:
@@ -317,7 +341,7 @@ class PidRequesterXMLQueryDocumentTest(TestCase):
 
     def test_query_document_raises_error(
         self,
-        mock_get,
+        mock_fetch_candidates,
         mock_validate_params,
         mock_query_list,
     ):
@@ -326,7 +350,7 @@ class PidRequesterXMLQueryDocumentTest(TestCase):
         PidRequesterXML.query_list
         """
         params_list = [
-            {"key": "value"},
+            {"v3": "value"},
         ]
         mock_query_list.return_value = params_list
         mock_validate_params.side_effect = (
@@ -338,6 +362,33 @@ class PidRequesterXMLQueryDocumentTest(TestCase):
             result = models.PidRequesterXML._query_document(xml_adapter)
 
 
+class PidRequesterXMLMatchesQueryParamsTest(TestCase):
+    def test_matches_query_params_follows_related_fields_and_lookups(self):
+        journal = models.XMLJournal(issn_print="1234-5678")
+        item = models.PidRequesterXML(journal=journal, main_doi="10.1/ABC")
+        self.assertTrue(
+            models._matches_query_params(
+                item,
+                {
+                    "journal__issn_print": "1234-5678",
+                    "main_doi__iexact": "10.1/abc",
+                    "issue__isnull": True,
+                    "issue__volume": None,
+                },
+            )
+        )
+        self.assertFalse(
+            models._matches_query_params(item, {"journal__issn_electronic": "x"})
+        )
+
+    def test_is_python_lookup(self):
+        self.assertTrue(models.PidRequesterXML._is_python_lookup("journal__issn_print"))
+        self.assertTrue(models.PidRequesterXML._is_python_lookup("main_doi__iexact"))
+        self.assertFalse(
+            models.PidRequesterXML._is_python_lookup("main_doi__startswith")
+        )
+
+
 @patch("pid_requester.models.PidRequesterXML._query_document")
 class PidRequesterXMLGetRegisteredTest(TestCase):
     def setUp(self):
@@ -844,3 +895,198 @@ class PidRequesterGetRegistrationDemandTest(TestCase):
         self.assertIsNotNone(demand["registered"])
         self.assertTrue(demand["required_remote_registration"])
         self.assertTrue(demand["required_local_registration"])
+
+
+class PidRequesterXMLBulkSynchronizationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="bulk-sync")
+        self.items = [
+            models.PidRequesterXML.objects.create(
+                creator=self.user, pkg_name=f"pkg{i}", synchronized=False
+            )
+            for i in range(5)
+        ]
+
+    def test_unsynchronized_pk_ranges(self):
+        ranges = list(models.PidRequesterXML.unsynchronized_pk_ranges(2))
+        self.assertEqual([2, 2, 1], [total for first, last, total in ranges])
+        self.assertEqual(self.items[0].pk, ranges[0][0])
+        self.assertEqual(self.items[-1].pk, ranges[-1][1])
+
+    def test_bulk_set_synchronized(self):
+        items = list(
+            models.PidRequesterXML.unsynchronized_in_range(
+                self.items[0].pk, self.items[1].pk
+            )
+        )
+        result = models.PidRequesterXML.bulk_set_synchronized(
+            items,
+            [{"xml_uri": "https://a.xml"}, {"error_type": "err", "error_msg": "msg"}],
+            self.user,
+        )
+        self.assertEqual(1, result)
+
+        first = models.PidRequesterXML.objects.get(pk=self.items[0].pk)
+        second = models.PidRequesterXML.objects.get(pk=self.items[1].pk)
+        self.assertTrue(first.synchronized)
+        self.assertIsNone(first.sync_failure)
+        self.assertFalse(second.synchronized)
+        self.assertEqual("msg", second.sync_failure.error_msg)
+
+
+class PidReservationTest(TestCase):
+    def setUp(self):
+        models.PidReservation._pools.clear()
+
+    def tearDown(self):
+        models.PidReservation._pools.clear()
+
+    def test_reserve_ignores_pids_reserved_by_others(self):
+        models.PidReservation.objects.create(
+            pid_type="v3", value="123456789012345678901v3", owner="other"
+        )
+        reserved = models.PidReservation.reserve(
+            "v3", ["123456789012345678901v3", "223456789012345678901v3"]
+        )
+        self.assertEqual(["223456789012345678901v3"], reserved)
+
+    def test_reserve_ignores_registered_pids(self):
+        user = User.objects.create(username="pid-reservation")
+        models.PidRequesterXML.objects.create(
+            creator=user, v2="S1806-37132022000201100"
+        )
+        reserved = models.PidReservation.reserve(
+            "v2", ["S1806-37132022000201100", "S1806-37132022000201101"]
+        )
+        self.assertEqual(["S1806-37132022000201101"], reserved)
+
+    def test_next_v2_returns_distinct_values_with_prefix(self):
+        values = [models.PidReservation.next_v2("S1806-37132022") for i in range(3)]
+        self.assertEqual(3, len(set(values)))
+        for value in values:
+            self.assertEqual(23, len(value))
+            self.assertTrue(value.startswith("S1806-37132022"))
+
+    @patch("pid_requester.models.utcnow")
+    def test_next_v2_uses_the_date_of_use(self, mock_utcnow):
+        mock_utcnow.return_value = datetime(2022, 10, 19)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = models.PidReservation.next_v2("S1806-37132022")
+        mock_utcnow.return_value = datetime(2022, 10, 20)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = models.PidReservation.next_v2("S1806-37132022")
+        self.assertTrue(first.startswith("S1806-371320221019"))
+        self.assertTrue(second.startswith("S1806-371320221020"))
+        self.assertEqual(
+            [("v2", "S1806-371320221020")], list(models.PidReservation._pools)
+        )
+
+    def test_next_v3_pools_the_block_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            models.PidReservation.next_v3()
+        self.assertEqual({}, models.PidReservation._pools)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            models.PID_BLOCK_SIZE - 1,
+            len(models.PidReservation._pools[("v3", None)]),
+        )
+
+    def test_next_v3_discards_pooled_pids_older_than_max_age(self):
+        now = timezone.now()
+        models.PidReservation._pools[("v3", None)] = deque(
+            [
+                (now - timedelta(seconds=models.PID_RESERVATION_MAX_AGE + 1), "OLD"),
+                (now, "123456789012345678901v3"),
+            ]
+        )
+        self.assertEqual("123456789012345678901v3", models.PidReservation.next_v3())
+        self.assertEqual(0, len(models.PidReservation._pools[("v3", None)]))
+
+    def test_expire_removes_old_reservations(self):
+        models.PidReservation.objects.create(
+            pid_type="v3", value="123456789012345678901v3", owner="old"
+        )
+        self.assertEqual(0, models.PidReservation.expire(max_age=60))
+        self.assertEqual(1, models.PidReservation.expire(max_age=0))
+        self.assertFalse(models.PidReservation.objects.exists())
+
+
+@patch("pid_requester.models.PidRequesterXML._query_document")
+class PidRequesterGetRegistrationDemandByFingerPrintTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="finger-print")
+        self.version = models.XMLVersion.objects.create(
+            creator=user, pid_v3="123456789012345678901v3", finger_print="FP"
+        )
+        self.registered = models.PidRequesterXML.objects.create(
+            creator=user,
+            v3="123456789012345678901v3",
+            current_version=self.version,
+            synchronized=True,
+        )
+
+    def test_check_registration_demand_uses_finger_print(self, mock_query_document):
+        xml_with_pre = Mock(XMLWithPre)
+        xml_with_pre.finger_print = "FP"
+        demand = models.PidRequesterXML.check_registration_demand(xml_with_pre)
+
+        mock_query_document.assert_not_called()
+        self.assertEqual("123456789012345678901v3", demand["registered"]["v3"])
+        self.assertFalse(demand["required_remote_registration"])
+        self.assertFalse(demand["required_local_registration"])
+
+    def test_check_registration_demand_ignores_unsynchronized(
+        self, mock_query_document
+    ):
+        self.registered.synchronized = False
+        self.registered.save()
+        mock_query_document.return_value = None
+        xml_with_pre = Mock(XMLWithPre)
+        xml_with_pre.finger_print = "FP"
+        demand = models.PidRequesterXML.check_registration_demand(xml_with_pre)
+
+        mock_query_document.assert_called_once()
+        self.assertTrue(demand["required_remote_registration"])
+
+
+class PidRequesterXMLBulkWritesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="bulk-writes")
+        self.version = models.XMLVersion.objects.create(
+            creator=self.user, pid_v3="123456789012345678901v3", finger_print="FP"
+        )
+        self.registered = models.PidRequesterXML.objects.create(
+            creator=self.user, current_version=self.version
+        )
+
+    def test_add_pid_changes_creates_each_change_once(self):
+        changed_pids = [
+            {"pid_type": "pid_v3", "old": "OLD", "new": "123456789012345678901v3"},
+            {"pid_type": "pid_v2", "old": None, "new": "S1806-37132022000201100"},
+        ]
+        self.registered._add_pid_changes(changed_pids, self.user)
+        self.registered._add_pid_changes(changed_pids, self.user)
+
+        self.assertEqual(1, models.PidChange.objects.count())
+        self.assertEqual("OLD", models.PidChange.objects.first().old)
+
+    def test_add_pid_changes_creates_change_without_new_once(self):
+        changed_pids = [{"pid_type": "aop_pid", "old": "OLD", "new": None}]
+        self.registered._add_pid_changes(changed_pids, self.user)
+        self.registered._add_pid_changes(changed_pids, self.user)
+
+        self.assertEqual(1, models.PidChange.objects.count())
+
+    def test_add_related_items_reuses_existing_items(self):
+        models.XMLRelatedItem.objects.create(creator=self.user, main_doi="10.1/a")
+        xml_adapter = Mock(PidProviderXMLAdapter)
+        xml_adapter.related_items = [{"href": "10.1/a"}, {"href": "10.1/b"}]
+
+        self.registered._add_related_items(xml_adapter, self.user)
+
+        self.assertEqual(2, models.XMLRelatedItem.objects.count())
+        self.assertEqual(
+            {"10.1/a", "10.1/b"},
+            set(self.registered.related_items.values_list("main_doi", flat=True)),
+        )
@@ -0,0 +1,88 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import SimpleTestCase
+
+from pid_requester.utils import requester
+
+
+class GetSessionTest(SimpleTestCase):
+    def setUp(self):
+        requester.close_sessions()
+
+    def tearDown(self):
+        requester.close_sessions()
+
+    def test_get_session_reuses_the_session_of_the_same_host(self):
+        session = requester.get_session("https://pid.scielo.org/api/v2/auth")
+        self.assertIs(
+            session, requester.get_session("https://pid.scielo.org/api/v2/pid")
+        )
+
+    def test_get_session_returns_one_session_per_host(self):
+        self.assertIsNot(
+            requester.get_session("https://pid.scielo.org/api/v2/pid"),
+            requester.get_session("https://other.scielo.org/api/v2/pid"),
+        )
+
+    def test_get_session_distinguishes_scheme_and_port(self):
+        session = requester.get_session("https://pid.scielo.org/api")
+        self.assertIsNot(session, requester.get_session("http://pid.scielo.org/api"))
+        self.assertIsNot(
+            session, requester.get_session("https://pid.scielo.org:8443/api")
+        )
+
+    def test_close_sessions_discards_the_sessions(self):
+        session = requester.get_session("https://pid.scielo.org/api")
+        requester.close_sessions()
+        self.assertEqual({}, requester._sessions)
+        self.assertIsNot(session, requester.get_session("https://pid.scielo.org/api"))
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionStatsTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%s/api/v2/pid" % self.server.server_port
+        self.key = "http://127.0.0.1:%s" % self.server.server_port
+        requester.close_sessions()
+        requester.connection_stats(reset=True)
+
+    def tearDown(self):
+        requester.close_sessions()
+        requester.connection_stats(reset=True)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_session_reuses_the_connection(self):
+        session = requester.get_session(self.url)
+        for i in range(3):
+            requester.post_data(self.url, data={"i": i}, json=True, session=session)
+
+        self.assertEqual(
+            {"requests": 3, "connections": 1, "reused": 2},
+            requester.connection_stats()[self.key],
+        )
+
+    def test_reset_clears_the_stats(self):
+        requester.post_data(
+            self.url, json=True, session=requester.get_session(self.url)
+        )
+        self.assertIn(self.key, requester.connection_stats(reset=True))
+        self.assertEqual({}, requester.connection_stats())
@@ -1,17 +1,35 @@
 import logging
 import re
+import threading
+from urllib.parse import urlparse
 
 import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 from tenacity import (
     retry,
     retry_if_exception_type,
     stop_after_attempt,
     wait_exponential,
 )
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util import Retry
 
 logger = logging.getLogger(__name__)
 
+# quantidade de hosts cujas conexões são mantidas por sessão
+POOL_CONNECTIONS = getattr(settings, "PID_PROVIDER_POOL_CONNECTIONS", 10)
+# quantidade máxima de conexões mantidas por host
+POOL_MAXSIZE = getattr(settings, "PID_PROVIDER_POOL_MAXSIZE", 10)
+# se True, aguarda uma conexão livre em vez de abrir uma além de POOL_MAXSIZE
+POOL_BLOCK = getattr(settings, "PID_PROVIDER_POOL_BLOCK", False)
+
+_sessions_lock = threading.Lock()
+_sessions = {}
+
+_connection_stats_lock = threading.Lock()
+_connection_stats = {}
+
 
 class RetryableError(Exception):
     """Recoverable error without having to modify the data state on the client
@@ -30,6 +48,93 @@ def _add_param(params, name, value):
         params[name] = value
 
 
+def _session_key(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _count(pool, name):
+    key = f"{pool.scheme}://{pool.host}:{pool.port}"
+    with _connection_stats_lock:
+        stats = _connection_stats.setdefault(key, {"requests": 0, "connections": 0})
+        stats[name] += 1
+
+
+class _CountingPoolMixin:
+    """
+    Conta as requisições feitas pelo pool e as conexões que ele abriu;
+    a diferença é a quantidade de requisições que reutilizaram conexões
+    """
+
+    def _new_conn(self):
+        _count(self, "connections")
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs):
+        _count(self, "requests")
+        return super().urlopen(*args, **kwargs)
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+def connection_stats(reset=False):
+    """
+    Retorna, por host (scheme://host:port), a quantidade de requisições,
+    de conexões abertas e de requisições que reutilizaram uma conexão
+    """
+    with _connection_stats_lock:
+        stats = {
+            key: dict(item, reused=item["requests"] - item["connections"])
+            for key, item in _connection_stats.items()
+        }
+        if reset:
+            _connection_stats.clear()
+    return stats
+
+
+def get_session(url):
+    """
+    Retorna a sessão HTTP do processo para o host de url,
+    cujas conexões são mantidas abertas (keep-alive) e reutilizadas
+    """
+    key = _session_key(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = CountingHTTPAdapter(
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE,
+                pool_block=POOL_BLOCK,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
 @retry(
     retry=retry_if_exception_type(RetryableError),
     wait=wait_exponential(multiplier=1, min=1, max=5),
@@ -44,6 +149,7 @@ def post_data(
     json=False,
     timeout=2,
     verify=True,
+    session=None,
 ):
     """
     Post data with HTTP
@@ -55,6 +161,7 @@ def post_data(
         headers: HTTP headers
         json: True|False
         verify: Verify the SSL.
+        session: requests.Session, e.g. get_session(url), to reuse connections
     Returns:
         Return a requests.response object.
     Except:
@@ -70,7 +177,9 @@ def post_data(
         _add_param(params, "auth", auth)
         _add_param(params, "files", files)
         _add_param(params, "data", data)
-        response = requests.post(url, **params)
+        response = (session or requests).post(url, **params)
+        if session is not None:
+            logger.debug("Connection stats: %s", connection_stats())
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
         logger.error("Erro posting data: %s, retry..., erro: %s" % (url, exc))
         raise RetryableError(exc) from exc
@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# segundos antes da expiração em que o token passa a ser renovado
+REFRESH_MARGIN = getattr(settings, "PID_PROVIDER_TOKEN_REFRESH_MARGIN", 30)
+# validade assumida para tokens sem o claim exp
+DEFAULT_TTL = getattr(settings, "PID_PROVIDER_TOKEN_DEFAULT_TTL", 60)
+# compartilha o token entre os workers usando o cache do Django (Redis)
+USE_DJANGO_CACHE = getattr(settings, "PID_PROVIDER_TOKEN_USE_DJANGO_CACHE", False)
+
+_lock = threading.Lock()
+_tokens = {}
+
+
+def cache_key(url, username):
+    digest = hashlib.sha1(f"{url}|{username}".encode("utf-8")).hexdigest()
+    return f"pid_provider_token:{digest}"
+
+
+def get_expiration(token):
+    """
+    Obtém o claim exp (timestamp) do payload do JWT, sem validar a assinatura
+
+    Returns
+    -------
+        float or None
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+        logger.info(f"Unable to get token expiration: {type(e)} {e}")
+        return None
+
+
+def get(key):
+    """
+    Retorna o token se ainda não está próximo de expirar
+    """
+    with _lock:
+        item = _tokens.get(key)
+    if not item and USE_DJANGO_CACHE:
+        item = cache.get(key)
+        if item:
+            with _lock:
+                _tokens[key] = item
+    if not item:
+        return None
+    token, expires_at = item
+    if expires_at - REFRESH_MARGIN <= time.time():
+        invalidate(key)
+        return None
+    return token
+
+
+def set(key, token):
+    if not token:
+        return
+    expires_at = get_expiration(token) or (time.time() + DEFAULT_TTL)
+    item = (token, expires_at)
+    with _lock:
+        _tokens[key] = item
+    if USE_DJANGO_CACHE:
+        timeout = int(expires_at - REFRESH_MARGIN - time.time())
+        if timeout > 0:
+            cache.set(key, item, timeout=timeout)
+
+
+def invalidate(key):
+    with _lock:
+        _tokens.pop(key, None)
+    if USE_DJANGO_CACHE:
+        cache.delete(key)
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from packtools.sps.pid_provider.xml_sps_lib import XMLWithPre
 
@@ -17,6 +18,10 @@ from .models import (
     choices,
 )
 
+VALIDATION_RESULT_BATCH_SIZE = getattr(
+    settings, "UPLOAD_VALIDATION_RESULT_BATCH_SIZE", 500
+)
+
 
 def add_validation_result(
     error_category, package_id, status=None, message=None, data=None
@@ -24,15 +29,10 @@ def add_validation_result(
     val_res = ValidationResult()
     val_res.category = error_category
 
-    val_res.package = get_object_or_404(Package, pk=package_id)
+    val_res.package_id = package_id
     val_res.status = status
     val_res.message = message
     val_res.data = data
-
-    if val_res.status == choices.VS_DISAPPROVED:
-        val_res.package.status = choices.PS_REJECTED
-        val_res.package.save()
-
     val_res.save()
     return val_res
 
@@ -42,16 +42,61 @@ def update_validation_result(validation_result_id, **kwargs):
         val_res = ValidationResult.objects.get(pk=validation_result_id)
         for k, v in kwargs.items():
             setattr(val_res, k, v)
-
-        if val_res.status == choices.VS_DISAPPROVED:
-            val_res.package.status = choices.PS_REJECTED
-            val_res.package.save()
-
         val_res.save()
     except ValidationResult.DoesNotExist:
         ...
 
 
+class ValidationResultWriter:
+    """
+    Acumula os resultados de validação de um pacote e os grava
+    com bulk_create em flush(), sem consultar o pacote
+    """
+
+    def __init__(self, package_id, batch_size=None):
+        self.package_id = package_id
+        self.batch_size = batch_size or VALIDATION_RESULT_BATCH_SIZE
+        self.items = []
+        self.is_valid = True
+
+    def add(self, error_category, status=None, message=None, data=None):
+        if status == choices.VS_DISAPPROVED:
+            self.is_valid = False
+        self.items.append(
+            ValidationResult(
+                category=error_category,
+                package_id=self.package_id,
+                status=status,
+                message=message,
+                data=data,
+            )
+        )
+        if len(self.items) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.items:
+            return
+        items = self.items
+        self.items = []
+        ValidationResult.objects.bulk_create(items, batch_size=self.batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.flush()
+
+
+def finish_package_validation(package_id, is_valid):
+    """
+    Define o status do pacote ao final de todas as validações
+    """
+    status = choices.PS_VALIDATED_WITHOUT_ERRORS if is_valid else choices.PS_REJECTED
+    Package.objects.filter(pk=package_id).update(status=status)
+    return status
+
+
 def upsert_validation_result_error_resolution(
     validation_result_id, user, action, rationale
 ):
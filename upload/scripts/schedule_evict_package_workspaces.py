@@ -0,0 +1,18 @@
+from django.utils.translation import gettext_lazy as _
+
+from core.utils.scheduler import schedule_task
+
+
+def run():
+    schedule_task(
+        task="Evict package workspaces",
+        name="Evict package workspaces",
+        kwargs={},
+        description=_("Remove os pacotes extraídos que não estão em uso"),
+        priority=3,
+        enabled=True,
+        run_once=False,
+        day_of_week="*",
+        hour="*",
+        minute="30",
+    )
@@ -1,13 +1,12 @@
 import json
+import logging
 
-from celery.result import AsyncResult
+from celery import chord
 from django.utils.translation import gettext as _
 from packtools.sps import exceptions as sps_exceptions
 from packtools.sps.models import package as sps_package
-from packtools.sps.utils import file_utils as sps_file_utils
 from packtools.sps.validation import article as sps_validation_article
 from packtools.sps.validation import journal as sps_validation_journal
-from packtools.validator import ValidationReportXML
 
 from article.choices import AS_CHANGE_SUBMITTED
 from article.controller import create_article_from_etree, update_article
@@ -18,7 +17,13 @@ from journal.controller import get_journal_dict_for_validation
 from libs.dsm.publication.documents import get_document, get_similar_documents
 
 from . import choices, controller, exceptions, models
-from .utils import file_utils, package_utils, xml_utils
+from .utils import (
+    file_utils,
+    package_utils,
+    package_workspace,
+    validation_utils,
+    xml_utils,
+)
 
 
 def run_validations(
@@ -26,74 +31,121 @@ def run_validations(
 ):
     file_path = file_utils.get_file_absolute_path(filename)
 
+    # Lê o pacote uma única vez e interpreta cada XML uma única vez
+    xml_contents = {}
+    try:
+        package_data = package_utils.analyse_package(
+            file_path, xml_contents=xml_contents
+        )
+    except file_utils.BadPackageFileError:
+        with controller.ValidationResultWriter(package_id) as results:
+            results.add(
+                error_category=choices.VE_PACKAGE_FILE_ERROR,
+                status=choices.VS_DISAPPROVED,
+            )
+        return task_finish_validations([False], package_id)
+
     # Obtém lista de paths de arquivos XML disponíveis no pacote
-    xml_files = sps_file_utils.get_files_list_filtered(file_path, [".xml"])
+    xml_files = list(package_data["xmls"])
+
+    # Pacote sem XML não é aprovado (chord([]) aprovaria o pacote)
+    if not xml_files:
+        with controller.ValidationResultWriter(package_id) as results:
+            results.add(
+                error_category=choices.VE_PACKAGE_FILE_ERROR,
+                status=choices.VS_DISAPPROVED,
+                message=_("Package does not contain a XML file"),
+            )
+        return task_finish_validations([False], package_id)
 
     # Valida arquivos XML do pacote
     xml_validation_success = []
     for xml_path in xml_files:
         xml_validation_success.append(
-            task_validate_xml_format(file_path, xml_path, package_id)
+            task_validate_xml_format(package_data, xml_path, package_id)
         )
 
-    # Caso nenhum arquivo XML seja inválido, aciona outras validações
-    if False not in xml_validation_success:
-        # Gera versão otimizada do pacote
-        optimised_filepath = task_optimise_package(file_path)
-
-        # Para cada XML no pacote
-        for xml_path in xml_files:
-            # Aciona validação de Assets
-            task_validate_assets.apply_async(
-                kwargs={
-                    "file_path": optimised_filepath,
-                    "xml_path": xml_path,
-                    "package_id": package_id,
-                },
-                countdown=10,
-            )
+    # Caso algum arquivo XML seja inválido, encerra a validação
+    if False in xml_validation_success:
+        return task_finish_validations(xml_validation_success, package_id)
+
+    # Gera versão otimizada do pacote
+    optimised_filepath = task_optimise_package(file_path)
+    # Os XML já foram analisados; do pacote otimizado só é necessária a lista
+    # de arquivos, com as versões otimizadas e miniaturas dos assets, que
+    # task_validate_assets verifica a partir dos nomes dos assets originais
+    with package_workspace.PackageWorkspace.open(optimised_filepath) as workspace:
+        optimised_package_data = dict(
+            package_data, path=optimised_filepath, files=workspace.file_list
+        )
 
-            # Aciona validação de Renditions
-            task_validate_renditions.apply_async(
-                kwargs={
-                    "file_path": optimised_filepath,
-                    "xml_path": xml_path,
-                    "package_id": package_id,
-                },
-                countdown=10,
+    validations = []
+
+    # Para cada XML no pacote
+    for xml_path in xml_files:
+        # Validação de Assets
+        validations.append(
+            task_validate_assets.si(
+                package_data=optimised_package_data,
+                xml_path=xml_path,
+                package_id=package_id,
             )
+        )
 
-            # Aciona validacao do conteudo do XML
-            task_validate_content_xml.apply_async(
-                kwargs={
-                    "file_path": file_path,
-                    "xml_path": xml_path,
-                    "package_id": package_id,
-                },
-                countdown=10,
+        # Validação de Renditions
+        validations.append(
+            task_validate_renditions.si(
+                package_data=optimised_package_data,
+                xml_path=xml_path,
+                package_id=package_id,
             )
+        )
 
-        # Aciona validação de compatibilidade entre dados do pacote e o Issue selecionado
-        if issue_id is not None and package_category:
-            task_validate_article_and_issue_data.apply_async(
-                kwargs={
-                    "file_path": optimised_filepath,
-                    "package_id": package_id,
-                    "issue_id": issue_id,
-                },
-                countdown=10,
+        # Validacao do conteudo do XML
+        validations.append(
+            task_validate_content_xml.si(
+                xml_content=xml_contents[xml_path],
+                xml_path=xml_path,
+                package_id=package_id,
             )
+        )
 
-        # Aciona validação de compatibilidade entre dados do pacote e o Article selecionado
-        if article_id is not None and package_category in (
-            choices.PC_UPDATE,
-            choices.PC_ERRATUM,
-        ):
-            task_validate_article_change(
-                file_path,
-                package_category,
-                article_id,
+    # Validação de compatibilidade entre dados do pacote e o Issue selecionado
+    if issue_id is not None and package_category:
+        validations.append(
+            task_validate_article_and_journal_issue_compatibility.si(
+                package_id=package_id,
+                xml_content=xml_contents[xml_files[0]],
+                issue_id=issue_id,
+            )
+        )
+        validations.append(
+            task_validate_article_is_unpublished.si(
+                package_data=optimised_package_data,
+                package_id=package_id,
             )
+        )
+
+    # Executa as validações em paralelo e define o status do pacote
+    # uma única vez, quando todas terminarem
+    # Se alguma validação (ou o callback) falhar, o pacote é rejeitado,
+    # em vez de permanecer com o status enfileirado
+    chord(validations)(
+        task_finish_validations.s(package_id=package_id).on_error(
+            task_reject_package.s(package_id=package_id)
+        )
+    )
+
+    # Aciona validação de compatibilidade entre dados do pacote e o Article selecionado
+    if article_id is not None and package_category in (
+        choices.PC_UPDATE,
+        choices.PC_ERRATUM,
+    ):
+        task_validate_article_change(
+            file_path,
+            package_category,
+            article_id,
+        )
 
 
 def check_resolutions(package_id):
@@ -108,28 +160,35 @@ def get_or_create_package(pid_v3, user_id):
     return task_get_or_create_package(pid_v3, user_id)
 
 
-@celery_app.task(bind=True, name="Validate article and issue data")
-def task_validate_article_and_issue_data(self, file_path, package_id, issue_id):
-    task_validate_article_and_journal_issue_compatibility.apply_async(
-        kwargs={
-            "package_id": package_id,
-            "file_path": file_path,
-            "issue_id": issue_id,
-        }
+@celery_app.task(name="Finish package validations")
+def task_finish_validations(results, package_id):
+    """
+    Callback do chord de validações: define o status do pacote
+    a partir do resultado de todas as validações
+    """
+    return controller.finish_package_validation(
+        package_id, is_valid=all(result is not False for result in results)
     )
-    task_validate_article_is_unpublished.apply_async(
-        kwargs={
-            "package_id": package_id,
-            "file_path": file_path,
-        }
+
+
+@celery_app.task(name="Reject package")
+def task_reject_package(request, exc, traceback, package_id):
+    """
+    Errback do chord de validações: rejeita o pacote quando uma das
+    validações não termina
+    """
+    logging.error(
+        f"Unable to validate package {package_id}: {request.id} {type(exc)} {exc}"
     )
+    return controller.finish_package_validation(package_id, is_valid=False)
 
 
 @celery_app.task(name="Validate article and journal issue compatibility")
 def task_validate_article_and_journal_issue_compatibility(
-    package_id, file_path, issue_id
+    package_id, xml_content, issue_id
 ):
-    xmltree = sps_package.PackageArticle(file_path).xmltree_article
+    # xml_content: XML do artigo obtido por analyse_package
+    xmltree = xml_utils.get_etree_from_xml_content(xml_content)
     issue = Issue.objects.get(pk=issue_id)
     journal_dict = get_journal_dict_for_validation(issue.official_journal.id)
 
@@ -170,9 +229,8 @@ def task_validate_article_and_journal_issue_compatibility(
 
 
 @celery_app.task(name="Validate article is unpublished")
-def task_validate_article_is_unpublished(file_path, package_id):
-    xmltree = sps_package.PackageArticle(file_path).xmltree_article
-    article_data = package_utils.get_article_data_for_comparison(xmltree)
+def task_validate_article_is_unpublished(package_data, package_id):
+    article_data = package_utils.get_article_data_from_package_data(package_data)
 
     val = controller.add_validation_result(
         error_category=choices.VE_ARTICLE_IS_NOT_NEW_ERROR,
@@ -233,41 +291,44 @@ def task_validate_article_change(
             }
         )
     elif new_package_category == choices.PC_ERRATUM:
-        task_result_ae = task_validate_article_erratum.apply_async(
-            kwargs={"file_path": new_package_file_path}
-        )
-        task_result_cp = task_compare_packages.apply_async(
-            kwargs={
-                "package1_file_path": new_package_file_path,
-                "package2_file_path": last_valid_pkg_file_path,
-            }
-        )
-        task_update_article_status_by_validations.apply_async(
-            kwargs={
-                "task_id_article_erratum": task_result_ae.id,
-                "task_id_compare_packages": task_result_cp.id,
-                "article_id": article_id,
-            }
+        chord(
+            [
+                task_validate_article_erratum.si(file_path=new_package_file_path),
+                task_compare_packages.si(
+                    package1_file_path=new_package_file_path,
+                    package2_file_path=last_valid_pkg_file_path,
+                ),
+            ]
+        )(
+            task_update_article_status_by_validations.s(article_id=article_id).on_error(
+                task_report_article_change_validation_error.s(article_id=article_id)
+            )
         )
 
 
 @celery_app.task(name="Update article status by validations")
-def task_update_article_status_by_validations(
-    task_id_article_erratum, task_id_compare_packages, article_id
-):
-    ar_article_erratum = AsyncResult(task_id_article_erratum)
-    ar_compare_packages = AsyncResult(task_id_compare_packages)
-
-    while not ar_article_erratum.ready() or not ar_compare_packages.ready():
-        ...
-
-    if ar_article_erratum.result and ar_compare_packages.result:
+def task_update_article_status_by_validations(results, article_id):
+    # results: [validação da errata, comparação com o último pacote publicado]
+    if all(results):
         update_article(article_id, status=AS_CHANGE_SUBMITTED)
         return True
 
     return False
 
 
+@celery_app.task(name="Report article change validation error")
+def task_report_article_change_validation_error(request, exc, traceback, article_id):
+    """
+    Errback do chord de validação da errata: o status do artigo não é
+    alterado, como quando a validação não é aprovada
+    """
+    logging.error(
+        f"Unable to validate change of article {article_id}: "
+        f"{request.id} {type(exc)} {exc}"
+    )
+    return False
+
+
 @celery_app.task(name="Validate article update")
 def task_validate_article_update(new_package_file_path, last_valid_package_file_path):
     new_pkg_xmltree = sps_package.PackageArticle(new_package_file_path).xmltree_article
@@ -294,46 +355,31 @@ def task_compare_packages(package1_file_path, package2_file_path):
 
 
 @celery_app.task()
-def task_validate_xml_format(file_path, xml_path, package_id):
-    val = controller.add_validation_result(
-        error_category=choices.VE_XML_FORMAT_ERROR,
-        package_id=package_id,
-        status=choices.VS_CREATED,
-        data={"xml_path": xml_path},
-    )
+def task_validate_xml_format(package_data, xml_path, package_id):
+    format_error = package_data["xmls"][xml_path]["format_error"]
+    results = controller.ValidationResultWriter(package_id)
 
-    try:
-        xml_str = file_utils.get_xml_content_from_zip(file_path, xml_path)
-        xml_utils.get_etree_from_xml_content(xml_str)
-        controller.update_validation_result(
-            validation_result_id=val.id,
+    if not format_error:
+        results.add(
+            error_category=choices.VE_XML_FORMAT_ERROR,
             status=choices.VS_APPROVED,
+            data={"xml_path": xml_path},
         )
+        results.flush()
         return True
 
-    except (file_utils.BadPackageFileError, file_utils.PackageWithoutXMLFileError):
-        controller.update_validation_result(
-            validation_result_id=val.id,
-            error_category=choices.VE_PACKAGE_FILE_ERROR,
-            status=choices.VS_DISAPPROVED,
-        )
-
-    except xml_utils.XMLFormatError as e:
-        data = {
+    results.add(
+        error_category=choices.VE_XML_FORMAT_ERROR,
+        status=choices.VS_DISAPPROVED,
+        message=format_error["message"],
+        data={
             "xml_path": xml_path,
-            "column": e.column,
-            "row": e.start_row,
-            "snippet": xml_utils.get_snippet(xml_str, e.start_row, e.end_row),
-        }
-
-        controller.update_validation_result(
-            validation_result_id=val.id,
-            error_category=choices.VE_XML_FORMAT_ERROR,
-            message=e.message,
-            data=data,
-            status=choices.VS_DISAPPROVED,
-        )
-
+            "column": format_error["column"],
+            "row": format_error["row"],
+            "snippet": format_error["snippet"],
+        },
+    )
+    results.flush()
     return False
 
 
@@ -342,28 +388,27 @@ def task_optimise_package(file_path):
     source = file_utils.get_file_absolute_path(file_path)
     target = file_utils.generate_filepath_with_new_extension(source, ".optz", True)
     package_utils.optimise_package(source, target)
-    package_utils.unzip(target)
+    # extrai o pacote otimizado uma única vez e registra seu manifesto
+    package_workspace.PackageWorkspace.get(target)
 
     return target
 
 
 @celery_app.task()
-def task_validate_assets(file_path, xml_path, package_id):
-    package_files = file_utils.get_file_list_from_zip(file_path)
-    article_assets = package_utils.get_article_assets_from_zipped_xml(
-        file_path, xml_path
+def task_validate_assets(package_data, xml_path, package_id):
+    package_files = package_data["files"]
+    article_assets = package_utils.get_article_assets_from_package_data(
+        package_data, xml_path
     )
 
-    has_errors = False
+    results = controller.ValidationResultWriter(package_id)
 
     for asset_result in package_utils.evaluate_assets(article_assets, package_files):
         asset, is_present = asset_result
 
         if not is_present:
-            has_errors = True
-            controller.add_validation_result(
+            results.add(
                 choices.VE_ASSET_ERROR,
-                package_id,
                 status=choices.VS_DISAPPROVED,
                 message=f'{asset.name} {_("file is mentioned in the XML but not present in the package.")}',
                 data={
@@ -374,9 +419,8 @@ def task_validate_assets(file_path, xml_path, package_id):
                 },
             )
 
-            controller.add_validation_result(
+            results.add(
                 choices.VE_ASSET_ERROR,
-                package_id,
                 status=choices.VS_DISAPPROVED,
                 message=f'{asset.name} {_("file is mentioned in the XML but its optimised version not present in the package.")}',
                 data={
@@ -389,9 +433,8 @@ def task_validate_assets(file_path, xml_path, package_id):
                 },
             )
 
-            controller.add_validation_result(
+            results.add(
                 choices.VE_ASSET_ERROR,
-                package_id,
                 status=choices.VS_DISAPPROVED,
                 message=f'{asset.name} {_("file is mentioned in the XML but its thumbnail version not present in the package.")}',
                 data={
@@ -404,24 +447,25 @@ def task_validate_assets(file_path, xml_path, package_id):
                 },
             )
 
-    if not has_errors:
-        controller.add_validation_result(
+    if results.is_valid:
+        results.add(
             choices.VE_ASSET_ERROR,
-            package_id,
             status=choices.VS_APPROVED,
             data={"xml_path": xml_path},
         )
-        return True
+    results.flush()
+
+    return results.is_valid
 
 
 @celery_app.task()
-def task_validate_renditions(file_path, xml_path, package_id):
-    package_files = file_utils.get_file_list_from_zip(file_path)
-    article_renditions = package_utils.get_article_renditions_from_zipped_xml(
-        file_path, xml_path
+def task_validate_renditions(package_data, xml_path, package_id):
+    package_files = package_data["files"]
+    article_renditions = package_utils.get_article_renditions_from_package_data(
+        package_data, xml_path
     )
 
-    has_errors = False
+    results = controller.ValidationResultWriter(package_id)
 
     for rendition_result in package_utils.evaluate_renditions(
         article_renditions, package_files
@@ -429,10 +473,7 @@ def task_validate_renditions(file_path, xml_path, package_id):
         rendition, expected_filename, is_present = rendition_result
 
         if not is_present:
-            has_errors = True
-
-            controller.add_validation_result(
-                package_id=package_id,
+            results.add(
                 error_category=choices.VE_RENDITION_ERROR,
                 status=choices.VS_DISAPPROVED,
                 message=f'{rendition.language} {_("language is mentioned in the XML but its PDF file not present in the package.")}',
@@ -444,26 +485,29 @@ def task_validate_renditions(file_path, xml_path, package_id):
                 },
             )
 
-    if not has_errors:
-        controller.add_validation_result(
+    if results.is_valid:
+        results.add(
             error_category=choices.VE_RENDITION_ERROR,
-            package_id=package_id,
             status=choices.VS_APPROVED,
             data={"xml_path": xml_path},
         )
-        return True
+    results.flush()
+
+    return results.is_valid
 
 
 from datetime import date
 
 
 @celery_app.task(name="Validate XML")
-def task_validate_content_xml(file_path, xml_path, package_id):
-    xml_str = file_utils.get_xml_content_from_zip(file_path)
+def task_validate_content_xml(xml_content, xml_path, package_id):
+    # xml_content: XML obtido por analyse_package, sem reabrir o zip;
+    # a árvore não pode ser enviada à task, então é interpretada aqui
+    xmltree = xml_utils.get_etree_from_xml_content(xml_content)
+
+    validations = validation_utils.get_validation_report(xmltree)
 
-    validations = ValidationReportXML(
-        file_path=xml_str, data_file_path="validation_criteria_example.json"
-    ).validation_report()
+    results = controller.ValidationResultWriter(package_id)
 
     # data = {}
     for result in validations:
@@ -472,13 +516,6 @@ def task_validate_content_xml(file_path, xml_path, package_id):
                 string_validations = json.dumps(result_ind, default=str)
                 json_validations = json.loads(string_validations)
 
-                vr = controller.add_validation_result(
-                    error_category=choices.VE_DATA_CONSISTENCY_ERROR,
-                    package_id=package_id,
-                    status=choices.VS_CREATED,
-                    data=json_validations,
-                )
-
                 # # TODO
                 # Realizar logica para verificar se a validacao passou ou nao
                 ########
@@ -494,18 +531,19 @@ def task_validate_content_xml(file_path, xml_path, package_id):
                     print(f"Error: {e}")
                     valor = False
 
-                if valor == "success":
-                    controller.update_validation_result(
-                        vr.id,
-                        status=choices.VS_APPROVED,
-                        message=_(message),
-                    )
-                else:
-                    controller.update_validation_result(
-                        vr.id,
-                        status=choices.VS_DISAPPROVED,
-                        message=_(message),
-                    )
+                results.add(
+                    error_category=choices.VE_DATA_CONSISTENCY_ERROR,
+                    status=(
+                        choices.VS_APPROVED
+                        if valor == "success"
+                        else choices.VS_DISAPPROVED
+                    ),
+                    message=_(message),
+                    data=json_validations,
+                )
+    results.flush()
+
+    return results.is_valid
 
 
 @celery_app.task(bind=True, name="Check validation error resolutions")
@@ -556,6 +594,11 @@ def task_get_or_create_package(pid_v3, user_id):
         ).id
 
 
+@celery_app.task(bind=True, name="Evict package workspaces")
+def task_evict_package_workspaces(self, max_age=None, max_size=None):
+    return package_workspace.evict(max_age=max_age, max_size=max_size)
+
+
 @celery_app.task(bind=True, name="request_pid_for_accepted_packages")
 def task_request_pid_for_accepted_packages(self, user_id):
     controller.request_pid_for_accepted_packages(user_id)
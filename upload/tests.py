@@ -1,3 +1,225 @@
-from django.test import TestCase
+import os
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import ANY, patch
+from zipfile import ZipFile
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+from lxml import etree
+
+from upload import choices, tasks
+from upload.utils import package_utils, package_workspace
+from upload.utils.package_workspace import PackageWorkspace
+
+
+@patch("upload.tasks.controller")
+@patch("upload.tasks.package_utils.analyse_package")
+@patch("upload.tasks.file_utils.get_file_absolute_path", return_value="/p.zip")
+class RunValidationsTest(SimpleTestCase):
+    def test_rejects_package_without_xml(
+        self, mock_path, mock_analyse, mock_controller
+    ):
+        mock_analyse.return_value = {"path": "/p.zip", "files": ["a.pdf"], "xmls": {}}
+        writer = mock_controller.ValidationResultWriter.return_value
+        results = writer.__enter__.return_value
+
+        tasks.run_validations("p.zip", 1, choices.PC_NEW_DOCUMENT)
+
+        results.add.assert_called_once_with(
+            error_category=choices.VE_PACKAGE_FILE_ERROR,
+            status=choices.VS_DISAPPROVED,
+            message=ANY,
+        )
+        mock_controller.finish_package_validation.assert_called_once_with(
+            1, is_valid=False
+        )
+
+    @patch("upload.tasks.chord")
+    @patch("upload.tasks.package_workspace.PackageWorkspace")
+    @patch("upload.tasks.task_optimise_package", return_value="/p.optz")
+    def test_passes_the_analysed_xml_to_the_validations(
+        self,
+        mock_optimise,
+        mock_workspace,
+        mock_chord,
+        mock_path,
+        mock_analyse,
+        mock_controller,
+    ):
+        def analyse_package(path, xml_contents):
+            xml_contents["a.xml"] = "<article/>"
+            return {
+                "path": path,
+                "files": ["a.xml", "a.tif"],
+                "xmls": {"a.xml": {"format_error": None}},
+            }
+
+        mock_analyse.side_effect = analyse_package
+        workspace = mock_workspace.open.return_value.__enter__.return_value
+        workspace.file_list = ["a.xml", "a.tif", "a.png", "a.thumbnail.jpg"]
+
+        tasks.run_validations("p.zip", 1, choices.PC_NEW_DOCUMENT, issue_id=2)
+
+        # o pacote otimizado não é analisado novamente
+        mock_analyse.assert_called_once()
+        validations = {
+            signature.task: signature.kwargs
+            for signature in mock_chord.call_args.args[0]
+        }
+        self.assertEqual(
+            "<article/>",
+            validations[tasks.task_validate_content_xml.name]["xml_content"],
+        )
+        self.assertEqual(
+            "<article/>",
+            validations[
+                tasks.task_validate_article_and_journal_issue_compatibility.name
+            ]["xml_content"],
+        )
+        self.assertEqual(
+            {
+                "path": "/p.optz",
+                "files": ["a.xml", "a.tif", "a.png", "a.thumbnail.jpg"],
+                "xmls": {"a.xml": {"format_error": None}},
+            },
+            validations[tasks.task_validate_assets.name]["package_data"],
+        )
+
+
+class AnalysePackageTest(SimpleTestCase):
+    def test_fills_xml_contents_with_the_parsed_xml(self):
+        with TemporaryDirectory() as tmpdir, override_settings(MEDIA_ROOT=tmpdir):
+            with ZipFile(os.path.join(tmpdir, "p.zip"), "w") as zf:
+                xml = (
+                    '<?xml version="1.0" encoding="ISO-8859-1"?>'
+                    '<article xml:lang="pt"><body><p>ação</p></body></article>'
+                )
+                zf.writestr("a.xml", xml.encode("iso-8859-1"))
+                zf.writestr("b.xml", "<article>")
+            xml_contents = {}
+
+            package_data = package_utils.analyse_package(
+                "p.zip", xml_contents=xml_contents
+            )
+
+        self.assertEqual(["a.xml", "b.xml"], list(package_data["xmls"]))
+        self.assertEqual(["a.xml"], list(xml_contents))
+        self.assertEqual(
+            "ação", etree.fromstring(xml_contents["a.xml"]).findtext(".//p")
+        )
+
+
+class PackageWorkspaceTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.location = self.tmpdir.name
+        self.settings_override = override_settings(MEDIA_ROOT=self.location)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+    def _create_zip(self, name, files):
+        path = os.path.join(self.location, name)
+        with ZipFile(path, "w") as zf:
+            for filename, content in files.items():
+                zf.writestr(filename, content)
+        return path
+
+    def _manifest(self, path):
+        return package_workspace._read_manifest(
+            package_workspace.get_workspace_dir(path)
+        )
+
+    def test_get_extracts_the_package_once(self):
+        path = self._create_zip("pkg.zip", {"a.xml": "<article/>", "a.pdf": "pdf"})
+
+        with patch.object(
+            package_workspace, "_extract", wraps=package_workspace._extract
+        ) as mock_extract:
+            workspace = PackageWorkspace.get(path)
+            PackageWorkspace.get(path)
+
+        mock_extract.assert_called_once()
+        self.assertEqual({"a.xml": 10, "a.pdf": 3}, workspace.files)
+        self.assertEqual(["a.xml"], workspace.xml_files)
+        self.assertEqual(b"<article/>", workspace.read("a.xml"))
+        self.assertEqual(0, self._manifest(path)["refs"])
+
+    def test_get_extracts_packages_with_the_same_name_apart(self):
+        zip_path = self._create_zip("pkg.zip", {"a.xml": "<zip/>"})
+        optz_path = self._create_zip("pkg.optz", {"a.xml": "<optz/>"})
+
+        workspace = PackageWorkspace.get(zip_path)
+        optz_workspace = PackageWorkspace.get(optz_path)
+
+        self.assertNotEqual(workspace.directory, optz_workspace.directory)
+        self.assertEqual(b"<zip/>", workspace.read("a.xml"))
+        self.assertEqual(b"<optz/>", optz_workspace.read("a.xml"))
+        self.assertEqual("/media/pkg.optz.d/a.xml", optz_workspace.url("a.xml"))
+
+    def test_get_extracts_again_the_changed_package(self):
+        path = self._create_zip("pkg.zip", {"a.xml": "<article/>"})
+        PackageWorkspace.get(path)
+        self._create_zip("pkg.zip", {"b.xml": "<article>b</article>"})
+
+        self.assertEqual(["b.xml"], PackageWorkspace.get(path).file_list)
+
+    def test_get_defers_the_extraction_while_in_use(self):
+        path = self._create_zip("pkg.zip", {"a.xml": "<article/>"})
+
+        with PackageWorkspace.open(path) as workspace:
+            self._create_zip("pkg.zip", {"b.xml": "<article>b</article>"})
+            self.assertEqual(["a.xml"], PackageWorkspace.get(path).file_list)
+            self.assertEqual(b"<article/>", workspace.read("a.xml"))
+
+        self.assertEqual(["b.xml"], PackageWorkspace.get(path).file_list)
+
+    def test_open_acquires_and_releases_the_workspace(self):
+        path = self._create_zip("pkg.zip", {"a.xml": "<article/>"})
+
+        with PackageWorkspace.open(path):
+            with PackageWorkspace.open(path):
+                self.assertEqual(2, self._manifest(path)["refs"])
+            self.assertEqual(1, self._manifest(path)["refs"])
+        self.assertEqual(0, self._manifest(path)["refs"])
+
+    def test_release_does_not_decrement_below_zero(self):
+        path = self._create_zip("pkg.zip", {"a.xml": "<article/>"})
+
+        PackageWorkspace.get(path).release()
+
+        self.assertEqual(0, self._manifest(path)["refs"])
+
+    def test_evict_removes_old_workspaces_not_in_use(self):
+        old = PackageWorkspace.get(self._create_zip("old.zip", {"a.xml": "a"}))
+        used = PackageWorkspace.get(
+            self._create_zip("used.zip", {"a.xml": "a"}), acquire=True
+        )
+        past = time.time() - 60
+        for workspace in (old, used):
+            os.utime(
+                workspace.directory + package_workspace.MANIFEST_SUFFIX, (past, past)
+            )
+
+        self.assertEqual(1, package_workspace.evict(max_age=30, location=self.location))
+        self.assertFalse(os.path.exists(old.directory))
+        self.assertFalse(
+            os.path.exists(old.directory + package_workspace.MANIFEST_SUFFIX)
+        )
+        self.assertTrue(os.path.isdir(used.directory))
+
+    def test_evict_removes_the_least_recent_workspaces_above_max_size(self):
+        first = PackageWorkspace.get(self._create_zip("first.zip", {"a.xml": "aaaa"}))
+        second = PackageWorkspace.get(self._create_zip("second.zip", {"a.xml": "aaaa"}))
+        past = time.time() - 60
+        os.utime(first.directory + package_workspace.MANIFEST_SUFFIX, (past, past))
+
+        removed = package_workspace.evict(
+            max_age=3600, max_size=4, location=self.location
+        )
+
+        self.assertEqual(1, removed)
+        self.assertFalse(os.path.exists(first.directory))
+        self.assertTrue(os.path.isdir(second.directory))
@@ -1,6 +1,8 @@
-from tempfile import mkdtemp
+import os
+from tempfile import TemporaryDirectory
 from time import sleep
-from zipfile import BadZipFile
+from types import SimpleNamespace
+from zipfile import BadZipFile, ZipFile
 
 from django.utils.translation import gettext as _
 from lxml import etree
@@ -15,21 +17,20 @@ from packtools.sps.models.journal_meta import ISSN
 from packtools.sps.models.package import PackageName
 
 from .file_utils import (
+    BadPackageFileError,
     create_file_for_xml_etree,
     create_file_for_zip_package,
     generate_filepath_with_new_extension,
     get_file_absolute_path,
-    get_file_list_from_zip,
-    get_file_url,
-    get_filename_from_filepath,
     get_xml_content_from_uri,
     get_xml_content_from_zip,
     get_xml_filename,
-    unzip,
 )
+from .package_workspace import PackageWorkspace
 from .xml_utils import (
     XMLFormatError,
     get_etree_from_xml_content,
+    get_snippet,
     get_xml_strio_for_preview,
 )
 
@@ -114,8 +115,19 @@ def create_package_file_from_site_doc(doc):
 
 
 def optimise_package(source, target):
-    package = SPPackage.from_file(source, mkdtemp())
-    package.optimise(new_package_file_path=target, preserve_files=True)
+    with TemporaryDirectory() as workdir:
+        package = SPPackage.from_file(source, workdir)
+        package.optimise(new_package_file_path=target, preserve_files=True)
+
+
+def open_optimised_package_workspace(zip_filename):
+    """
+    Retorna o workspace (conteúdo extraído e manifesto) do pacote otimizado,
+    em uso (não removido por evict) até o final do bloco with
+    """
+    return PackageWorkspace.open(
+        generate_filepath_with_new_extension(zip_filename, ".optz", True)
+    )
 
 
 def get_article_assets_from_zipped_xml(path, xml_path=None):
@@ -130,6 +142,136 @@ def get_article_renditions_from_zipped_xml(path, xml_path=None):
     return ArticleRenditions(xmltree).article_renditions
 
 
+def get_article_assets_from_workspace(workspace, xml_path=None):
+    xmltree = get_etree_from_xml_content(workspace.get_xml_content(xml_path))
+    return ArticleAssets(xmltree).article_assets
+
+
+def get_article_renditions_from_workspace(workspace, xml_path=None):
+    xmltree = get_etree_from_xml_content(workspace.get_xml_content(xml_path))
+    return ArticleRenditions(xmltree).article_renditions
+
+
+def analyse_package(path, workspace=None, xml_contents=None):
+    """
+    Lê o zip uma única vez e interpreta cada XML uma única vez,
+    retornando um resumo serializável usado pelas validações.
+
+    Se xml_contents (dict) for informado, recebe, por XML bem formado,
+    o conteúdo serializado (str) da árvore interpretada, para as tasks
+    que precisam do XML completo sem reabrir o zip.
+
+    Resumo:
+        {
+            "path": "/.../package.zip",
+            "files": ["a01.xml", "a01.pdf", "a01-gf01.tif", ...],
+            "xmls": {
+                "a01.xml": {
+                    "format_error": None,
+                    "assets": [{"id": "f1", "type": "graphic", "name": "a01-gf01.tif"}],
+                    "renditions": [{"language": "pt", "is_main_language": True}],
+                    "article_data": {...},  # get_article_data_for_comparison
+                },
+            },
+        }
+    """
+    file_absolute_path = get_file_absolute_path(path)
+    package_data = {"path": file_absolute_path, "files": [], "xmls": {}}
+    if workspace:
+        # conteúdo já extraído: usa o manifesto em vez de reabrir o zip
+        package_data["files"] = workspace.file_list
+        for name in workspace.xml_files:
+            package_data["xmls"][name] = _analyse_xml(
+                workspace.read(name), name, xml_contents
+            )
+        return package_data
+
+    try:
+        with ZipFile(file_absolute_path) as zf:
+            package_data["files"] = zf.namelist()
+            for name in package_data["files"]:
+                if os.path.splitext(name)[1].lower() == ".xml":
+                    package_data["xmls"][name] = _analyse_xml(
+                        zf.read(name), name, xml_contents
+                    )
+    except BadZipFile:
+        raise BadPackageFileError(f"Package {file_absolute_path} is invalid")
+    return package_data
+
+
+def _analyse_xml(xml_str, name=None, xml_contents=None):
+    try:
+        xmltree = get_etree_from_xml_content(xml_str)
+    except XMLFormatError as e:
+        return {
+            "format_error": {
+                "message": e.message,
+                "column": e.column,
+                "row": e.start_row,
+                "snippet": get_snippet(xml_str, e.start_row, e.end_row),
+            }
+        }
+
+    if xml_contents is not None:
+        # str, e não bytes, para ser enviado às tasks (serializer json)
+        xml_contents[name] = etree.tostring(xmltree, encoding="unicode")
+
+    try:
+        article_data = get_article_data_for_comparison(xmltree)
+    except (AttributeError, KeyError, TypeError):
+        article_data = None
+
+    return {
+        "format_error": None,
+        "assets": [
+            {"id": asset.id, "type": asset.type, "name": asset.name}
+            for asset in ArticleAssets(xmltree).article_assets
+        ],
+        "renditions": [
+            {
+                "language": rendition.language,
+                "is_main_language": rendition.is_main_language,
+            }
+            for rendition in ArticleRenditions(xmltree).article_renditions
+        ],
+        "article_data": article_data,
+    }
+
+
+def get_article_assets_from_package_data(package_data, xml_path):
+    """
+    Retorna os assets do XML registrados por analyse_package
+    com a mesma interface (id, type, name) de ArticleAssets
+    """
+    return [
+        SimpleNamespace(**asset)
+        for asset in package_data["xmls"][xml_path].get("assets") or []
+    ]
+
+
+def get_article_renditions_from_package_data(package_data, xml_path):
+    """
+    Retorna as renditions do XML registradas por analyse_package
+    com a mesma interface (language, is_main_language) de ArticleRenditions
+    """
+    return [
+        SimpleNamespace(**rendition)
+        for rendition in package_data["xmls"][xml_path].get("renditions") or []
+    ]
+
+
+def get_article_data_from_package_data(package_data, xml_path=None):
+    """
+    Retorna os dados de comparação (ISSNs, título e autores) registrados
+    por analyse_package para xml_path ou, se ausente, para o primeiro XML
+    """
+    xml_path = xml_path or next(iter(package_data["xmls"]))
+    article_data = package_data["xmls"][xml_path].get("article_data")
+    if article_data is None:
+        raise ValueError(f"Unable to get article data from {xml_path}")
+    return article_data
+
+
 def evaluate_assets(assets, files_list):
     """
     For each asset, returns a tuple that indicates whether or not the asset filename is in a file list.
@@ -186,14 +328,12 @@ def _fill_data_with_valitadion_errors(assets, renditions, validation_errors):
             )
 
 
-def _fill_data_with_present_files(assets, renditions, path, validation_errors):
+def _fill_data_with_present_files(assets, renditions, workspace, validation_errors):
     missing_files = [
         ve.data["missing_file"] for ve in validation_errors if ve.data["missing_file"]
     ]
 
-    dir_extracted_files = get_filename_from_filepath(path)
-
-    for a in get_article_assets_from_zipped_xml(path):
+    for a in get_article_assets_from_workspace(workspace):
         a_is_present = a.name not in missing_files
 
         if a_is_present:
@@ -205,14 +345,13 @@ def _fill_data_with_present_files(assets, renditions, path, validation_errors):
                     "name": a.name,
                     "type": a.type,
                     "is_present": a_is_present,
-                    "src": get_file_url(dir_extracted_files, a.name),
+                    "src": workspace.url(a.name),
                 }
             )
 
-    package_files = get_file_list_from_zip(path)
-    document_name = get_xml_filename(package_files)
+    document_name = get_xml_filename(workspace.file_list)
 
-    for r in get_article_renditions_from_zipped_xml(path):
+    for r in get_article_renditions_from_workspace(workspace):
         r_expected_filename = get_rendition_expected_name(r, document_name)
         r_is_present = r_expected_filename not in missing_files
 
@@ -223,7 +362,7 @@ def _fill_data_with_present_files(assets, renditions, path, validation_errors):
                     "language": r.language,
                     "is_main_language": r.is_main_language,
                     "is_present": True,
-                    "src": get_file_url(dir_extracted_files, r_expected_filename),
+                    "src": workspace.url(r_expected_filename),
                 }
             )
 
@@ -232,13 +371,9 @@ def coerce_package_and_errors(package, validation_errors):
     assets = {}
     renditions = []
 
-    source = get_file_absolute_path(package.file.name)
-    target = generate_filepath_with_new_extension(source, ".optz", True)
-
-    unzip(target)
-
     _fill_data_with_valitadion_errors(assets, renditions, validation_errors)
-    _fill_data_with_present_files(assets, renditions, target, validation_errors)
+    with open_optimised_package_workspace(package.file.name) as workspace:
+        _fill_data_with_present_files(assets, renditions, workspace, validation_errors)
 
     return assets, renditions
 
@@ -249,32 +384,28 @@ def get_main_language(path):
             return rendition.language
 
 
-def get_languages(zip_filename, use_optimised_package=True):
-    path = (
-        generate_filepath_with_new_extension(zip_filename, ".optz", True)
-        if use_optimised_package
-        else zip_filename
-    )
+def open_package_workspace(zip_filename, use_optimised_package=True):
+    if use_optimised_package:
+        return open_optimised_package_workspace(zip_filename)
+    return PackageWorkspace.open(zip_filename)
 
+
+def get_languages(zip_filename, use_optimised_package=True):
     try:
-        return [
-            rendition.language
-            for rendition in get_article_renditions_from_zipped_xml(path)
-        ]
+        with open_package_workspace(zip_filename, use_optimised_package) as workspace:
+            return [
+                rendition.language
+                for rendition in get_article_renditions_from_workspace(workspace)
+            ]
     except (FileNotFoundError, BadZipFile, XMLFormatError):
         return []
 
 
 def render_html(zip_filename, xml_path, language, use_optimised_package=True):
-    path = (
-        generate_filepath_with_new_extension(zip_filename, ".optz", True)
-        if use_optimised_package
-        else zip_filename
-    )
-
-    dir_optz = get_file_url(dirname="", filename=get_filename_from_filepath(path))
-    xmlstr = get_xml_content_from_zip(path, xml_path)
-    xmltree_strio = get_xml_strio_for_preview(xmlstr, dir_optz)
+    with open_package_workspace(zip_filename, use_optimised_package) as workspace:
+        xmlstr = workspace.get_xml_content(xml_path)
+        base_url = workspace.base_url
+    xmltree_strio = get_xml_strio_for_preview(xmlstr, base_url)
 
     html = HTMLGenerator.parse(
         xmltree_strio, valid_only=False, js=JS_ARTICLE, css=CSS_ARTICLE
@@ -0,0 +1,260 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import zipfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+from .file_utils import PackageWithoutXMLFileError, get_file_absolute_path, get_file_url
+
+# segundos sem acesso após os quais um workspace não utilizado é removido
+WORKSPACE_MAX_AGE = getattr(settings, "UPLOAD_WORKSPACE_MAX_AGE", 24 * 60 * 60)
+# soma máxima (bytes) dos arquivos extraídos; 0: sem limite
+WORKSPACE_MAX_SIZE = getattr(settings, "UPLOAD_WORKSPACE_MAX_SIZE", 0)
+
+WORKSPACE_SUFFIX = ".d"
+MANIFEST_SUFFIX = ".manifest.json"
+LOCK_SUFFIX = ".lock"
+
+
+def get_workspace_dir(zip_path):
+    """
+    Diretório em que o pacote é extraído, ao lado do zip e nomeado com o
+    nome completo do arquivo, inclusive a extensão, para que pacotes de
+    mesmo nome e extensões diferentes (pkg.zip, pkg.optz) não o compartilhem
+    """
+    return zip_path + WORKSPACE_SUFFIX
+
+
+def get_package_version(zip_path):
+    st = os.stat(zip_path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+@contextmanager
+def _locked(directory):
+    path = directory + LOCK_SUFFIX
+    while True:
+        fp = open(path, "a")
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            # _remove apaga o arquivo de lock; se isso ocorreu enquanto se
+            # aguardava o lock, tenta novamente com o novo arquivo
+            if os.fstat(fp.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fp, fcntl.LOCK_UN)
+        fp.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(fp, fcntl.LOCK_UN)
+        fp.close()
+
+
+def _read_manifest(directory):
+    try:
+        with open(directory + MANIFEST_SUFFIX) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(directory, manifest):
+    path = directory + MANIFEST_SUFFIX
+    with open(path + ".tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(path + ".tmp", path)
+
+
+def _extract(zip_path, directory, version, refs=0):
+    shutil.rmtree(directory, ignore_errors=True)
+    with zipfile.ZipFile(zip_path) as zf:
+        zf.extractall(directory)
+        files = {
+            info.filename: info.file_size for info in zf.infolist() if not info.is_dir()
+        }
+    return {
+        "source": zip_path,
+        "version": version,
+        "files": files,
+        "size": sum(files.values()),
+        "refs": refs,
+    }
+
+
+def _remove(directory):
+    # deve ser chamada com o lock obtido por _locked(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    for suffix in (MANIFEST_SUFFIX, LOCK_SUFFIX):
+        try:
+            os.remove(directory + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class PackageWorkspace:
+    """
+    Conteúdo extraído de um pacote zip, uma única extração por versão
+    (mtime e tamanho) do zip, descrito por um manifesto com os arquivos
+    e seus tamanhos. Os consumidores leem o manifesto e os arquivos
+    extraídos em vez de reabrir o zip.
+    """
+
+    def __init__(self, zip_path, directory, manifest):
+        self.zip_path = zip_path
+        self.directory = directory
+        self.manifest = manifest
+
+    @classmethod
+    def get(cls, zip_path, acquire=False):
+        """
+        Retorna o workspace do pacote, extraindo-o se ainda não foi extraído
+        ou se o zip mudou. Com acquire=True, incrementa o contador de uso,
+        que impede a remoção do workspace por evict().
+
+        Se o zip mudou enquanto o workspace está em uso (refs > 0), os
+        arquivos extraídos não são substituídos sob os consumidores: a versão
+        extraída continua sendo servida e a nova é extraída no primeiro get()
+        após a liberação
+        """
+        zip_path = get_file_absolute_path(zip_path)
+        version = get_package_version(zip_path)
+        directory = get_workspace_dir(zip_path)
+
+        with _locked(directory):
+            manifest = _read_manifest(directory)
+            extracted = bool(manifest) and os.path.isdir(directory)
+            changed = not extracted or manifest["version"] != version
+            if changed and extracted and manifest["refs"] > 0:
+                logging.warning(
+                    f"Package {zip_path} changed while its workspace is in use "
+                    f"({manifest['refs']}); keeping version {manifest['version']}"
+                )
+                changed = False
+            if changed:
+                manifest = _extract(
+                    zip_path, directory, version, manifest and manifest["refs"] or 0
+                )
+            if acquire:
+                manifest["refs"] += 1
+            if changed or acquire:
+                _write_manifest(directory, manifest)
+            else:
+                # registra o acesso, considerado por evict()
+                os.utime(directory + MANIFEST_SUFFIX)
+
+        return cls(zip_path, directory, manifest)
+
+    @classmethod
+    @contextmanager
+    def open(cls, zip_path):
+        """
+        Obtém o workspace com acquire=True e o libera ao final do bloco
+        """
+        workspace = cls.get(zip_path, acquire=True)
+        try:
+            yield workspace
+        finally:
+            workspace.release()
+
+    def release(self):
+        with _locked(self.directory):
+            manifest = _read_manifest(self.directory)
+            if manifest and manifest["refs"] > 0:
+                manifest["refs"] -= 1
+                _write_manifest(self.directory, manifest)
+
+    @property
+    def files(self):
+        return self.manifest["files"]
+
+    @property
+    def file_list(self):
+        return list(self.manifest["files"])
+
+    @property
+    def xml_files(self):
+        return [
+            name
+            for name in self.manifest["files"]
+            if os.path.splitext(name)[1].lower() == ".xml"
+        ]
+
+    @property
+    def base_url(self):
+        return get_file_url(dirname="", filename=os.path.basename(self.directory))
+
+    def url(self, name):
+        return get_file_url(os.path.basename(self.directory), name)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name), "rb") as fp:
+            return fp.read()
+
+    def get_xml_content(self, xml_path=None):
+        xml_path = xml_path or next(iter(self.xml_files), None)
+        if not xml_path:
+            raise PackageWithoutXMLFileError(
+                f"Package {self.zip_path} does not contain a XML file"
+            )
+        return self.read(xml_path)
+
+
+def evict(max_age=None, max_size=None, location=None):
+    """
+    Remove os workspaces que não estão em uso (refs == 0) e não são
+    acessados há mais de max_age segundos; depois, se a soma dos
+    arquivos extraídos exceder max_size, remove os menos recentes
+    """
+    max_age = WORKSPACE_MAX_AGE if max_age is None else max_age
+    max_size = WORKSPACE_MAX_SIZE if max_size is None else max_size
+    location = location or FileSystemStorage().location
+
+    now = time.time()
+    candidates = []
+    total_size = 0
+    removed = 0
+
+    for entry in os.scandir(location):
+        if not entry.name.endswith(MANIFEST_SUFFIX):
+            continue
+        directory = entry.path[: -len(MANIFEST_SUFFIX)]
+        with _locked(directory):
+            manifest = _read_manifest(directory)
+            if not manifest:
+                # já removido por outro processo: apaga o lock recriado
+                if not os.path.isdir(directory):
+                    _remove(directory)
+                continue
+            last_access = os.path.getmtime(entry.path)
+            if manifest["refs"] == 0 and now - last_access > max_age:
+                _remove(directory)
+                removed += 1
+                continue
+        total_size += manifest["size"]
+        if manifest["refs"] == 0:
+            candidates.append((last_access, directory, manifest["size"]))
+
+    if max_size:
+        for last_access, directory, size in sorted(candidates):
+            if total_size <= max_size:
+                break
+            with _locked(directory):
+                manifest = _read_manifest(directory)
+                if not manifest or manifest["refs"] > 0:
+                    continue
+                _remove(directory)
+            total_size -= size
+            removed += 1
+
+    return removed
@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+
+import packtools
+from django.conf import settings
+from packtools.validator import ValidationReportXML
+
+# arquivo de critérios usado na validação do conteúdo do XML
+VALIDATION_CRITERIA_FILE = getattr(
+    settings,
+    "UPLOAD_VALIDATION_CRITERIA_FILE",
+    "validation_criteria_example.json",
+)
+
+_lock = threading.Lock()
+# {caminho absoluto: (mtime, conteúdo do arquivo)}
+_criteria = {}
+
+
+class PreloadedValidationReportXML(ValidationReportXML):
+    """
+    ValidationReportXML para um XML já interpretado e critérios já
+    carregados, em vez dos caminhos dos arquivos
+    """
+
+    def __init__(self, xmltree, data):
+        self.xmltree = xmltree
+        self.data = data
+
+
+def get_criteria_file_path(data_file_path=None):
+    """
+    Retorna o caminho absoluto do arquivo de critérios, procurando-o
+    também no diretório de instalação do packtools
+    """
+    data_file_path = data_file_path or VALIDATION_CRITERIA_FILE
+    for path in (
+        data_file_path,
+        os.path.join(os.path.dirname(packtools.__file__), data_file_path),
+    ):
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    raise FileNotFoundError(f"Validation criteria file {data_file_path} not found")
+
+
+def get_validation_criteria(data_file_path=None):
+    """
+    Retorna os critérios de validação do arquivo JSON. O conteúdo do
+    arquivo fica em cache no processo do worker enquanto o arquivo não for
+    alterado; cada chamada retorna um novo dict, que pode ser alterado
+    sem afetar o cache nem as demais validações
+    """
+    path = get_criteria_file_path(data_file_path)
+    mtime = os.path.getmtime(path)
+
+    with _lock:
+        cached = _criteria.get(path)
+    if not cached or cached[0] != mtime:
+        with open(path) as fp:
+            content = fp.read()
+        # valida o conteúdo antes de mantê-lo em cache
+        json.loads(content)
+        cached = (mtime, content)
+        with _lock:
+            _criteria[path] = cached
+    return json.loads(cached[1])
+
+
+def get_validation_report(xmltree, data_file_path=None):
+    """
+    Executa a validação do conteúdo sobre o xmltree já interpretado,
+    com os critérios em cache em vez de reler o arquivo a cada chamada
+    """
+    return PreloadedValidationReportXML(
+        xmltree, get_validation_criteria(data_file_path)
+    ).validation_report()
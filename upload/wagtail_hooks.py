@@ -1,4 +1,5 @@
 import json
+from zipfile import BadZipFile
 
 from django.contrib import messages
 from django.http import HttpResponseRedirect
@@ -102,36 +103,18 @@ class PackageCreateView(CreateView):
 
 
 class PackageAdminInspectView(InspectView):
-    def get_optimized_package_filepath_and_directory(self):
-        # Obtém caminho do pacote otimizado
-        _path = package_utils.generate_filepath_with_new_extension(
-            self.instance.file.name,
-            ".optz",
-            True,
-        )
-
-        # Obtém diretório em que o pacote otimizado foi extraído
-        _directory = file_utils.get_file_url(
-            dirname="", filename=file_utils.get_filename_from_filepath(_path)
-        )
-
-        return _path, _directory
-
-    def set_pdf_paths(self, data, optz_dir):
+    def set_pdf_paths(self, data, workspace):
         try:
-            for rendition in package_utils.get_article_renditions_from_zipped_xml(
-                self.instance.file.name
+            document_name = package_utils.get_xml_filename(workspace.file_list)
+            for rendition in package_utils.get_article_renditions_from_workspace(
+                workspace
             ):
-                package_files = file_utils.get_file_list_from_zip(
-                    self.instance.file.name
-                )
-                document_name = package_utils.get_xml_filename(package_files)
                 rendition_name = package_utils.get_rendition_expected_name(
                     rendition, document_name
                 )
                 data["pdfs"].append(
                     {
-                        "base_uri": file_utils.os.path.join(optz_dir, rendition_name),
+                        "base_uri": workspace.url(rendition_name),
                         "language": rendition.language,
                     }
                 )
@@ -145,13 +128,24 @@ class PackageAdminInspectView(InspectView):
             "original_pkg": self.instance.file.name,
             "status": self.instance.status,
             "category": self.instance.category,
-            "languages": package_utils.get_languages(self.instance.file.name),
             "pdfs": [],
         }
 
-        optz_file_path, optz_dir = self.get_optimized_package_filepath_and_directory()
-        data["optimized_pkg"] = optz_file_path
-        self.set_pdf_paths(data, optz_dir)
+        data["optimized_pkg"] = package_utils.generate_filepath_with_new_extension(
+            self.instance.file.name,
+            ".optz",
+            True,
+        )
+        # Obtém o conteúdo extraído (e o manifesto) do pacote otimizado
+        try:
+            with package_utils.open_optimised_package_workspace(
+                self.instance.file.name
+            ) as workspace:
+                optz_dir = workspace.base_url
+                self.set_pdf_paths(data, workspace)
+        except (FileNotFoundError, BadZipFile):
+            optz_dir = ""
+        data["languages"] = [pdf["language"] for pdf in data["pdfs"]]
 
         for vr in self.instance.validationresult_set.all():
             vr_name = vr.report_name()
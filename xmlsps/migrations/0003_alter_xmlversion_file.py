@@ -0,0 +1,21 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import xmlsps.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("xmlsps", "0002_xmlissue_xmljournal_xmlversion_alter_xmlsps_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="xmlversion",
+            name="file",
+            field=models.FileField(
+                blank=True, null=True, upload_to=xmlsps.models.xml_content_path
+            ),
+        ),
+    ]
@@ -1,6 +1,10 @@
+import copy
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.db import models
 from django.db.models import Q
@@ -50,13 +54,57 @@ def xml_directory_path(instance, subdir):
     return f"xml_pid_provider/{subdir}/{instance.pid_v3[0]}/{instance.pid_v3[-1]}/{instance.pid_v3}/{instance.finger_print}.zip"
 
 
+def xml_content_path(instance, filename=None):
+    # endereçado pelo conteúdo: versões idênticas compartilham o mesmo arquivo
+    fp = instance.finger_print
+    return f"xml_pid_provider/content/{fp[:2]}/{fp[2:4]}/{fp}.zip"
+
+
+class XMLWithPreCache:
+    """
+    LRU, por processo, de XMLWithPre já obtidos dos arquivos de XMLVersion,
+    identificados por (pid_v3, finger_print)
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+        # cópia, pois quem usa o XMLWithPre pode alterá-lo (ex.: pids)
+        return None if item is None else copy.deepcopy(item)
+
+    def set(self, key, item):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._items[key] = copy.deepcopy(item)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+xml_with_pre_cache = XMLWithPreCache(
+    getattr(settings, "XMLSPS_XML_WITH_PRE_CACHE_SIZE", 128)
+)
+
+
 class XMLVersion(CommonControlField):
     """
     Tem função de guardar a versão do XML
     """
 
     pid_v3 = models.CharField(_("PID v3"), max_length=23, null=True, blank=True)
-    file = models.FileField(upload_to=xml_directory_path, null=True, blank=True)
+    file = models.FileField(upload_to=xml_content_path, null=True, blank=True)
     finger_print = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
@@ -83,25 +131,48 @@ class XMLVersion(CommonControlField):
         pid_v3 = xml_with_pre.v3
         sps_pkg_name = xml_with_pre.sps_pkg_name
         logging.info(f"XMLVersion.create({sps_pkg_name})")
-        subdir = sps_pkg_name[:9]
 
         obj = cls()
         obj.pid_v3 = pid_v3
         obj.finger_print = xml_with_pre.finger_print
         obj.creator = creator
         obj.created = datetime.utcnow()
+        obj.set_file(xml_with_pre, sps_pkg_name)
         obj.save()
-        obj.save_file(subdir, xml_with_pre.get_zip_content(f"{sps_pkg_name}.xml"))
-        obj.save()
+        xml_with_pre_cache.set((obj.pid_v3, obj.finger_print), xml_with_pre)
         return obj
 
-    def save_file(self, subdir, content):
-        self.file.save(subdir, ContentFile(content))
+    def set_file(self, xml_with_pre, sps_pkg_name):
+        """
+        Reutiliza o arquivo de outra versão com o mesmo finger_print,
+        se existir, caso contrário, grava o conteúdo
+        """
+        name = (
+            XMLVersion.objects.filter(finger_print=self.finger_print)
+            .exclude(file="")
+            .exclude(file__isnull=True)
+            .values_list("file", flat=True)
+            .first()
+        ) or xml_content_path(self)
+        if self.file.storage.exists(name):
+            self.file.name = name
+        else:
+            self.save_file(
+                name, xml_with_pre.get_zip_content(f"{sps_pkg_name}.xml"), save=False
+            )
+
+    def save_file(self, name, content, save=True):
+        self.file.save(name, ContentFile(content), save=save)
 
     @property
     def xml_with_pre(self):
+        key = (self.pid_v3, self.finger_print)
+        item = xml_with_pre_cache.get(key)
+        if item is not None:
+            return item
         try:
             for item in XMLWithPre.create(path=self.file.path):
+                xml_with_pre_cache.set(key, item)
                 return item
         except Exception as e:
             raise XMLVersionXmlWithPreError(